@@ -0,0 +1,310 @@
+"""主窗口在大量任务下的响应速度
+
+在离屏平台（QT_QPA_PLATFORM=offscreen）上创建MainWindow，用合成的DownloadProgress信号
+模拟N个同时下载的任务：每100毫秒每个任务一次progress、每秒一次speed，偶尔切换状态。
+对每个任务数报告：
+    insert_s           通过task_added添加N行的耗时（超过--max-insert秒时停止添加，inserted为实际行数）
+    latency_*_ms       事件循环延迟（10毫秒定时器的实际触发时间比预定晚多少）
+    frame_*_ms         整个窗口同步重绘一次（repaint）的耗时，每250毫秒采样
+    rss_*_mb           常驻内存：添加行之后的增量，以及压测期间的增长
+    tick_rate          实际完成的汇总周期数/秒（目标10，低于10说明界面线程处理不过来）
+    events_per_s       界面实际处理的信号数/秒
+    max_backlog        thread模式下已发出但界面还没处理的信号数峰值（积压超过一个周期的信号数时暂停发送）
+    drain_s            thread模式下停止发送后处理完积压信号的耗时
+
+两种信号来源：
+    tick    在界面线程的定时器中发出（与本进程的Downloader._tick相同，信号直接调用槽函数）
+    thread  在后台线程中发出（与RemoteDownloader、线程池中的作业相同，信号排队到界面线程）
+
+    python benchmarks/gui_scale.py --tasks 10,1000,10000 --json result.json
+    python benchmarks/gui_scale.py --mode thread --baseline result.json   # 与上次结果比较，有退化时退出码为1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtCore import QTimer  # noqa: E402
+from PyQt6.QtWidgets import QApplication  # noqa: E402
+
+from ui.main_window import MainWindow  # noqa: E402
+from utils.downloader import DownloadProgress, DownloadTask  # noqa: E402
+
+TICK = 0.1  # 与Downloader._bridge的间隔一致
+PROBE_INTERVAL = 10  # 测量事件循环延迟的定时器间隔（毫秒）
+FRAME_INTERVAL = 250  # 重绘采样间隔（毫秒）
+STATUSES = ("下载中", "已暂停", "下载中", "排队中")
+
+# 数值越小越好的指标，与基准结果比较时使用；第二项为绝对差值的下限，避免小数值的抖动被当作退化
+LOWER_IS_BETTER = {
+    "insert_s": 0.05, "latency_p50_ms": 1.0, "latency_p99_ms": 5.0, "latency_max_ms": 20.0,
+    "frame_p50_ms": 1.0, "frame_p99_ms": 5.0, "rss_rows_mb": 2.0, "rss_growth_mb": 2.0,
+    "max_backlog": 100, "drain_s": 0.05,
+}
+HIGHER_IS_BETTER = {"tick_rate": 0.5, "events_per_s": 100}
+
+
+class SyntheticDownloader:
+    """只提供MainWindow用到的接口，任务状态由压测程序直接改写"""
+
+    def __init__(self):
+        self.progress_handler = DownloadProgress()
+        self.tasks = {}
+
+    def get_task(self, task_id: str):
+        return self.tasks.get(task_id)
+
+    def get_settings(self) -> dict:
+        return {"default_thread_count": 8, "max_active_tasks": 0, "max_connections": 64,
+                "host_connection_limit": 32, "default_compression": "auto", "io_policy": "buffered",
+                "speed_limit": 0.0}
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        pass
+
+
+def rss_mb() -> float:
+    """当前进程的常驻内存（MB），不支持时返回-1"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return -1.0
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Harness:
+    """对一个任务数运行一轮压测"""
+
+    def __init__(self, app: QApplication, count: int, duration: float, mode: str, max_insert: float = 120.0):
+        self.app = app
+        self.count = count
+        self.duration = duration
+        self.mode = mode
+        self.max_insert = max_insert
+        self.downloader = SyntheticDownloader()
+        self.handler = self.downloader.progress_handler
+        self.ids = [f"task-{i:06d}" for i in range(count)]
+        self.sent = 0
+        self.handled = 0
+        self.max_backlog = 0
+        self.ticks = 0
+        self.latencies = []
+        self.frames = []
+        self._progress = {}
+        self._stop = threading.Event()
+
+    def _count(self, *args) -> None:
+        self.handled += 1
+
+    def run(self) -> dict:
+        base_rss = rss_mb()
+        window = MainWindow(self.downloader)
+        window.show()
+        for name in ("progress", "speed", "status"):
+            getattr(self.handler, name).connect(self._count)
+
+        started = time.perf_counter()
+        for i, task_id in enumerate(self.ids):
+            if i % 50 == 0 and time.perf_counter() - started > self.max_insert:
+                # 添加行太慢时只用已经添加的任务压测，避免一轮跑几个小时
+                self.ids = self.ids[:i]
+                break
+            self.downloader.tasks[task_id] = DownloadTask(url=f"http://example.com/file{i}.bin",
+                                                          save_path=f"/tmp/file{i}.bin",
+                                                          total_size=random.randint(1, 1 << 32), status="下载中")
+            self.handler.task_added.emit(task_id)
+        self.app.processEvents()
+        insert_s = time.perf_counter() - started
+        rows_rss = rss_mb()
+
+        probe = QTimer()
+        probe.setInterval(PROBE_INTERVAL)
+        last = [time.perf_counter()]
+
+        def on_probe():
+            now = time.perf_counter()
+            self.latencies.append(max(0.0, (now - last[0]) * 1000 - PROBE_INTERVAL))
+            last[0] = now
+            self.max_backlog = max(self.max_backlog, self.sent - self.handled)
+
+        probe.timeout.connect(on_probe)
+        frame = QTimer()
+        frame.setInterval(FRAME_INTERVAL)
+
+        def on_frame():
+            t = time.perf_counter()
+            window.repaint()
+            self.frames.append((time.perf_counter() - t) * 1000)
+
+        frame.timeout.connect(on_frame)
+
+        self.deadline = time.perf_counter() + self.duration
+        if self.mode == "tick":
+            ticker = QTimer()
+            ticker.setInterval(int(TICK * 1000))
+            ticker.timeout.connect(self._tick)
+            ticker.start()
+        else:
+            producer = threading.Thread(target=self._produce, daemon=True)
+            producer.start()
+        probe.start()
+        frame.start()
+        run_started = time.perf_counter()
+        while time.perf_counter() < self.deadline:
+            self.app.processEvents()
+            time.sleep(0.001)
+        run_s = time.perf_counter() - run_started
+        # 压测结束时界面线程可能还卡在一个汇总周期中，这段停顿也算作延迟
+        on_probe()
+        if self.mode == "tick":
+            ticker.stop()
+        else:
+            self._stop.set()
+            producer.join()
+
+        # 处理完积压的信号
+        drain_started = time.perf_counter()
+        drain_deadline = drain_started + max(30.0, self.duration * 6)
+        while self.handled < self.sent and time.perf_counter() < drain_deadline:
+            self.app.processEvents()
+        drain_s = time.perf_counter() - drain_started
+        probe.stop()
+        frame.stop()
+        on_frame()
+        end_rss = rss_mb()
+
+        result = {
+            "mode": self.mode,
+            "tasks": self.count,
+            "inserted": len(self.ids),
+            "seconds": round(run_s, 2),
+            "insert_s": round(insert_s, 3),
+            "latency_p50_ms": round(percentile(self.latencies, 0.5), 2),
+            "latency_p99_ms": round(percentile(self.latencies, 0.99), 2),
+            "latency_max_ms": round(max(self.latencies, default=0.0), 2),
+            "frame_p50_ms": round(percentile(self.frames, 0.5), 2),
+            "frame_p99_ms": round(percentile(self.frames, 0.99), 2),
+            "rss_rows_mb": round(rows_rss - base_rss, 1),
+            "rss_growth_mb": round(end_rss - rows_rss, 1),
+            "tick_rate": round(self.ticks / run_s, 2),
+            "events_per_s": round(self.handled / (run_s + drain_s), 1),
+            "max_backlog": self.max_backlog,
+            "drain_s": round(drain_s, 3),
+            "unhandled": self.sent - self.handled,
+        }
+        window.close()
+        window.deleteLater()
+        self.app.processEvents()
+        return result
+
+    def _emit_tick(self) -> bool:
+        """发出一个汇总周期的信号，超过压测时间时中途停止并返回False"""
+        self.ticks += 1
+        speed = self.ticks % 10 == 0
+        for i, task_id in enumerate(self.ids):
+            if i % 100 == 0 and time.perf_counter() >= self.deadline:
+                return False
+            progress = self._progress.get(task_id, 0)
+            if progress < 100 and random.random() < 0.3:
+                progress += 1
+                self._progress[task_id] = progress
+            self.handler.progress.emit(task_id, progress)
+            self.sent += 1
+            if speed:
+                self.handler.speed.emit(task_id, random.uniform(0, 20000))
+                self.sent += 1
+            if random.random() < 0.001:
+                self.handler.status.emit(task_id, random.choice(STATUSES))
+                self.sent += 1
+        return True
+
+    def _tick(self) -> None:
+        self._emit_tick()
+
+    def _produce(self) -> None:
+        next_tick = time.perf_counter()
+        while not self._stop.is_set():
+            # 界面处理不过来时等它追上，积压不会无限增长，清空积压的时间也有上限
+            while self.sent - self.handled > len(self.ids) and not self._stop.wait(0.01):
+                next_tick = time.perf_counter()
+            if self._stop.is_set() or not self._emit_tick():
+                return
+            next_tick += TICK
+            self._stop.wait(max(0.0, next_tick - time.perf_counter()))
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """与基准结果比较，返回退化的指标"""
+    previous = {(r["mode"], r["tasks"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result["mode"], result["tasks"]))
+        if old is None:
+            continue
+        for metric, floor in LOWER_IS_BETTER.items():
+            if metric in old and result[metric] > old[metric] * (1 + tolerance) and result[metric] - old[metric] > floor:
+                regressions.append({"mode": result["mode"], "tasks": result["tasks"], "metric": metric,
+                                    "baseline": old[metric], "value": result[metric]})
+        for metric, floor in HIGHER_IS_BETTER.items():
+            if metric in old and result[metric] < old[metric] * (1 - tolerance) and old[metric] - result[metric] > floor:
+                regressions.append({"mode": result["mode"], "tasks": result["tasks"], "metric": metric,
+                                    "baseline": old[metric], "value": result[metric]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="主窗口在大量任务下的响应速度")
+    parser.add_argument("--tasks", default="10,1000,10000", help="逗号分隔的任务数")
+    parser.add_argument("--duration", type=float, default=5.0, help="每轮压测的秒数")
+    parser.add_argument("--mode", default="tick", help="信号来源：tick、thread，或逗号分隔的多个")
+    parser.add_argument("--max-insert", type=float, default=120.0, help="每轮添加行的最长时间（秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="把结果另存为JSON文件")
+    parser.add_argument("--baseline", help="上次的JSON结果，指标变差超过tolerance时报告退化")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的相对变化")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    results = []
+    for mode in args.mode.split(","):
+        for count in (int(n) for n in args.tasks.split(",")):
+            result = Harness(app, count, args.duration, mode, args.max_insert).run()
+            results.append(result)
+            print(f"{mode:<6} {count:>6}个任务  添加{result['inserted']}行{result['insert_s']:.2f}s  "
+                  f"延迟p50/p99/max {result['latency_p50_ms']:.1f}/{result['latency_p99_ms']:.1f}/"
+                  f"{result['latency_max_ms']:.0f}ms  重绘p50/p99 {result['frame_p50_ms']:.1f}/"
+                  f"{result['frame_p99_ms']:.1f}ms  内存+{result['rss_rows_mb']:.0f}MB/+{result['rss_growth_mb']:.0f}MB  "
+                  f"周期{result['tick_rate']:.1f}/s  信号{result['events_per_s']:.0f}/s  "
+                  f"积压{result['max_backlog']}  清空{result['drain_s']:.2f}s", flush=True)
+
+    report = {"results": results, "regressions": []}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(results, baseline.get("results", baseline), args.tolerance)
+        for item in report["regressions"]:
+            print(f"退化：{item['mode']} {item['tasks']}个任务 {item['metric']} {item['baseline']} -> {item['value']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if report["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
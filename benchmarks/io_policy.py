@@ -0,0 +1,168 @@
+"""比较DiskWriter各I/O策略对系统页缓存和持续写入速度的影响
+
+按下载时的方式（多个分片交错提交256KB缓冲区）写入一个大文件，期间每0.2秒采样
+/proc/meminfo，报告每种策略的写入速度、页缓存（Cached）和脏页（Dirty+Writeback）
+的峰值增量，以及写完后仍留在页缓存中的字节数。
+
+    python benchmarks/io_policy.py --size 8G --dir /data/tmp
+    python benchmarks/io_policy.py --size 2G --policies streaming,direct --json result.json
+
+测试文件应放在真实磁盘上（tmpfs不经过回写，也不支持O_DIRECT）。
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.disk_writer import DiskWriter, IOPolicy  # noqa: E402
+
+BUFFER_SIZE = 256 * 1024  # 与ChunkDownloader.write_buffer_size一致
+
+
+def parse_size(text: str) -> int:
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def meminfo() -> dict:
+    """读取/proc/meminfo中的页缓存相关字段（字节）"""
+    values = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            if key in ("Cached", "Dirty", "Writeback", "MemAvailable"):
+                values[key] = int(value.split()[0]) * 1024
+    return values
+
+
+def resident_bytes(path: str) -> int:
+    """用mincore统计文件仍在页缓存中的字节数，不支持时返回-1"""
+    libc_name = ctypes.util.find_library("c")
+    size = os.path.getsize(path)
+    if not libc_name or size == 0:
+        return -1
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+    libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+    page = mmap.PAGESIZE
+    resident = 0
+    window = 1024 * 1024 * 1024  # 分段映射，避免一次映射整个大文件
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for start in range(0, size, window):
+            length = min(window, size - start)
+            address = libc.mmap(None, length, mmap.PROT_READ, mmap.MAP_SHARED, fd, start)
+            if address in (None, ctypes.c_void_p(-1).value):
+                return -1
+            try:
+                vec = (ctypes.c_ubyte * ((length + page - 1) // page))()
+                if libc.mincore(address, length, vec) != 0:
+                    return -1
+                resident += sum(v & 1 for v in vec) * page
+            finally:
+                libc.munmap(address, length)
+    finally:
+        os.close(fd)
+    return resident
+
+
+def run(policy: str, path: str, size: int, chunks: int) -> dict:
+    """用指定策略写入size字节，chunks个分片交错提交"""
+    writer = DiskWriter(io_policy=policy)
+    writer.preallocate(path, size)
+    data = os.urandom(BUFFER_SIZE)
+    piece = (size + chunks - 1) // chunks
+    offsets = [i * piece for i in range(chunks)]
+
+    base = meminfo()
+    peak = {"Cached": 0, "Dirty": 0}
+    low_available = base.get("MemAvailable", 0)
+    stop = threading.Event()
+
+    def sample():
+        nonlocal low_available
+        while not stop.is_set():
+            now = meminfo()
+            peak["Cached"] = max(peak["Cached"], now["Cached"] - base["Cached"])
+            dirty = now["Dirty"] + now["Writeback"] - base["Dirty"] - base["Writeback"]
+            peak["Dirty"] = max(peak["Dirty"], dirty)
+            low_available = min(low_available, now.get("MemAvailable", 0))
+            stop.wait(0.2)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.time()
+    active = True
+    while active:
+        active = False
+        for i in range(chunks):
+            end = min(size, (i + 1) * piece)
+            if offsets[i] >= end:
+                continue
+            active = True
+            n = min(BUFFER_SIZE, end - offsets[i])
+            writer.submit(path, offsets[i], data[:n])
+            offsets[i] += n
+    writer.close(path)
+    elapsed = time.time() - started
+    stop.set()
+    sampler.join()
+    stats = writer.get_stats()
+    writer.shutdown()
+
+    result = {
+        "policy": policy,
+        "size": size,
+        "seconds": round(elapsed, 2),
+        "mb_per_s": round(size / 1024 / 1024 / elapsed, 1),
+        "peak_cached_mb": round(peak["Cached"] / 1024 / 1024, 1),
+        "peak_dirty_mb": round(peak["Dirty"] / 1024 / 1024, 1),
+        "min_available_mb": round(low_available / 1024 / 1024, 1),
+        "resident_after_mb": round(resident_bytes(path) / 1024 / 1024, 1),
+        "direct_mb": round(stats.direct_bytes / 1024 / 1024, 1),
+        "dropped_mb": round(stats.dropped_bytes / 1024 / 1024, 1),
+    }
+    os.remove(path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较DiskWriter的I/O策略")
+    parser.add_argument("--size", default="2G", help="写入的文件大小，如512M、8G")
+    parser.add_argument("--dir", default=".", help="测试文件所在目录（应在真实磁盘上）")
+    parser.add_argument("--chunks", type=int, default=8, help="交错写入的分片数")
+    parser.add_argument("--policies", default=",".join(IOPolicy.ALL), help="逗号分隔的策略列表")
+    parser.add_argument("--json", help="把结果另存为JSON文件")
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    results = []
+    for policy in args.policies.split(","):
+        path = os.path.join(args.dir, f"io_policy_{policy}.bin")
+        # 每轮之前把上一轮的脏页写回，避免互相影响
+        os.sync()
+        result = run(policy, path, size, args.chunks)
+        results.append(result)
+        print(f"{policy:<10} {result['mb_per_s']:>8.1f} MB/s  页缓存峰值+{result['peak_cached_mb']:.0f}MB  "
+              f"脏页峰值+{result['peak_dirty_mb']:.0f}MB  写完后驻留{result['resident_after_mb']:.0f}MB  "
+              f"O_DIRECT {result['direct_mb']:.0f}MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""RangeSet在大量区间下的性能
+
+模拟下载状态的几种变化方式，每种操作报告总耗时和每次操作的平均微秒数：
+    append     按顺序追加相邻的写入（正常下载，集合始终只有少数几个区间）
+    scatter    按随机顺序写入互不相邻的块，得到n个区间（多来源、乱序完成）
+    query      在n个区间上做contiguous_from、covers和largest_gap查询
+    punch      随机挖掉小段（校验失败后重新下载），每次把一个区间拆成两段
+    fill       按随机顺序补齐所有空洞，最后合并成一个区间
+    serialize  to_bytes/from_bytes，另报告编码后每个区间的字节数
+
+    python benchmarks/rangeset.py --ranges 1000000
+    python benchmarks/rangeset.py --ranges 100000,1000000,3000000 --json result.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rangeset import RangeSet  # noqa: E402
+
+BLOCK = 16 * 1024  # 每次写入的大小，与区间数无关，只影响偏移的数值范围
+
+
+def timed(results: dict, name: str, ops: int, func):
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+    results[name] = {"ops": ops, "seconds": round(seconds, 3), "us_per_op": round(seconds / max(1, ops) * 1e6, 3)}
+    print(f"  {name:<14}{ops:>10}次  {seconds:8.2f}秒  {results[name]['us_per_op']:8.2f}微秒/次")
+    return value
+
+
+def run(n: int, seed: int) -> dict:
+    rnd = random.Random(seed)
+    results = {"ranges": n}
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def append():
+        ranges = RangeSet()
+        for i in range(n):
+            ranges.add(i * BLOCK, (i + 1) * BLOCK)
+        return ranges
+    ranges = timed(results, "append", n, append)
+    assert len(ranges) == 1
+
+    # 偶数号的块，写完后两两之间各有一个空洞
+    order = list(range(0, 2 * n, 2))
+    rnd.shuffle(order)
+
+    def scatter():
+        ranges = RangeSet()
+        for k in order:
+            ranges.add(k * BLOCK, (k + 1) * BLOCK)
+        return ranges
+    ranges = timed(results, "scatter", n, scatter)
+    assert len(ranges) == n
+    results["rss_mb"] = round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1)
+    size = 2 * n * BLOCK
+
+    probes = [rnd.randrange(size) for _ in range(min(n, 1000000))]
+    timed(results, "contiguous_from", len(probes), lambda: [ranges.contiguous_from(x) for x in probes])
+    timed(results, "covers", len(probes), lambda: [ranges.covers(x, x + BLOCK // 2) for x in probes])
+    timed(results, "largest_gap", len(probes), lambda: [ranges.largest_gap(size) for _ in probes])
+
+    data = timed(results, "to_bytes", n, ranges.to_bytes)
+    restored = timed(results, "from_bytes", n, lambda: RangeSet.from_bytes(data))
+    assert restored == ranges
+    results["encoded_bytes"] = len(data)
+    results["bytes_per_range"] = round(len(data) / n, 3)
+
+    # 在区间中间挖掉1KB，区间数增加
+    punches = [k * BLOCK + rnd.randrange(1, BLOCK - 1024) for k in rnd.sample(range(0, 2 * n, 2), min(n, 1000000))]
+
+    def punch():
+        for offset in punches:
+            ranges.remove(offset, offset + 1024)
+            ranges.largest_gap(size)
+    timed(results, "punch", len(punches), punch)
+    assert len(ranges) == n + len(punches)
+
+    holes = ranges.gaps(0, size)
+    rnd.shuffle(holes)
+
+    def fill():
+        for start, end in holes:
+            ranges.add(start, end)
+    timed(results, "fill", len(holes), fill)
+    assert len(ranges) == 1 and ranges.covered == size
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RangeSet在大量区间下的性能")
+    parser.add_argument("--ranges", default="1000000", help="逗号分隔的区间数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="把结果另存为JSON文件")
+    args = parser.parse_args()
+
+    results = []
+    for n in [int(x) for x in args.ranges.split(",")]:
+        print(f"{n}个区间：")
+        result = run(n, args.seed)
+        print(f"  编码后{result['encoded_bytes']}字节（每个区间{result['bytes_per_range']}字节），"
+              f"内存增加约{result['rss_mb']}MB")
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
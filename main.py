@@ -1,14 +1,45 @@
+import time
+_start_time = time.perf_counter()  # 用于统计启动耗时，必须在其他导入之前
+
+import argparse
 import sys
 from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QTimer
 from ui.main_window import MainWindow
+from utils.network import preload
 
 def main():
+    parser = argparse.ArgumentParser(description="多线程下载器")
+    parser.add_argument("--connect", nargs="?", const="127.0.0.1:8790", metavar="地址",
+                        help="作为客户端连接下载守护进程（python -m utils.daemon serve），不在本进程中下载")
+    parser.add_argument("--token", default="", help="守护进程的X-Token")
+    args, qt_args = parser.parse_known_args()
+
     # 创建应用实例
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
+    
+    downloader = None
+    if args.connect:
+        from utils.daemon import RemoteDownloader
+        try:
+            downloader = RemoteDownloader(args.connect, args.token)
+        except Exception as e:
+            print(f"无法连接下载守护进程 {args.connect}：{str(e)}")
+            sys.exit(1)
     
     # 创建主窗口
-    window = MainWindow()
+    window = MainWindow(downloader)
+    if args.connect:
+        window.setWindowTitle(f"多线程下载器（守护进程 {args.connect}）")
     window.show()
+
+    # 显示启动耗时（各模块的导入耗时可用 python -X importtime main.py 查看）
+    startup_ms = (time.perf_counter() - _start_time) * 1000
+    window.statusBar.showMessage(f"就绪（启动耗时 {startup_ms:.0f} ms）")
+    print(f"启动耗时：{startup_ms:.0f} ms")
+
+    # 窗口显示后再在后台导入网络库
+    QTimer.singleShot(0, preload)
     
     # 运行应用
     sys.exit(app.exec())
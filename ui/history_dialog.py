@@ -0,0 +1,163 @@
+from datetime import datetime
+
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLineEdit, QComboBox,
+                             QTableView, QPushButton, QLabel, QHeaderView, QMessageBox,
+                             QAbstractItemView)
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
+
+
+class HistoryModel(QAbstractTableModel):
+    """下载历史表格模型
+
+    只保留已经滚动到的行，视图滚到底部时通过fetchMore按游标再取一页，
+    打开时只查询第一页，与历史总条数无关。
+    """
+
+    HEADERS = ["文件名", "大小", "状态", "完成时间", "保存位置", "URL"]
+    PAGE_SIZE = 200
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.records = []
+        self.query = ""
+        self.status = ""
+        self._exhausted = False
+
+    def set_filter(self, query: str, status: str):
+        """修改查询条件后从第一页重新加载"""
+        self.beginResetModel()
+        self.query = query
+        self.status = status
+        self.records = []
+        self._exhausted = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.records)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        after = (self.records[-1].finished_at, self.records[-1].id) if self.records else None
+        page = self.store.page(after, self.PAGE_SIZE, self.query, self.status)
+        if len(page) < self.PAGE_SIZE:
+            self._exhausted = True
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.records), len(self.records) + len(page) - 1)
+            self.records.extend(page)
+            self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self.records[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            column = index.column()
+            if column == 0:
+                return record.filename
+            if column == 1:
+                return _format_size(record.size) if record.size else "--"
+            if column == 2:
+                return record.status
+            if column == 3:
+                return datetime.fromtimestamp(record.finished_at).strftime("%Y-%m-%d %H:%M:%S")
+            if column == 4:
+                return record.save_path
+            return record.url
+        if role == Qt.ItemDataRole.ToolTipRole and record.error:
+            return record.error
+        return None
+
+
+def _format_size(size: float) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} PB"
+
+
+class HistoryDialog(QDialog):
+    """下载历史对话框"""
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.setWindowTitle("下载历史")
+        self.setMinimumSize(800, 500)
+        self.setup_ui()
+        self._apply_filter()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+
+        # 搜索栏：输入文件名或URL开头的部分，停止输入后再查询
+        filter_layout = QHBoxLayout()
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("按文件名或URL开头搜索")
+        self.status_combo = QComboBox()
+        self.status_combo.addItems(["全部", "已完成", "错误", "已取消"])
+        filter_layout.addWidget(self.search_input, stretch=1)
+        filter_layout.addWidget(self.status_combo)
+        layout.addLayout(filter_layout)
+
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(300)
+        self._search_timer.timeout.connect(self._apply_filter)
+        self.search_input.textChanged.connect(lambda: self._search_timer.start())
+        self.status_combo.currentIndexChanged.connect(self._apply_filter)
+
+        self.model = HistoryModel(self.store, self)
+        self.view = QTableView()
+        self.view.setModel(self.model)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.view.verticalHeader().setVisible(False)
+        # 固定行高和列宽，避免按内容计算尺寸时遍历所有行
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Interactive)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        self.view.setColumnWidth(0, 200)
+        self.view.setColumnWidth(3, 150)
+        self.view.setColumnWidth(4, 200)
+        layout.addWidget(self.view)
+
+        button_layout = QHBoxLayout()
+        self.count_label = QLabel()
+        button_layout.addWidget(self.count_label)
+        button_layout.addStretch()
+
+        clear_btn = QPushButton("清空历史")
+        clear_btn.clicked.connect(self._clear)
+        close_btn = QPushButton("关闭")
+        close_btn.clicked.connect(self.close)
+        button_layout.addWidget(clear_btn)
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+
+    def _apply_filter(self):
+        status = self.status_combo.currentText()
+        status = "" if status == "全部" else status
+        query = self.search_input.text().strip()
+        self.model.set_filter(query, status)
+        self.count_label.setText(f"共 {self.store.count(query, status)} 条")
+
+    def _clear(self):
+        if QMessageBox.question(self, "清空历史", "确定要清空所有下载历史吗？") \
+                == QMessageBox.StandardButton.Yes:
+            self.store.clear()
+            self._apply_filter()
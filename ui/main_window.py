@@ -2,16 +2,18 @@ from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QPushButton,
                              QProgressBar, QLineEdit, QFileDialog, QMessageBox,
                              QTableWidget, QTableWidgetItem, QHBoxLayout, QHeaderView,
                              QLabel, QSpinBox, QStyle, QMenu, QMenuBar, QStatusBar,
-                             QStyleFactory, QDialog)
-from PyQt6.QtCore import Qt, QSize
+                             QStyleFactory, QDialog, QComboBox)
+from PyQt6.QtCore import Qt, QSize, QTimer
 from PyQt6.QtGui import QAction, QIcon, QPalette, QColor, QActionGroup
 from utils.downloader import Downloader
+from ui.segment_map import SegmentMapWidget
 import uuid
 from datetime import datetime
 import os
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, downloader=None):
+        """downloader为None时在本进程中创建下载引擎，也可以传入连接守护进程的RemoteDownloader"""
         super().__init__()
         self.setWindowTitle("多线程下载器")
         self.setMinimumSize(1000, 600)
@@ -22,12 +24,18 @@ class MainWindow(QMainWindow):
         self._set_dark_theme()
         
         # 创建下载器实例
-        self.downloader = Downloader()
+        self.downloader = downloader if downloader is not None else Downloader()
         self.downloader.progress_handler.progress.connect(self.update_progress)
         self.downloader.progress_handler.status.connect(self.update_status)
         self.downloader.progress_handler.speed.connect(self.update_speed)
         self.downloader.progress_handler.completed.connect(self.download_completed)
         self.downloader.progress_handler.error.connect(self.show_error)
+        self.downloader.progress_handler.sync_finished.connect(self.sync_finished)
+        self.downloader.progress_handler.task_archived.connect(self.task_archived)
+        self.downloader.progress_handler.bulk_status.connect(self.update_bulk_status)
+        self.downloader.progress_handler.task_added.connect(self.task_added)
+        self.downloader.progress_handler.url_probed.connect(self.url_probed)
+        self.batch_schedule = "fifo"  # 批量下载的调度顺序
         
         # 创建菜单栏
         self._create_menu_bar()
@@ -51,6 +59,13 @@ class MainWindow(QMainWindow):
         self.url_input.setPlaceholderText("输入URL或将多个URL粘贴到此处（每行一个）")
         url_layout.addWidget(url_label)
         url_layout.addWidget(self.url_input)
+        
+        # 停止输入后提前探测URL，选择保存位置时连接和文件信息已经就绪
+        self._warm_up_timer = QTimer(self)
+        self._warm_up_timer.setSingleShot(True)
+        self._warm_up_timer.setInterval(400)
+        self._warm_up_timer.timeout.connect(self._warm_up)
+        self.url_input.textChanged.connect(lambda: self._warm_up_timer.start())
         control_layout.addLayout(url_layout, stretch=4)
         
         # 限速控制
@@ -104,6 +119,18 @@ class MainWindow(QMainWindow):
         batch_action.triggered.connect(self.batch_download)
         file_menu.addAction(batch_action)
         
+        # 增量同步动作
+        sync_action = QAction("同步下载（只下载有变化的文件）", self)
+        sync_action.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_BrowserReload))
+        sync_action.triggered.connect(lambda: self.batch_download(sync=True))
+        file_menu.addAction(sync_action)
+        
+        # 下载历史动作
+        history_action = QAction("下载历史", self)
+        history_action.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogDetailedView))
+        history_action.triggered.connect(self.show_history)
+        file_menu.addAction(history_action)
+        
         file_menu.addSeparator()
         
         # 退出动作
@@ -112,6 +139,24 @@ class MainWindow(QMainWindow):
         exit_action.triggered.connect(self.close)
         file_menu.addAction(exit_action)
         
+        # 任务菜单：对所有任务的批量操作，一次完成，不阻塞界面
+        task_menu = menubar.addMenu("任务")
+        
+        pause_all_action = QAction("全部暂停", self)
+        pause_all_action.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPause))
+        pause_all_action.triggered.connect(lambda: self.downloader.pause_tasks())
+        task_menu.addAction(pause_all_action)
+        
+        resume_all_action = QAction("全部继续", self)
+        resume_all_action.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPlay))
+        resume_all_action.triggered.connect(lambda: self.downloader.resume_tasks())
+        task_menu.addAction(resume_all_action)
+        
+        cancel_all_action = QAction("全部取消", self)
+        cancel_all_action.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaStop))
+        cancel_all_action.triggered.connect(lambda: self.downloader.cancel_tasks())
+        task_menu.addAction(cancel_all_action)
+        
         # 设置菜单
         settings_menu = menubar.addMenu("设置")
         
@@ -155,6 +200,39 @@ class MainWindow(QMainWindow):
         theme_group.addAction(dark_action)
         theme_group.addAction(light_action)
         theme_group.setExclusive(True)
+        
+        settings = self.downloader.get_settings()
+        
+        # 传输压缩菜单
+        compression_menu = settings_menu.addMenu("传输压缩")
+        compression_group = QActionGroup(self)
+        compression_group.setExclusive(True)
+        for mode, text in (("auto", "自动（比较压缩单连接和分段下载）"), ("on", "总是请求压缩"), ("off", "不压缩")):
+            action = QAction(text, self)
+            action.setCheckable(True)
+            action.setChecked(settings["default_compression"] == mode)
+            action.triggered.connect(lambda checked, mode=mode: self.set_compression(mode))
+            compression_group.addAction(action)
+            compression_menu.addAction(action)
+        
+        # 写盘缓存菜单（大文件不占满系统页缓存）
+        io_menu = settings_menu.addMenu("写盘缓存")
+        io_group = QActionGroup(self)
+        io_group.setExclusive(True)
+        for policy, text in (("buffered", "使用系统缓存"), ("streaming", "落盘后释放缓存（适合大文件）"),
+                             ("direct", "直接写盘（O_DIRECT）")):
+            action = QAction(text, self)
+            action.setCheckable(True)
+            action.setChecked(settings["io_policy"] == policy)
+            action.triggered.connect(lambda checked, policy=policy: self.set_io_policy(policy))
+            io_group.addAction(action)
+            io_menu.addAction(action)
+        
+        # 性能分析动作（勾选时开始采样，取消勾选时写出结果）
+        profile_action = QAction("性能分析", self)
+        profile_action.setCheckable(True)
+        profile_action.toggled.connect(self.toggle_profiling)
+        settings_menu.addAction(profile_action)
     
     def _set_dark_theme(self):
         """设置深色主题"""
@@ -213,14 +291,15 @@ class MainWindow(QMainWindow):
             # 批量下载
             save_dir = QFileDialog.getExistingDirectory(self, "选择保存目录")
             if save_dir:
-                self.downloader.add_batch_tasks(urls, save_dir)
+                self.downloader.add_batch_tasks(urls, save_dir, schedule=self.batch_schedule)
                 self.url_input.clear()
                 self.statusBar.showMessage(f"已添加 {len(urls)} 个下载任务")
         else:
             # 单个下载
             url = urls[0]
-            # 从URL中获取文件名
-            filename = url.split('/')[-1]
+            # 优先使用预先探测得到的文件名（Content-Disposition），否则从URL中获取
+            probe = self.downloader.probe_cache.get(url)
+            filename = os.path.basename(probe.filename) if probe is not None and probe.filename else url.split('/')[-1]
             if not filename:
                 filename = 'download_' + str(uuid.uuid4())[:8]
             
@@ -240,8 +319,22 @@ class MainWindow(QMainWindow):
                 self.url_input.clear()
                 self.statusBar.showMessage("已添加下载任务")
     
-    def batch_download(self):
-        """批量下载"""
+    def _warm_up(self):
+        """输入框中是单个URL时提前探测"""
+        url = self.url_input.text().strip()
+        if url and '\n' not in url and url.lower().startswith(('http://', 'https://')):
+            self.downloader.warm_up(url)
+    
+    def url_probed(self, url: str, probe):
+        """预先探测完成，在状态栏显示文件信息"""
+        if self.url_input.text().strip() != url:
+            return
+        size_text = self._format_size(probe.total_size) if probe.total_size > 0 else "大小未知"
+        ranges_text = "支持断点续传" if probe.accept_ranges else "不支持断点续传"
+        self.statusBar.showMessage(f"{probe.filename or url}：{size_text}，{ranges_text}")
+    
+    def batch_download(self, sync: bool = False):
+        """批量下载，sync为True时只下载新增和有变化的文件"""
         file_path, _ = QFileDialog.getOpenFileName(
             self, "选择URL列表文件", "", "文本文件 (*.txt)"
         )
@@ -252,27 +345,43 @@ class MainWindow(QMainWindow):
                 if urls:
                     save_dir = QFileDialog.getExistingDirectory(self, "选择保存目录")
                     if save_dir:
-                        self.downloader.add_batch_tasks(urls, save_dir)
-                        self.statusBar.showMessage(f"已添加 {len(urls)} 个下载任务")
+                        self.downloader.add_batch_tasks(urls, save_dir, sync=sync, schedule=self.batch_schedule)
+                        if sync:
+                            self.statusBar.showMessage(f"正在检查 {len(urls)} 个文件是否有变化")
+                        else:
+                            self.statusBar.showMessage(f"已添加 {len(urls)} 个下载任务")
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"读取文件失败：{str(e)}")
     
     def _add_task_to_table(self, url: str, save_path: str):
         """添加任务到下载列表"""
         task_id = str(uuid.uuid4())
+        self._insert_task_row(task_id, os.path.basename(save_path))
         
+        # 开始下载（分片进度由详情对话框中的分段图定时读取，不再逐条处理信号）
+        self.downloader.add_task(task_id, url, save_path)
+    
+    def task_added(self, task_id: str):
+        """批量下载和同步创建的任务，预检过的任务直接显示文件大小"""
+        task = self.downloader.get_task(task_id)
+        if task is None or self.find_row_by_task_id(task_id) >= 0:
+            return
+        size_text = self._format_size(task.total_size) if task.total_size > 0 else "计算中"
+        self._insert_task_row(task_id, os.path.basename(task.save_path), size_text, task.status)
+    
+    def _insert_task_row(self, task_id: str, filename: str, size_text: str = "计算中", status: str = "等待中"):
+        """在下载列表末尾添加一行"""
         # 添加到下载列表
         row_position = self.download_table.rowCount()
         self.download_table.insertRow(row_position)
         
         # 设置文件名
-        filename = os.path.basename(save_path)
         self.download_table.setItem(row_position, 0, QTableWidgetItem(filename))
         
         # 设置初始状态
-        self.download_table.setItem(row_position, 1, QTableWidgetItem("计算中"))
+        self.download_table.setItem(row_position, 1, QTableWidgetItem(size_text))
         self.download_table.setItem(row_position, 2, QTableWidgetItem("0%"))
-        self.download_table.setItem(row_position, 3, QTableWidgetItem("等待中"))
+        self.download_table.setItem(row_position, 3, QTableWidgetItem(status))
         self.download_table.setItem(row_position, 4, QTableWidgetItem("0 KB/s"))
         
         # 添加控制按钮
@@ -339,11 +448,6 @@ class MainWindow(QMainWindow):
         
         # 保存任务ID
         self.download_table.setItem(row_position, 6, QTableWidgetItem(task_id))
-        
-        # 开始下载
-        worker = self.downloader.add_task(task_id, url, save_path)
-        worker.chunk_progress.connect(lambda tid, idx, prog, spd, st: 
-            self.update_chunk_progress(tid, idx, prog, spd, st))
 
     def show_task_detail(self, task_id: str):
         """显示任务详情对话框"""
@@ -358,59 +462,38 @@ class MainWindow(QMainWindow):
         
         layout = QVBoxLayout(dialog)
         
-        # 创建线程状态表格
-        table = QTableWidget()
-        table.setColumnCount(4)
-        table.setHorizontalHeaderLabels(["线程", "进度", "速度", "状态"])
-        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-        table.setRowCount(len(task.chunks))
-        table.setAlternatingRowColors(True)  # 设置交替行颜色
-        
-        # 设置表格样式
-        table.setStyleSheet("""
-            QTableWidget {
-                gridline-color: #d3d3d3;
-                border: 1px solid #d3d3d3;
-            }
-            QTableWidget::item {
-                padding: 5px;
-            }
-            QHeaderView::section {
-                background-color: #f0f0f0;
-                padding: 5px;
-                border: 1px solid #d3d3d3;
-                font-weight: bold;
-            }
-        """)
-        
-        # 保存表格引用以便更新
-        task.detail_table = table
-        
-        # 初始化表格数据
-        for i, chunk in enumerate(task.chunks):
-            # 线程列
-            thread_item = QTableWidgetItem(f"线程 {i+1}")
-            thread_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            table.setItem(i, 0, thread_item)
-            
-            # 进度列
-            progress = int((chunk.downloaded / (chunk.end - chunk.start + 1)) * 100)
-            progress_item = QTableWidgetItem(f"{progress}%")
-            progress_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            table.setItem(i, 1, progress_item)
-            
-            # 速度列
-            speed_item = QTableWidgetItem("0 KB/s")
-            speed_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            table.setItem(i, 2, speed_item)
-            
-            # 状态列
-            status_item = QTableWidgetItem(chunk.status)
-            status_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            self._set_status_color(status_item, chunk.status)
-            table.setItem(i, 3, status_item)
+        # 分段进度图，定时重绘，不再为每个分片维护表格行
+        segment_map = SegmentMapWidget(task, dialog)
+        layout.addWidget(segment_map, stretch=1)
+        
+        # 图例
+        legend_layout = QHBoxLayout()
+        for text, color in (("已下载", SegmentMapWidget.DONE_COLOR),
+                            ("下载中", SegmentMapWidget.ACTIVE_COLOR),
+                            ("未下载", SegmentMapWidget.MISSING_COLOR),
+                            ("错误", SegmentMapWidget.ERROR_COLOR)):
+            legend = QLabel(f"■ {text}")
+            legend.setStyleSheet(f"color: {color.name()};")
+            legend_layout.addWidget(legend)
+        legend_layout.addStretch()
+        layout.addLayout(legend_layout)
+        
+        # 汇总信息，与分段图使用同一个定时器刷新
+        summary_label = QLabel()
+        layout.addWidget(summary_label)
+        
+        def update_summary():
+            chunks = list(task.chunks)
+            active = sum(1 for chunk in chunks if chunk.status == "下载中")
+            progress = int(task.downloaded_size / task.total_size * 100) if task.total_size > 0 else 0
+            eta = self._format_eta(task.eta) if task.eta is not None else "--"
+            summary_label.setText(
+                f"进度：{progress}%    分段：{len(chunks)}    活动连接：{active}    "
+                f"速度：{task.speed:.1f} KB/s    剩余时间：{eta}    状态：{task.status}"
+            )
         
-        layout.addWidget(table)
+        update_summary()
+        segment_map.timer.timeout.connect(update_summary)
         
         # 添加关闭按钮
         close_btn = QPushButton("关闭")
@@ -425,45 +508,9 @@ class MainWindow(QMainWindow):
         
         layout.addLayout(btn_layout)
         
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
         dialog.show()
     
-    def _set_status_color(self, item: QTableWidgetItem, status: str):
-        """设置状态颜色"""
-        if status == "下载中":
-            item.setForeground(QColor(0, 128, 0))  # 绿色
-        elif status == "已暂停":
-            item.setForeground(QColor(128, 128, 0))  # 黄色
-        elif status == "已完成":
-            item.setForeground(QColor(0, 0, 255))  # 蓝色
-        elif status == "错误":
-            item.setForeground(QColor(255, 0, 0))  # 红色
-    
-    def update_chunk_progress(self, task_id: str, chunk_index: int, progress: int, speed: float, status: str):
-        """更新线程进度"""
-        task = self.downloader.get_task(task_id)
-        if not task or not hasattr(task, 'detail_table'):
-            return
-        
-        table = task.detail_table
-        if not table or chunk_index >= table.rowCount():
-            return
-        
-        # 更新进度
-        progress_item = QTableWidgetItem(f"{progress}%")
-        progress_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-        table.setItem(chunk_index, 1, progress_item)
-        
-        # 更新速度
-        speed_item = QTableWidgetItem(f"{speed:.1f} KB/s")
-        speed_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-        table.setItem(chunk_index, 2, speed_item)
-        
-        # 更新状态
-        status_item = QTableWidgetItem(status)
-        status_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-        self._set_status_color(status_item, status)
-        table.setItem(chunk_index, 3, status_item)
-    
     def set_speed_limit(self, speed: int):
         """设置下载限速"""
         self.downloader.set_speed_limit(float(speed))
@@ -489,54 +536,69 @@ class MainWindow(QMainWindow):
         """更新状态"""
         row = self.find_row_by_task_id(task_id)
         if row >= 0:
-            self.download_table.setItem(row, 3, QTableWidgetItem(status))
+            self._set_row_status(row, status)
+    
+    def update_bulk_status(self, task_ids: list, status: str):
+        """批量更新状态，只遍历一次下载列表"""
+        wanted = set(task_ids)
+        for row in range(self.download_table.rowCount()):
+            item = self.download_table.item(row, 6)
+            if item is not None and item.text() in wanted:
+                self._set_row_status(row, status)
+        self.statusBar.showMessage(f"{len(task_ids)} 个任务{status}")
+    
+    def _set_row_status(self, row: int, status: str):
+        """设置一行的状态文本和暂停/继续按钮"""
+        self.download_table.setItem(row, 3, QTableWidgetItem(status))
+        
+        # 更新暂停/继续按钮文本和样式
+        control_widget = self.download_table.cellWidget(row, 5)
+        if not control_widget:
+            return
             
-            # 更新暂停/继续按钮文本和样式
-            control_widget = self.download_table.cellWidget(row, 5)
-            if not control_widget:
-                return
-                
-            pause_btn = control_widget.layout().itemAt(0).widget()
-            if status == "已暂停":
-                pause_btn.setText("▶️ 继续")
-                pause_btn.setStyleSheet("""
-                    QPushButton {
-                        background-color: #FF9800;
-                        color: white;
-                        border: none;
-                        padding: 5px 10px;
-                        border-radius: 3px;
-                        min-width: 80px;
-                    }
-                    QPushButton:hover {
-                        background-color: #F57C00;
-                    }
-                """)
-            elif status == "下载中":
-                pause_btn.setText("⏸️ 暂停")
-                pause_btn.setStyleSheet("""
-                    QPushButton {
-                        background-color: #2196F3;
-                        color: white;
-                        border: none;
-                        padding: 5px 10px;
-                        border-radius: 3px;
-                        min-width: 80px;
-                    }
-                    QPushButton:hover {
-                        background-color: #1976D2;
-                    }
-                """)
+        pause_btn = control_widget.layout().itemAt(0).widget()
+        if status == "已暂停":
+            pause_btn.setText("▶️ 继续")
+            pause_btn.setStyleSheet("""
+                QPushButton {
+                    background-color: #FF9800;
+                    color: white;
+                    border: none;
+                    padding: 5px 10px;
+                    border-radius: 3px;
+                    min-width: 80px;
+                }
+                QPushButton:hover {
+                    background-color: #F57C00;
+                }
+            """)
+        elif status in ("下载中", "排队中"):
+            pause_btn.setText("⏸️ 暂停")
+            pause_btn.setStyleSheet("""
+                QPushButton {
+                    background-color: #2196F3;
+                    color: white;
+                    border: none;
+                    padding: 5px 10px;
+                    border-radius: 3px;
+                    min-width: 80px;
+                }
+                QPushButton:hover {
+                    background-color: #1976D2;
+                }
+            """)
     
     def update_speed(self, task_id: str, speed: float):
         """更新下载速度"""
         row = self.find_row_by_task_id(task_id)
         if row >= 0:
+            task = self.downloader.get_task(task_id)
             speed_text = f"{speed:.1f} KB/s"
+            if task and task.eta is not None:
+                speed_text += f"  剩余{self._format_eta(task.eta)}"
             self.download_table.setItem(row, 4, QTableWidgetItem(speed_text))
             
             # 更新文件大小
-            task = self.downloader.get_task(task_id)
             if task and task.total_size > 0:
                 size_text = self._format_size(task.total_size)
                 self.download_table.setItem(row, 1, QTableWidgetItem(size_text))
@@ -549,6 +611,18 @@ class MainWindow(QMainWindow):
             size /= 1024
         return f"{size:.1f} PB"
     
+    def _format_eta(self, seconds: float) -> str:
+        """格式化剩余时间"""
+        seconds = int(seconds)
+        if seconds >= 3600:
+            return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+        return f"{seconds // 60}:{seconds % 60:02d}"
+    
+    def closeEvent(self, event):
+        """关闭窗口时取消所有任务，最多等待几秒（连接守护进程时只断开连接，任务继续下载）"""
+        self.downloader.shutdown()
+        super().closeEvent(event)
+    
     def toggle_pause(self, task_id: str):
         """切换暂停/继续状态"""
         task = self.downloader.get_task(task_id)
@@ -606,8 +680,8 @@ class MainWindow(QMainWindow):
         """取消下载"""
         row = self.find_row_by_task_id(task_id)
         if row >= 0:
+            # 任务移入历史后通过task_archived从列表中移除
             self.downloader.cancel_task(task_id)
-            self.download_table.removeRow(row)
             self.statusBar.showMessage("已取消下载任务")
     
     def download_completed(self, task_id: str):
@@ -633,15 +707,66 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, "错误", f"下载失败：{message}")
             self.statusBar.showMessage("下载失败")
     
+    def task_archived(self, task_id: str):
+        """任务已移入下载历史，从下载列表中移除"""
+        row = self.find_row_by_task_id(task_id)
+        if row >= 0:
+            self.download_table.removeRow(row)
+    
+    def show_history(self):
+        """显示下载历史对话框"""
+        from ui.history_dialog import HistoryDialog
+        dialog = HistoryDialog(self.downloader.history, self)
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dialog.show()
+    
+    def sync_finished(self, summary):
+        """增量同步结束，显示变化汇总"""
+        self.statusBar.showMessage(summary.text().split("\n")[1])
+        QMessageBox.information(self, "同步完成", summary.text())
+    
+    def set_compression(self, mode: str):
+        """设置新任务的传输压缩方式"""
+        self.downloader.set_default_compression(mode)
+        self.statusBar.showMessage("已设置传输压缩方式，对之后添加的任务生效")
+    
+    def set_io_policy(self, policy: str):
+        """设置输出文件的页缓存策略"""
+        self.downloader.set_io_policy(policy)
+        self.statusBar.showMessage("已设置写盘缓存策略，对之后开始的任务生效")
+    
+    def toggle_profiling(self, enabled: bool):
+        """开启或停止性能分析"""
+        if enabled:
+            self.downloader.start_profiling()
+            self.statusBar.showMessage("性能分析已开启")
+            return
+        output_dir = os.path.join(os.path.expanduser("~"), "Downloads", "profiles",
+                                  datetime.now().strftime("%Y%m%d-%H%M%S"))
+        summary = self.downloader.stop_profiling(output_dir)
+        self.statusBar.showMessage(f"性能分析结果已保存到 {output_dir}")
+        QMessageBox.information(self, "性能分析", f"结果已保存到：{output_dir}\n\n{summary}")
+    
     def show_proxy_settings(self):
         """显示代理设置对话框"""
         from ui.proxy_dialog import ProxyDialog
+        from utils.downloader import ProxyConfig
         dialog = ProxyDialog(self)
+        config = self.downloader.get_proxy_settings()
+        if config["host"]:
+            dialog.set_proxy_config(config["enabled"], config["host"], config["port"],
+                                    config["username"], config["password"])
+        if config["pool"]:
+            dialog.set_proxy_pool([tuple(item) for item in config["pool"]])
         if dialog.exec():
             enabled, host, port, username, password = dialog.get_proxy_config()
             self.downloader.set_proxy(enabled, host, port, username, password)
+            proxies = [ProxyConfig(True, *item) for item in dialog.get_proxy_pool()]
+            self.downloader.set_proxy_pool("default", proxies)
             
-            if enabled:
+            if proxies:
+                self.statusBar.showMessage(f"已启用代理池：{len(proxies)}个代理")
+            elif enabled:
                 self.statusBar.showMessage(f"已启用代理：{host}:{port}")
             else:
                 self.statusBar.showMessage("已禁用代理")
@@ -653,18 +778,65 @@ class MainWindow(QMainWindow):
         dialog.setModal(True)
         
         layout = QVBoxLayout(dialog)
+        settings = self.downloader.get_settings()
         
         # 线程数设置
         thread_layout = QHBoxLayout()
         thread_label = QLabel("下载线程数:")
         thread_spinbox = QSpinBox()
         thread_spinbox.setRange(1, 32)
-        thread_spinbox.setValue(self.downloader.default_thread_count)
+        thread_spinbox.setValue(settings["default_thread_count"])
         thread_spinbox.setToolTip("设置每个任务的下载线程数（1-32）")
         thread_layout.addWidget(thread_label)
         thread_layout.addWidget(thread_spinbox)
         layout.addLayout(thread_layout)
         
+        # 同时下载的任务数
+        active_layout = QHBoxLayout()
+        active_label = QLabel("同时下载任务数:")
+        active_spinbox = QSpinBox()
+        active_spinbox.setRange(0, 64)
+        active_spinbox.setSpecialValueText("不限制")
+        active_spinbox.setValue(settings["max_active_tasks"])
+        active_spinbox.setToolTip("超出的任务排队等待")
+        active_layout.addWidget(active_label)
+        active_layout.addWidget(active_spinbox)
+        layout.addLayout(active_layout)
+        
+        # 所有任务共用的连接总数
+        connection_layout = QHBoxLayout()
+        connection_label = QLabel("总连接数:")
+        connection_spinbox = QSpinBox()
+        connection_spinbox.setRange(1, 256)
+        connection_spinbox.setValue(settings["max_connections"])
+        connection_spinbox.setToolTip("所有任务同时下载的分片总数，超出的分片排队等待")
+        connection_layout.addWidget(connection_label)
+        connection_layout.addWidget(connection_spinbox)
+        layout.addLayout(connection_layout)
+        
+        # 每个主机的连接数上限
+        host_layout = QHBoxLayout()
+        host_label = QLabel("每主机最大连接数:")
+        host_spinbox = QSpinBox()
+        host_spinbox.setRange(1, 256)
+        host_spinbox.setValue(settings["host_connection_limit"])
+        host_spinbox.setToolTip("同一主机所有任务合计的连接数上限；服务器限流（429/503）时自动减少")
+        host_layout.addWidget(host_label)
+        host_layout.addWidget(host_spinbox)
+        layout.addLayout(host_layout)
+        
+        # 批量下载顺序
+        schedule_layout = QHBoxLayout()
+        schedule_label = QLabel("批量下载顺序:")
+        schedule_combo = QComboBox()
+        schedules = [("fifo", "按添加顺序"), ("sjf", "小文件优先"), ("ljf", "大文件优先")]
+        for key, text in schedules:
+            schedule_combo.addItem(text, key)
+        schedule_combo.setCurrentIndex([key for key, _ in schedules].index(self.batch_schedule))
+        schedule_layout.addWidget(schedule_label)
+        schedule_layout.addWidget(schedule_combo)
+        layout.addLayout(schedule_layout)
+        
         # 说明文本
         info_label = QLabel("提示：线程数越多，下载速度可能越快，但也会占用更多系统资源。\n建议根据网络状况和系统配置调整，一般4-16个线程即可。")
         info_label.setWordWrap(True)
@@ -684,4 +856,8 @@ class MainWindow(QMainWindow):
         if dialog.exec():
             thread_count = thread_spinbox.value()
             self.downloader.set_default_thread_count(thread_count)
+            self.downloader.set_max_active_tasks(active_spinbox.value())
+            self.downloader.set_max_connections(connection_spinbox.value())
+            self.downloader.set_host_connection_limit(host_spinbox.value())
+            self.batch_schedule = schedule_combo.currentData()
             self.statusBar.showMessage(f"已设置下载线程数：{thread_count}") 
\ No newline at end of file
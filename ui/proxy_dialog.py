@@ -1,6 +1,6 @@
 from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
                              QLineEdit, QSpinBox, QCheckBox, QPushButton,
-                             QFormLayout, QGroupBox)
+                             QFormLayout, QGroupBox, QPlainTextEdit)
 from PyQt6.QtCore import Qt
 
 class ProxyDialog(QDialog):
@@ -49,6 +49,16 @@ class ProxyDialog(QDialog):
         proxy_group.setLayout(proxy_layout)
         layout.addWidget(proxy_group)
         layout.addWidget(auth_group)
+
+        # 代理池组：填写多个代理时分片连接会分散到各代理上，并自动避开故障代理
+        pool_group = QGroupBox("代理池")
+        pool_layout = QVBoxLayout()
+        pool_layout.addWidget(QLabel("每行一个代理，格式：服务器:端口[:用户名:密码]"))
+        self.pool_input = QPlainTextEdit()
+        self.pool_input.setPlaceholderText("127.0.0.1:8080\n10.0.0.2:3128:user:pass")
+        pool_layout.addWidget(self.pool_input)
+        pool_group.setLayout(pool_layout)
+        layout.addWidget(pool_group)
         
         # 按钮
         button_layout = QHBoxLayout()
@@ -92,4 +102,26 @@ class ProxyDialog(QDialog):
         self.host_input.setText(host)
         self.port_input.setValue(port)
         self.username_input.setText(username)
-        self.password_input.setText(password) 
\ No newline at end of file
+        self.password_input.setText(password)
+
+    def get_proxy_pool(self) -> list[tuple[str, int, str, str]]:
+        """获取代理池列表，每项为(服务器, 端口, 用户名, 密码)，忽略格式错误的行"""
+        pool = []
+        for line in self.pool_input.toPlainText().splitlines():
+            parts = [p.strip() for p in line.strip().split(":")]
+            if len(parts) < 2 or not parts[0] or not parts[1].isdigit():
+                continue
+            username = parts[2] if len(parts) > 2 else ""
+            password = ":".join(parts[3:]) if len(parts) > 3 else ""
+            pool.append((parts[0], int(parts[1]), username, password))
+        return pool
+
+    def set_proxy_pool(self, proxies: list[tuple[str, int, str, str]]):
+        """设置代理池列表"""
+        lines = []
+        for host, port, username, password in proxies:
+            line = f"{host}:{port}"
+            if username:
+                line += f":{username}:{password}"
+            lines.append(line)
+        self.pool_input.setPlainText("\n".join(lines))
@@ -0,0 +1,140 @@
+from PyQt6.QtWidgets import QWidget, QToolTip
+from PyQt6.QtCore import Qt, QTimer, QRect
+from PyQt6.QtGui import QPainter, QColor
+
+
+class SegmentMapWidget(QWidget):
+    """分段进度图
+
+    把整个文件按字节映射到若干行像素上，画出已下载、下载中（已分配给连接但未收到）
+    和未下载的区间。由定时器按固定频率重绘，每次重绘的工作量只和可见像素数及
+    分段数有关，与进度信号的数量无关。
+    """
+
+    ROW_HEIGHT = 14
+    ROW_SPACING = 2
+
+    DONE_COLOR = QColor(42, 130, 218)      # 已下载
+    ACTIVE_COLOR = QColor(76, 175, 80)     # 下载中
+    ERROR_COLOR = QColor(244, 67, 54)      # 错误
+    MISSING_COLOR = QColor(90, 90, 90)     # 未下载
+
+    def __init__(self, task, parent=None, interval: int = 200):
+        super().__init__(parent)
+        self.task = task
+        self.setMinimumHeight(self.ROW_HEIGHT * 4)
+        self.setMouseTracking(True)
+
+        # 定时重绘，只在可见时刷新
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._refresh)
+        self.timer.start(interval)
+
+    def _refresh(self):
+        if self.isVisible():
+            self.update()
+
+    def _rows(self) -> int:
+        return max(1, (self.height() + self.ROW_SPACING) // (self.ROW_HEIGHT + self.ROW_SPACING))
+
+    def _cells(self) -> int:
+        """可用像素格数（每行宽度 × 行数）"""
+        return max(1, self.width()) * self._rows()
+
+    def _segments(self):
+        """返回(起始字节, 结束字节(不含), 状态)列表，状态为done/active/error
+
+        已下载的部分取自任务的已写入区间（可以画出分片内部的空洞，如增量更新复用的块），
+        分片只用来标出其中还没写入、正在下载或出错的部分。
+        """
+        ranges = self.task.ranges_snapshot()
+        segments = [(start, end, "done") for start, end in ranges.ranges(0, self.task.total_size)]
+        for chunk in list(self.task.chunks):
+            if chunk.status in ("下载中", "已暂停"):
+                state = "active"
+            elif chunk.status == "错误":
+                state = "error"
+            else:
+                continue
+            segments.extend((start, end, state) for start, end in ranges.gaps(chunk.start, chunk.end + 1))
+        return segments
+
+    def _coverage(self, cells: int):
+        """计算每个像素格中各状态覆盖的比例"""
+        total = self.task.total_size
+        per_cell = total / cells
+        coverage = {"done": [0.0] * cells, "active": [0.0] * cells, "error": [0.0] * cells}
+        for start, end, state in self._segments():
+            cov = coverage[state]
+            first = min(cells - 1, int(start / per_cell))
+            last = min(cells - 1, int((end - 1) / per_cell))
+            for cell in range(first, last + 1):
+                cell_start = cell * per_cell
+                overlap = min(end, cell_start + per_cell) - max(start, cell_start)
+                cov[cell] += overlap / per_cell
+        return coverage
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        width = max(1, self.width())
+        rows = self._rows()
+
+        if self.task.total_size <= 0 or not self.task.chunks:
+            painter.setPen(self.palette().color(self.foregroundRole()))
+            painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "等待获取文件信息…")
+            return
+
+        cells = width * rows
+        coverage = self._coverage(cells)
+
+        # 覆盖超过一半的状态决定像素颜色，已下载优先
+        states = [
+            "done" if done >= 0.5 else "error" if error >= 0.5 else "active" if active >= 0.5 else "missing"
+            for done, error, active in zip(coverage["done"], coverage["error"], coverage["active"])
+        ]
+
+        colors = {"done": self.DONE_COLOR, "active": self.ACTIVE_COLOR,
+                  "error": self.ERROR_COLOR, "missing": self.MISSING_COLOR}
+
+        # 相同状态的连续像素合并成一个矩形绘制
+        for row in range(rows):
+            y = row * (self.ROW_HEIGHT + self.ROW_SPACING)
+            base = row * width
+            run_start = 0
+            run_state = states[base]
+            for x in range(1, width + 1):
+                state = states[base + x] if x < width else None
+                if state != run_state:
+                    painter.fillRect(QRect(run_start, y, x - run_start, self.ROW_HEIGHT), colors[run_state])
+                    run_start = x
+                    run_state = state
+
+    def _chunk_at(self, x: int, y: int):
+        """根据鼠标位置找到对应的分段"""
+        if self.task.total_size <= 0:
+            return None
+        row = y // (self.ROW_HEIGHT + self.ROW_SPACING)
+        if row >= self._rows() or x < 0 or x >= self.width():
+            return None
+        offset = int((row * self.width() + x) * self.task.total_size / self._cells())
+        for i, chunk in enumerate(list(self.task.chunks)):
+            if chunk.start <= offset <= chunk.end:
+                return i, chunk
+        return None
+
+    def mouseMoveEvent(self, event):
+        pos = event.position().toPoint()
+        found = self._chunk_at(pos.x(), pos.y())
+        if found is None:
+            QToolTip.hideText()
+            return
+        i, chunk = found
+        size = chunk.end - chunk.start + 1
+        with self.task.ranges_lock:
+            written = self.task.ranges.covered_in(chunk.start, chunk.end + 1)
+        progress = int(written / size * 100)
+        QToolTip.showText(
+            event.globalPosition().toPoint(),
+            f"分段 {i+1}：{progress}%  {chunk.speed:.1f} KB/s  {chunk.status}",
+            self
+        )
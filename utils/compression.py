@@ -0,0 +1,111 @@
+"""传输压缩
+
+文本、CSV、JSON等可压缩的文件可以让服务器压缩后再传输（Content-Encoding），
+但压缩只能用于不带Range的单连接下载，需要和多连接分段下载比较哪种更快。
+"""
+import os
+import threading
+import zlib
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+COMPRESSION_MODES = ("auto", "on", "off")  # 自动选择 / 总是请求压缩 / 不压缩
+MIN_COMPRESS_SIZE = 4 * 1024 * 1024  # 自动模式下小于4MB的文件不值得比较
+TRIAL_SECONDS = 2.0  # 自动模式下先用压缩单连接下载的时间，据此估计两种方式的速度
+
+_COMPRESSIBLE_TYPES = ("text/", "application/json", "application/xml", "application/javascript",
+                       "application/x-ndjson", "application/csv", "application/sql", "application/yaml",
+                       "application/x-yaml", "application/x-tar", "application/wasm", "image/svg+xml")
+_COMPRESSIBLE_EXTENSIONS = (".txt", ".csv", ".tsv", ".json", ".ndjson", ".jsonl", ".xml", ".log", ".sql",
+                            ".html", ".htm", ".js", ".css", ".svg", ".yaml", ".yml", ".md", ".tar", ".wasm")
+
+
+def accept_encoding() -> str:
+    """可以解压的编码，br和zstd需要安装对应的库"""
+    encodings = ["gzip", "deflate"]
+    try:
+        import brotli  # noqa: F401
+        encodings.append("br")
+    except ImportError:
+        pass
+    try:
+        import zstandard  # noqa: F401
+        encodings.append("zstd")
+    except ImportError:
+        pass
+    return ", ".join(encodings)
+
+
+def is_compressible(content_type: str, url: str) -> bool:
+    """按Content-Type判断内容是否值得压缩，服务器没有给出有意义的类型时看扩展名"""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type and content_type not in ("application/octet-stream", "binary/octet-stream"):
+        return content_type.startswith(_COMPRESSIBLE_TYPES) or content_type.endswith(("+json", "+xml"))
+    return os.path.splitext(urlparse(url).path)[1].lower() in _COMPRESSIBLE_EXTENSIONS
+
+
+class StreamDecoder:
+    """按Content-Encoding流式解压响应体"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding in ("gzip", "x-gzip"):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._obj = zlib.decompressobj()
+            self._first = True
+        elif encoding == "br":
+            import brotli
+            self._obj = brotli.Decompressor()
+        elif encoding == "zstd":
+            import zstandard
+            self._obj = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            raise ValueError(f"不支持的内容编码：{encoding}")
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.encoding == "deflate" and self._first:
+            self._first = False
+            try:
+                return self._obj.decompress(data)
+            except zlib.error:
+                # 有些服务器的deflate不带zlib头，按原始deflate流重新解压
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        if self.encoding == "br":
+            return self._obj.process(data) if hasattr(self._obj, "process") else self._obj.decompress(data)
+        return self._obj.decompress(data)
+
+    def flush(self) -> bytes:
+        flush = getattr(self._obj, "flush", None)
+        return flush() if flush is not None and self.encoding != "br" else b""
+
+
+class HostRates:
+    """各主机多连接下载的总速度（字节/秒，指数平均），用于估计分段下载能达到的速度"""
+
+    def __init__(self, alpha: float = 0.5):
+        self.alpha = alpha
+        self._rates: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def update(self, url: str, rate: float) -> None:
+        host = urlparse(url).hostname or ""
+        with self._lock:
+            old = self._rates.get(host)
+            self._rates[host] = rate if old is None else old + self.alpha * (rate - old)
+
+    def get(self, url: str) -> Optional[float]:
+        with self._lock:
+            return self._rates.get(urlparse(url).hostname or "")
+
+
+def prefer_compressed(decoded_rate: float, wire_rate: float, threads: int, host_rate: Optional[float]) -> bool:
+    """比较压缩单连接和不压缩多连接的速度
+
+    decoded_rate、wire_rate为试下载期间压缩单连接解压后和网络上的速度。不压缩时每个连接
+    最多也只有wire_rate，多连接的总速度按线程数估计，知道该主机以往多连接的总速度时以它为上限。
+    """
+    multi_rate = wire_rate * threads
+    if host_rate:
+        multi_rate = min(multi_rate, host_rate)
+    return decoded_rate >= multi_rate
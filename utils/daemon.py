@@ -0,0 +1,673 @@
+"""守护进程模式：下载引擎作为本机的常驻服务运行，多个客户端共用
+
+所有任务共用一个线程池、每主机连接控制、写盘线程和预检缓存，各客户端（图形界面、
+命令行、脚本）通过HTTP接口添加和控制任务；关闭图形界面后任务继续在守护进程中下载。
+
+协议：
+    POST /rpc              JSON-RPC 2.0（支持批量请求），方法名与Downloader一致，
+                           如add_task、add_batch_tasks、pause_task、resume_tasks、cancel_task、
+                           set_speed_limit等；另有get_task、list_tasks（任务快照）、
+                           events（长轮询事件）、history_page/history_count/history_clear、shutdown
+    GET  /events?since=N   以Server-Sent Events推送进度事件（progress、status、speed、error、
+                           completed、task_added、task_archived、bulk_status、sync_finished、url_probed）
+
+默认只监听127.0.0.1，可用--token要求X-Token请求头；用--host监听其他地址时必须设置token，
+否则网络上任何人都能以守护进程用户的身份把任意文件写到任意save_path。请求必须是application/json且不带Origin头，
+网页中的脚本无法借用户的浏览器向守护进程提交任务。
+
+用法：
+    python -m utils.daemon serve [--port 8790] [--host 0.0.0.0 --token TOKEN]
+    python -m utils.daemon add URL 保存路径
+    python -m utils.daemon batch URL列表文件 保存目录 [--sync]
+    python -m utils.daemon list
+    python -m utils.daemon pause|resume|cancel [任务ID ...]     # 不指定任务ID时为全部任务
+    python -m utils.daemon events
+    python -m utils.daemon call 方法名 '{"参数": 值}'
+    python -m utils.daemon stop
+    python main.py --connect [127.0.0.1:8790]                   # 图形界面作为客户端
+"""
+import argparse
+import base64
+import inspect
+import itertools
+import json
+import signal
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import asdict, is_dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from PyQt6.QtCore import QCoreApplication, QObject, QTimer, pyqtSignal
+
+from utils.downloader import DownloadChunk, DownloadProgress, DownloadTask, Downloader, ProxyConfig
+from utils.history import DEFAULT_PATH, HistoryRecord
+from utils.network import ProbeResult, is_loopback
+from utils.preflight import ProbeCache
+from utils.rangeset import RangeSet
+from utils.sync import SyncSummary
+
+DEFAULT_ADDRESS = "127.0.0.1:8790"
+CALL_TIMEOUT = 30.0  # 等待界面线程执行一次调用的最长时间
+
+# JSON-RPC 2.0 错误码
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+APPLICATION_ERROR = -32000
+
+# 直接转发给Downloader的方法
+FORWARDED = (
+    "add_batch_tasks", "pause_task", "resume_task", "cancel_task", "pause_tasks", "resume_tasks", "cancel_tasks",
+    "warm_up", "set_speed_limit", "set_task_speed_limit", "set_default_thread_count", "set_max_active_tasks",
+    "set_max_connections", "set_host_connection_limit", "set_default_compression", "set_io_policy",
+    "set_fsync_policy", "set_proxy", "add_proxy_rule", "set_source_addresses", "get_settings",
+    "get_proxy_settings", "get_host_stats", "get_rates", "get_proxy_stats", "get_interface_stats", "get_io_stats",
+    "start_profiling", "stop_profiling",
+)
+
+
+class DaemonError(Exception):
+    """守护进程返回的JSON-RPC错误"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def _encode(value):
+    """json.dumps无法直接处理的对象：dataclass转成字典，集合转成列表"""
+    if is_dataclass(value):
+        return asdict(value)
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+def _address(address: str) -> str:
+    return address if address.startswith(("http://", "https://")) else f"http://{address}"
+
+
+def task_snapshot(task_id: str, task: DownloadTask, chunks: bool = False) -> Dict[str, object]:
+    """任务状态的快照
+
+    chunks为True时带上分片列表[起点, 终点, 已下载, 状态, 速度, 已写入]和已写入区间
+    （RangeSet.to_bytes()的base64编码）。
+    """
+    snapshot = {
+        "task_id": task_id, "url": task.url, "save_path": task.save_path, "status": task.status,
+        "total_size": task.total_size, "downloaded_size": task.downloaded_size, "wire_bytes": task.wire_bytes,
+        "speed": task.speed, "eta": task.eta, "error_msg": task.error_msg, "thread_count": task.thread_count,
+        "streaming": task.streaming,
+    }
+    if chunks:
+        snapshot["chunks"] = [[c.start, c.end, c.downloaded, c.status, c.speed, c.written] for c in list(task.chunks)]
+        snapshot["ranges"] = base64.b64encode(task.ranges_snapshot().to_bytes()).decode("ascii")
+    return snapshot
+
+
+class EventLog:
+    """带序号的事件环形缓冲区，客户端按序号长轮询；落后超过size条时只能取到最近的事件"""
+
+    def __init__(self, size: int = 10000):
+        self._events: deque = deque(maxlen=size)  # (序号, 事件名, 参数)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def append(self, name: str, args: list) -> None:
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, name, args))
+            self._cond.notify_all()
+
+    def read(self, since: int, timeout: float = 0, limit: int = 1000):
+        """返回(最后序号, 是否漏掉了事件, [(序号, 事件名, 参数)])；since为负数时只返回当前序号"""
+        with self._cond:
+            if since < 0:
+                return self._seq, False, []
+            if since > self._seq:
+                # 守护进程重启过，序号重新开始
+                since = 0
+            self._cond.wait_for(lambda: self._seq > since, timeout)
+            if not self._events:
+                return self._seq, False, []
+            first = self._events[0][0]
+            missed = first > since + 1
+            start = max(0, since + 1 - first)
+            events = list(itertools.islice(self._events, start, start + limit))
+            return (events[-1][0] if events else self._seq), missed, events
+
+
+class _Invoker(QObject):
+    """把HTTP线程中的调用转到界面线程（Downloader只能在创建它的线程中使用）"""
+    call = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.call.connect(self._run)
+
+    def _run(self, job) -> None:
+        future, fn, args, kwargs = job
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+
+class DownloadService:
+    """在Qt事件循环中运行Downloader，并在后台线程中提供HTTP接口"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8790, token: str = "",
+                 history_path: str = DEFAULT_PATH):
+        if not token and not is_loopback(host):
+            raise ValueError(f"监听非本机地址（{host}）时必须设置token")
+        self.token = token
+        self.downloader = Downloader(history_path)
+        self.events = EventLog()
+        self._invoker = _Invoker()
+        self._last_progress: Dict[str, int] = {}  # 只记录变化了的进度，传输中每100毫秒汇总一次
+        self.methods = {name: getattr(self.downloader, name) for name in FORWARDED}
+        self.methods.update({
+            "add_task": self.add_task, "set_proxy_pool": self.set_proxy_pool, "get_task": self.get_task,
+            "list_tasks": self.list_tasks, "history_page": self.history_page,
+            "history_count": self.downloader.history.count, "history_clear": self.downloader.history.clear,
+            "shutdown": self.shutdown,
+        })
+        self._connect_events()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        threading.Thread(target=self._server.serve_forever, name="daemon-http", daemon=True).start()
+        print(f"下载守护进程已启动：{self.address}")
+
+    def stop(self) -> None:
+        """停止接受请求并关闭下载引擎（取消所有任务）"""
+        self._server.shutdown()
+        self._server.server_close()
+        self.downloader.shutdown()
+
+    def _connect_events(self) -> None:
+        handler = self.downloader.progress_handler
+        handler.progress.connect(self._on_progress)
+        handler.task_archived.connect(lambda task_id: self._last_progress.pop(task_id, None))
+        for name in ("status", "speed", "error", "completed", "bulk_status", "task_archived",
+                     "task_added", "sync_finished", "url_probed"):
+            getattr(handler, name).connect(lambda *args, name=name: self._record(name, args))
+
+    def _on_progress(self, task_id: str, progress: int) -> None:
+        if self._last_progress.get(task_id) != progress:
+            self._last_progress[task_id] = progress
+            self._record("progress", (task_id, progress))
+
+    def _record(self, name: str, args: tuple) -> None:
+        # SyncSummary、ProbeResult等对象转成字典，客户端再还原
+        self.events.append(name, [asdict(arg) if is_dataclass(arg) else arg for arg in args])
+
+    def invoke(self, fn, *args, **kwargs):
+        """在界面线程中执行fn并等待结果"""
+        future = Future()
+        self._invoker.call.emit((future, fn, args, kwargs))
+        return future.result(CALL_TIMEOUT)
+
+    def add_task(self, url: str, save_path: str, task_id: str = "", thread_count: int = None,
+                 streaming: bool = False, proxy_pool: str = "", delta_source: str = "",
+                 delta_manifest: str = "", compression: str = None, fast_path: bool = False) -> str:
+        """添加任务，返回任务ID（没有指定时生成）；通过task_added事件通知其他客户端"""
+        task_id = task_id or str(uuid.uuid4())
+        if task_id in self.downloader.tasks:
+            raise ValueError(f"任务ID已存在：{task_id}")
+        self.downloader.add_task(task_id, url, save_path, thread_count, fast_path=fast_path, streaming=streaming,
+                                 proxy_pool=proxy_pool, delta_source=delta_source,
+                                 delta_manifest=delta_manifest, compression=compression)
+        self._record("task_added", (task_id,))
+        return task_id
+
+    def set_proxy_pool(self, name: str, proxies: List[dict]) -> None:
+        self.downloader.set_proxy_pool(name, [ProxyConfig(**proxy) for proxy in proxies])
+
+    def get_task(self, task_id: str, chunks: bool = True) -> Optional[Dict[str, object]]:
+        task = self.downloader.get_task(task_id)
+        return task_snapshot(task_id, task, chunks) if task is not None else None
+
+    def list_tasks(self, chunks: bool = False) -> List[Dict[str, object]]:
+        """所有未结束任务的快照；chunks为True时带上下载中任务的分片"""
+        return [task_snapshot(task_id, task, chunks and task.status == "下载中")
+                for task_id, task in list(self.downloader.tasks.items())]
+
+    def history_page(self, after: list = None, limit: int = 200, query: str = "", status: str = "",
+                     since: float = 0, until: float = 0) -> List[HistoryRecord]:
+        return self.downloader.history.page(tuple(after) if after else None, limit, query, status, since, until)
+
+    def shutdown(self) -> None:
+        """回复请求后退出事件循环"""
+        QTimer.singleShot(100, QCoreApplication.quit)
+
+    def handle(self, request) -> Optional[dict]:
+        """执行一个JSON-RPC请求，通知（没有id）返回None"""
+        if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" or "method" not in request:
+            return {"jsonrpc": "2.0", "id": None,
+                    "error": {"code": INVALID_REQUEST, "message": "不是有效的JSON-RPC 2.0请求"}}
+        request_id = request.get("id")
+        try:
+            result = self._dispatch(request["method"], request.get("params"))
+        except DaemonError as e:
+            response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}}
+        except Exception as e:
+            response = {"jsonrpc": "2.0", "id": request_id,
+                        "error": {"code": APPLICATION_ERROR, "message": str(e) or type(e).__name__}}
+        else:
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+        return response if "id" in request else None
+
+    def _dispatch(self, method: str, params):
+        if params is None:
+            params = {}
+        args, kwargs = (params, {}) if isinstance(params, list) else ([], params)
+        if method == "events":
+            # 长轮询在HTTP线程中等待，不占用界面线程
+            seq, missed, events = self.events.read(*args, **kwargs)
+            return {"seq": seq, "missed": missed, "events": events}
+        fn = self.methods.get(method)
+        if fn is None:
+            raise DaemonError(METHOD_NOT_FOUND, f"未知的方法：{method}")
+        try:
+            inspect.signature(fn).bind(*args, **kwargs)
+        except TypeError as e:
+            raise DaemonError(INVALID_PARAMS, f"参数错误：{str(e)}")
+        return self.invoke(fn, *args, **kwargs)
+
+    def _make_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code: int, payload=None):
+                body = json.dumps(payload, ensure_ascii=False, default=_encode).encode() if payload is not None else b""
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self) -> bool:
+                if self.headers.get("Origin"):
+                    self._reply(403, {"error": "不接受浏览器发起的请求"})
+                    return False
+                if service.token and self.headers.get("X-Token") != service.token:
+                    self._reply(403, {"error": "token错误"})
+                    return False
+                return True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                if not self._authorized():
+                    return
+                if urlparse(self.path).path != "/rpc":
+                    return self._reply(404)
+                if not (self.headers.get("Content-Type") or "").startswith("application/json"):
+                    return self._reply(415, {"error": "Content-Type必须是application/json"})
+                try:
+                    request = json.loads(body)
+                except ValueError as e:
+                    return self._reply(200, {"jsonrpc": "2.0", "id": None,
+                                             "error": {"code": PARSE_ERROR, "message": str(e)}})
+                if isinstance(request, list):
+                    responses = [r for r in (service.handle(item) for item in request) if r is not None]
+                    return self._reply(200, responses) if responses else self._reply(204)
+                response = service.handle(request)
+                self._reply(200, response) if response is not None else self._reply(204)
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                url = urlparse(self.path)
+                if url.path != "/events":
+                    return self._reply(404)
+                try:
+                    since = int(parse_qs(url.query).get("since", ["-1"])[0])
+                except ValueError:
+                    return self._reply(400, {"error": "since必须是整数"})
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    since, _, _ = service.events.read(since) if since < 0 else (since, False, [])
+                    while True:
+                        since, _, events = service.events.read(since, timeout=15)
+                        if not events:
+                            self.wfile.write(b": keepalive\n\n")
+                        for seq, name, args in events:
+                            data = json.dumps(args, ensure_ascii=False)
+                            self.wfile.write(f"id: {seq}\nevent: {name}\ndata: {data}\n\n".encode())
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+
+class DaemonClient:
+    """守护进程的JSON-RPC客户端（只用标准库，不影响图形界面的启动速度）"""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, token: str = ""):
+        self.url = _address(address).rstrip("/") + "/rpc"
+        self.token = token
+        self._ids = itertools.count(1)
+        # 本机通信不走环境变量中的代理
+        self._opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+    def call(self, method: str, **params):
+        """调用一个方法，返回result，出错时抛出DaemonError"""
+        # 长轮询events时按它的等待时间放宽超时
+        timeout = CALL_TIMEOUT + 5 + (params.get("timeout") or 0 if method == "events" else 0)
+        payload = {"jsonrpc": "2.0", "method": method, "params": params, "id": next(self._ids)}
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["X-Token"] = self.token
+        request = urllib.request.Request(self.url, json.dumps(payload, default=_encode).encode(), headers)
+        try:
+            with self._opener.open(request, timeout=timeout) as response:
+                reply = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise DaemonError(APPLICATION_ERROR, f"HTTP {e.code}：{e.read().decode('utf-8', 'replace')}")
+        if "error" in reply:
+            raise DaemonError(reply["error"]["code"], reply["error"]["message"])
+        return reply["result"]
+
+
+class RemoteHistory:
+    """守护进程中的下载历史，接口与HistoryStore的page/count/clear相同"""
+
+    def __init__(self, client: DaemonClient):
+        self.client = client
+
+    def count(self, query: str = "", status: str = "", since: float = 0, until: float = 0) -> int:
+        return self.client.call("history_count", query=query, status=status, since=since, until=until)
+
+    def page(self, after=None, limit: int = 200, query: str = "", status: str = "",
+             since: float = 0, until: float = 0) -> List[HistoryRecord]:
+        rows = self.client.call("history_page", after=after, limit=limit, query=query, status=status,
+                                since=since, until=until)
+        return [HistoryRecord(**row) for row in rows]
+
+    def clear(self) -> None:
+        self.client.call("history_clear")
+
+
+class RemoteDownloader:
+    """连接守护进程的下载器，提供图形界面用到的Downloader接口
+
+    后台线程长轮询事件并通过progress_handler发出与本地下载器相同的信号；任务对象是本地镜像，
+    每SNAPSHOT_INTERVAL秒按守护进程的快照更新（包括下载中任务的分片，供分段进度图读取）。
+    其他客户端添加的任务同样通过task_added通知界面。
+    """
+
+    SNAPSHOT_INTERVAL = 1.0
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, token: str = ""):
+        self.address = address
+        self.client = DaemonClient(address, token)
+        self.client.call("get_settings")  # 守护进程没有运行时立即报错
+        self.progress_handler = DownloadProgress()
+        self.history = RemoteHistory(self.client)
+        self.probe_cache = ProbeCache()  # 守护进程预先探测的结果，添加任务前用于显示文件名
+        self.tasks: Dict[str, DownloadTask] = {}  # 任务镜像
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name="daemon-events", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name: str):
+        # 其余设置和统计方法直接转发，如set_speed_limit、set_max_connections、get_host_stats
+        if name not in FORWARDED:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.client.call(name, **self._params(name, args, kwargs))
+
+    @staticmethod
+    def _params(name: str, args: tuple, kwargs: dict) -> dict:
+        """把位置参数按Downloader方法的参数名转成关键字参数"""
+        bound = inspect.signature(getattr(Downloader, name)).bind(None, *args, **kwargs)
+        params = dict(bound.arguments)
+        params.pop("self", None)
+        return params
+
+    def add_task(self, task_id: str, url: str, save_path: str, thread_count: int = None, **kwargs) -> None:
+        with self._lock:
+            self.tasks[task_id] = DownloadTask(url=url, save_path=save_path)
+        self.client.call("add_task", task_id=task_id, url=url, save_path=save_path, thread_count=thread_count,
+                         **kwargs)
+
+    def set_proxy_pool(self, name: str, proxies: List[ProxyConfig]) -> None:
+        self.client.call("set_proxy_pool", name=name, proxies=proxies)
+
+    def get_task(self, task_id: str) -> Optional[DownloadTask]:
+        with self._lock:
+            task = self.tasks.get(task_id)
+        if task is not None:
+            return task
+        snapshot = self.client.call("get_task", task_id=task_id)
+        return self._update(snapshot) if snapshot is not None else None
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """只断开连接，任务继续在守护进程中下载"""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _update(self, snapshot: dict) -> DownloadTask:
+        """按快照更新任务镜像（保持同一个对象，已打开的详情对话框继续读取它）"""
+        with self._lock:
+            task = self.tasks.get(snapshot["task_id"])
+            if task is None:
+                task = self.tasks[snapshot["task_id"]] = DownloadTask(url=snapshot["url"],
+                                                                      save_path=snapshot["save_path"])
+        for key in ("save_path", "status", "total_size", "downloaded_size", "wire_bytes", "speed", "eta",
+                    "error_msg", "thread_count", "streaming"):
+            setattr(task, key, snapshot[key])
+        if "chunks" in snapshot:
+            task.chunks = [DownloadChunk(start, end, downloaded, status, speed, written)
+                           for start, end, downloaded, status, speed, written in snapshot["chunks"]]
+        if "ranges" in snapshot:
+            ranges = RangeSet.from_bytes(base64.b64decode(snapshot["ranges"]))
+            with task.ranges_lock:
+                task.ranges = ranges
+        return task
+
+    def _refresh(self, resync: bool = False) -> None:
+        """按快照更新所有任务；发现其他客户端添加的任务时发出task_added，resync时补发状态"""
+        snapshots = self.client.call("list_tasks", chunks=True)
+        live = {s["task_id"] for s in snapshots}
+        with self._lock:
+            known = set(self.tasks)
+            for task_id in known - live:
+                del self.tasks[task_id]
+        handler = self.progress_handler
+        for snapshot in snapshots:
+            task = self._update(snapshot)
+            task_id = snapshot["task_id"]
+            if task_id not in known:
+                handler.task_added.emit(task_id)
+            elif resync:
+                handler.status.emit(task_id, task.status)
+                if task.total_size > 0:
+                    handler.progress.emit(task_id, int(task.downloaded_size / task.total_size * 100))
+        if resync:
+            for task_id in known - live:
+                handler.task_archived.emit(task_id)
+
+    def _poll(self) -> None:
+        since = -1
+        refreshed = 0.0
+        while not self._stop.is_set():
+            try:
+                result = self.client.call("events", since=since, timeout=self.SNAPSHOT_INTERVAL)
+                resync = result["missed"] or result["seq"] < since
+                since = result["seq"]
+                for _, name, args in result["events"]:
+                    self._dispatch(name, args)
+                if resync or time.time() - refreshed >= self.SNAPSHOT_INTERVAL:
+                    self._refresh(resync)
+                    refreshed = time.time()
+            except (OSError, ValueError, DaemonError) as e:
+                print(f"与守护进程通信失败：{str(e)}")
+                self._stop.wait(1)
+
+    def _dispatch(self, name: str, args: list) -> None:
+        """更新任务镜像后发出对应的信号"""
+        if name == "sync_finished":
+            args = [SyncSummary(**args[0])]
+        elif name == "url_probed":
+            probe = ProbeResult(**args[1])
+            self.probe_cache.put(probe)
+            args = [args[0], probe]
+        with self._lock:
+            if name in ("status", "error", "speed", "completed"):
+                task = self.tasks.get(args[0])
+                if task is not None:
+                    if name == "status":
+                        task.status = args[1]
+                    elif name == "error":
+                        task.status, task.error_msg = "错误", args[1]
+                    elif name == "speed":
+                        task.speed = args[1]
+                    else:
+                        task.status = "已完成"
+            elif name == "bulk_status":
+                for task_id in args[0]:
+                    if task_id in self.tasks:
+                        self.tasks[task_id].status = args[1]
+            elif name == "task_archived":
+                self.tasks.pop(args[0], None)
+        emitter = getattr(self.progress_handler, name, None)
+        if emitter is not None:
+            emitter.emit(*args)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8790, token: str = "", history_path: str = DEFAULT_PATH) -> None:
+    """运行守护进程直到收到shutdown请求或Ctrl+C"""
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    service = DownloadService(host, port, token, history_path)
+    service.start()
+    signal.signal(signal.SIGINT, lambda *_: app.quit())
+    signal.signal(signal.SIGTERM, lambda *_: app.quit())
+    # 让Python解释器定期运行，及时处理信号
+    timer = QTimer()
+    timer.timeout.connect(lambda: None)
+    timer.start(200)
+    app.exec()
+    print("下载守护进程正在退出")
+    service.stop()
+
+
+def _print_tasks(tasks: List[dict]) -> None:
+    for task in tasks:
+        progress = int(task["downloaded_size"] / task["total_size"] * 100) if task["total_size"] > 0 else 0
+        print(f"{task['task_id']}  {task['status']:<4} {progress:>3}%  {task['speed']:>9.1f} KB/s  {task['save_path']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="下载守护进程")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="守护进程地址（客户端命令使用）")
+    parser.add_argument("--token", default="")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p = sub.add_parser("serve", help="启动守护进程")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8790)
+    p.add_argument("--history", default=DEFAULT_PATH, help="下载历史数据库路径")
+
+    p = sub.add_parser("add", help="添加下载任务")
+    p.add_argument("url")
+    p.add_argument("save_path")
+    p.add_argument("--threads", type=int)
+
+    p = sub.add_parser("batch", help="批量添加URL列表文件中的任务")
+    p.add_argument("list_file")
+    p.add_argument("save_dir")
+    p.add_argument("--sync", action="store_true", help="增量同步，只下载新增和有变化的文件")
+    p.add_argument("--schedule", default="fifo", choices=("fifo", "sjf", "ljf"))
+
+    sub.add_parser("list", help="列出未结束的任务")
+    for name in ("pause", "resume", "cancel"):
+        p = sub.add_parser(name, help="暂停、继续或取消任务，不指定任务ID时为全部任务")
+        p.add_argument("task_ids", nargs="*")
+
+    sub.add_parser("events", help="持续输出进度事件")
+
+    p = sub.add_parser("call", help="调用任意方法")
+    p.add_argument("method")
+    p.add_argument("params", nargs="?", default="{}", help="JSON对象形式的参数")
+
+    sub.add_parser("stop", help="停止守护进程（取消所有任务）")
+
+    args = parser.parse_args(argv)
+    if args.mode == "serve":
+        try:
+            serve(args.host, args.port, args.token, args.history)
+        except ValueError as e:
+            parser.error(str(e))
+        return
+
+    try:
+        _run_command(DaemonClient(args.address, args.token), args)
+    except (OSError, DaemonError) as e:
+        print(f"调用守护进程失败：{str(e)}")
+        sys.exit(1)
+
+
+def _run_command(client: DaemonClient, args) -> None:
+    if args.mode == "add":
+        print(client.call("add_task", url=args.url, save_path=args.save_path, thread_count=args.threads))
+    elif args.mode == "batch":
+        with open(args.list_file, encoding="utf-8") as f:
+            urls = [line.strip() for line in f if line.strip()]
+        client.call("add_batch_tasks", urls=urls, save_dir=args.save_dir, sync=args.sync, schedule=args.schedule)
+        print(f"已提交{len(urls)}个URL")
+    elif args.mode == "list":
+        _print_tasks(client.call("list_tasks"))
+    elif args.mode in ("pause", "resume", "cancel"):
+        ids = client.call(f"{args.mode}_tasks", task_ids=args.task_ids or None)
+        print(f"{len(ids)}个任务")
+    elif args.mode == "events":
+        since = -1
+        try:
+            while True:
+                result = client.call("events", since=since, timeout=15)
+                since = result["seq"]
+                for seq, name, event_args in result["events"]:
+                    print(seq, name, json.dumps(event_args, ensure_ascii=False), flush=True)
+        except KeyboardInterrupt:
+            pass
+    elif args.mode == "call":
+        result = client.call(args.method, **json.loads(args.params))
+        print(json.dumps(result, ensure_ascii=False, indent=2, default=_encode))
+    else:
+        client.call("shutdown")
+        print("守护进程正在退出")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""块级增量更新（类似zsync）
+
+服务器上的文件旁边发布一份块校验清单（默认为 文件URL + ".blocks.json"），
+客户端用它和本地旧版本比对：能在旧版本中找到的块直接复制，只用范围请求下载变化的块。
+
+清单格式（JSON）：
+    {"version": 1, "size": 文件大小, "block_size": 块大小, "sha256": 整个文件的SHA-256,
+     "blocks": [[弱校验和, "MD5"], ...]}
+
+弱校验和为rsync式滚动校验和，开启rolling时在旧版本中整体偏移的块（前面插入或删除了数据）
+也能找到；滚动查找是纯Python的逐字节循环，只在未匹配块的原位置附近进行，总扫描量有上限。
+
+用法：
+    python -m utils.delta make FILE [--block-size 1048576] [-o FILE.blocks.json]
+    python -m utils.delta plan FILE.blocks.json OLD_FILE [--rolling]
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+MANIFEST_SUFFIX = ".blocks.json"
+MANIFEST_VERSION = 1
+DEFAULT_BLOCK_SIZE = 1024 * 1024  # 1MB
+READ_BLOCK = 4 * 1024 * 1024
+_MOD = 1 << 16
+ROLLING_RADIUS = 256 * 1024  # 滚动查找只在未匹配块预计位置前后这么远的范围内进行
+ROLLING_LIMIT = 16 * 1024 * 1024  # 滚动查找最多扫描的字节数（纯Python每秒只能处理一两MB）
+
+
+def weak_checksum(block: bytes) -> Tuple[int, int]:
+    """rsync式弱校验和的两个分量(a, b)
+
+    a = Σx_i，b = Σ(L-i)·x_i（即各前缀和之和），都取模65536。
+    """
+    return sum(block) % _MOD, sum(itertools.accumulate(block)) % _MOD
+
+
+def _pack(a: int, b: int) -> int:
+    return a | (b << 16)
+
+
+def strong_checksum(block: bytes) -> str:
+    return hashlib.md5(block).hexdigest()
+
+
+def make_manifest(path: str, block_size: int = DEFAULT_BLOCK_SIZE) -> Dict:
+    """为文件生成块校验清单"""
+    blocks = []
+    whole = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            whole.update(block)
+            blocks.append([_pack(*weak_checksum(block)), strong_checksum(block)])
+    return {
+        "version": MANIFEST_VERSION,
+        "size": os.path.getsize(path),
+        "block_size": block_size,
+        "sha256": whole.hexdigest(),
+        "blocks": blocks,
+    }
+
+
+def load_manifest(data: Dict) -> Dict:
+    """检查清单格式，格式不对时抛出ValueError"""
+    if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+        raise ValueError("不支持的块清单版本")
+    size, block_size, blocks = data.get("size"), data.get("block_size"), data.get("blocks")
+    if not isinstance(size, int) or not isinstance(block_size, int) or block_size <= 0 or not isinstance(blocks, list):
+        raise ValueError("块清单格式错误")
+    if len(blocks) != (size + block_size - 1) // block_size:
+        raise ValueError("块清单中的块数与文件大小不符")
+    return data
+
+
+@dataclass
+class DeltaPlan:
+    """增量更新计划"""
+    size: int
+    reuse: List[Tuple[int, int, int]] = field(default_factory=list)  # (目标偏移, 旧文件偏移, 长度)
+    missing: List[Tuple[int, int]] = field(default_factory=list)     # 需要下载的区间(起点, 终点)，含终点
+
+    @property
+    def reused_bytes(self) -> int:
+        return sum(length for _, _, length in self.reuse)
+
+
+def _match_aligned(manifest: Dict, local_path: str, found: Dict[int, int]) -> None:
+    """先比较相同偏移处的块：原地修改的文件（如磁盘镜像）大部分块都在原位置"""
+    block_size = manifest["block_size"]
+    size = manifest["size"]
+    with open(local_path, 'rb') as f:
+        for i, (_, strong) in enumerate(manifest["blocks"]):
+            length = min(block_size, size - i * block_size)
+            f.seek(i * block_size)
+            block = f.read(length)
+            if len(block) < length:
+                break
+            if strong_checksum(block) == strong:
+                found[i] = i * block_size
+
+
+def _scan(buf: bytes, base: int, block_size: int, wanted: Dict[int, List[Tuple[int, str]]],
+          found: Dict[int, int]) -> None:
+    """在buf（旧文件中从base开始的一段）的每个偏移处用滚动校验和查找wanted中的块"""
+    last = len(buf) - block_size
+    if last < 0:
+        return
+    pos = 0
+    a, b = weak_checksum(buf[:block_size])
+    while True:
+        candidates = wanted.get(_pack(a, b))
+        if candidates:
+            strong = strong_checksum(buf[pos:pos + block_size])
+            matched = False
+            for i, s in candidates:
+                if s == strong and i not in found:
+                    found[i] = base + pos
+                    matched = True
+            if matched:
+                # 匹配的块整体跳过，重新计算新窗口的校验和
+                pos += block_size
+                if pos > last:
+                    return
+                a, b = weak_checksum(buf[pos:pos + block_size])
+                continue
+        if pos >= last:
+            return
+        out_byte, in_byte = buf[pos], buf[pos + block_size]
+        a = (a - out_byte + in_byte) % _MOD
+        b = (b - block_size * out_byte + a) % _MOD
+        pos += 1
+
+
+def _match_rolling(manifest: Dict, local_path: str, found: Dict[int, int],
+                   radius: int = ROLLING_RADIUS, limit: int = ROLLING_LIMIT) -> None:
+    """在未匹配块的预计位置附近查找整体偏移了的完整块
+
+    前面插入或删除了数据时，之后的块在旧文件中偏移相同的距离：找到一个块后，后面的块先直接
+    比较按这个偏移推算的位置，不再滚动。滚动查找只扫描预计位置前后radius字节，按顺序推进不重复
+    扫描，总量不超过limit字节，不会因为一处修改扫描整个旧文件。
+    """
+    block_size = manifest["block_size"]
+    size = manifest["size"]
+    blocks = manifest["blocks"]
+    wanted: Dict[int, List[Tuple[int, str]]] = {}
+    for i, (weak, strong) in enumerate(blocks):
+        if i not in found and (i + 1) * block_size <= size:
+            wanted.setdefault(weak, []).append((i, strong))
+    if not wanted:
+        return
+    old_size = os.path.getsize(local_path)
+    shift = 0          # 最近一个匹配块相对原位置的偏移
+    scanned = 0        # 已经滚动扫描的字节数
+    scanned_until = 0  # 旧文件中这个位置之前的窗口起点都已经检查过
+
+    with open(local_path, 'rb') as f:
+        for i in range(size // block_size):
+            if i in found:
+                shift = found[i] - i * block_size
+                continue
+            expected = i * block_size + shift
+            if shift and 0 <= expected and expected + block_size <= old_size:
+                f.seek(expected)
+                if strong_checksum(f.read(block_size)) == blocks[i][1]:
+                    found[i] = expected
+                    continue
+            if scanned >= limit:
+                continue
+            start = max(0, scanned_until, expected - radius)
+            end = min(old_size, expected + block_size + radius, start + limit - scanned + block_size)
+            if end - start < block_size:
+                continue
+            f.seek(start)
+            buf = f.read(end - start)
+            scanned += len(buf)
+            scanned_until = start + len(buf) - block_size + 1
+            _scan(buf, start, block_size, wanted, found)
+            if i in found:
+                shift = found[i] - i * block_size
+
+
+def plan_delta(manifest: Dict, local_path: str, rolling: bool = False) -> DeltaPlan:
+    """比对清单和本地旧版本，得到可以复用的块和需要下载的区间
+
+    默认只比较相同偏移处的块（原地修改的文件只需读一遍旧文件）；rolling为True时再在未匹配块
+    附近滚动查找整体偏移的块，扫描量有上限，见_match_rolling。
+    """
+    block_size = manifest["block_size"]
+    size = manifest["size"]
+    found: Dict[int, int] = {}  # 块序号 -> 旧文件中的偏移
+    if os.path.exists(local_path):
+        _match_aligned(manifest, local_path, found)
+        if rolling and len(found) < len(manifest["blocks"]):
+            _match_rolling(manifest, local_path, found)
+
+    plan = DeltaPlan(size)
+    for i in range(len(manifest["blocks"])):
+        start = i * block_size
+        length = min(block_size, size - start)
+        if i in found:
+            src = found[i]
+            # 合并目标和来源都相邻的块，减少复制次数
+            if plan.reuse and plan.reuse[-1][0] + plan.reuse[-1][2] == start \
+                    and plan.reuse[-1][1] + plan.reuse[-1][2] == src:
+                dst, old, n = plan.reuse[-1]
+                plan.reuse[-1] = (dst, old, n + length)
+            else:
+                plan.reuse.append((start, src, length))
+        elif plan.missing and plan.missing[-1][1] + 1 == start:
+            plan.missing[-1] = (plan.missing[-1][0], start + length - 1)
+        else:
+            plan.missing.append((start, start + length - 1))
+    return plan
+
+
+def copy_reused(plan: DeltaPlan, local_path: str, target_path: str) -> None:
+    """把可复用的块从旧版本复制到目标文件（目标文件需已创建）"""
+    if not plan.reuse:
+        return
+    with open(local_path, 'rb') as src, open(target_path, 'r+b') as dst:
+        for offset, old_offset, length in plan.reuse:
+            src.seek(old_offset)
+            dst.seek(offset)
+            while length > 0:
+                data = src.read(min(READ_BLOCK, length))
+                if not data:
+                    raise IOError(f"读取旧版本失败：{local_path}")
+                dst.write(data)
+                length -= len(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="块级增量更新工具")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p = sub.add_parser("make", help="为文件生成块校验清单")
+    p.add_argument("file")
+    p.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    p.add_argument("-o", "--output", default="", help="默认为 FILE" + MANIFEST_SUFFIX)
+
+    p = sub.add_parser("plan", help="预览用旧版本更新时需要下载多少数据")
+    p.add_argument("manifest")
+    p.add_argument("old_file")
+    p.add_argument("--rolling", action="store_true", help="在未匹配块附近查找整体偏移的块（较慢）")
+
+    args = parser.parse_args(argv)
+    if args.mode == "make":
+        manifest = make_manifest(args.file, args.block_size)
+        output = args.output or args.file + MANIFEST_SUFFIX
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        print(f"已生成块清单：{output}（{len(manifest['blocks'])}块，每块{args.block_size}字节）")
+    else:
+        with open(args.manifest, 'r', encoding='utf-8') as f:
+            manifest = load_manifest(json.load(f))
+        plan = plan_delta(manifest, args.old_file, rolling=args.rolling)
+        missing = sum(end - start + 1 for start, end in plan.missing)
+        print(f"可复用 {plan.reused_bytes} 字节，需要下载 {missing} 字节（{len(plan.missing)}个区间）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+import errno
+import mmap
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from utils.profiler import IO_TASK, register_thread
+
+
+class FsyncPolicy:
+    """fsync 策略"""
+    NEVER = "never"          # 不主动fsync，交给操作系统回写
+    PER_CHUNK = "per_chunk"  # 每个分片写完时fsync
+    PERIODIC = "periodic"    # 按固定间隔fsync
+
+    ALL = (NEVER, PER_CHUNK, PERIODIC)
+
+
+class IOPolicy:
+    """输出文件的页缓存策略
+
+    写入上百GB的文件时，普通的带缓存写入会把系统中其他程序的页缓存挤出去，
+    并在回写时造成写入停顿。STREAMING和DIRECT策略都会先用fallocate预分配空间。
+    """
+    BUFFERED = "buffered"    # 普通带缓存写入，交给操作系统回写
+    STREAMING = "streaming"  # 每写入drop_interval字节fdatasync一次，再用fadvise(DONTNEED)从页缓存中释放
+    DIRECT = "direct"        # 按4KB对齐的部分用O_DIRECT绕过页缓存，不对齐的首尾按STREAMING处理
+
+    ALL = (BUFFERED, STREAMING, DIRECT)
+
+
+DIRECT_ALIGN = 4096  # O_DIRECT要求的偏移、长度和内存对齐（兼容512字节和4KB扇区）
+
+
+@dataclass
+class WriteRequest:
+    """一次待写入的数据块"""
+    path: str
+    offset: int
+    data: bytes
+    callback: Optional[Callable[[int], None]] = None  # 写入完成后回调，参数为写入字节数
+
+
+@dataclass
+class FileOp:
+    """交给I/O线程执行的文件操作（fsync、drop、close），与写入按队列顺序执行，调用方等待完成"""
+    op: str
+    path: str
+    done: threading.Event = field(default_factory=threading.Event)
+    error: Optional[Exception] = None
+
+
+@dataclass
+class DiskWriterStats:
+    """磁盘写入统计"""
+    queue_depth: int = 0         # 队列中等待写入的缓冲区数量
+    queued_bytes: int = 0        # 队列中等待写入的字节数
+    bytes_written: int = 0       # 累计写入字节数
+    write_calls: int = 0         # 实际的write系统调用次数（合并后）
+    coalesced: int = 0           # 被合并掉的相邻写入次数
+    fsync_calls: int = 0         # fsync次数
+    direct_bytes: int = 0        # 以O_DIRECT写入的字节数
+    dropped_bytes: int = 0       # 落盘后从页缓存中释放的字节数
+    throughput: float = 0.0      # 最近的磁盘写入速度 KB/s
+
+
+_STOP = object()
+
+
+def _pwrite_all(fd: int, view: memoryview, offset: int) -> None:
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+class _OutputFile:
+    """I/O线程打开的一个输出文件，按IOPolicy写入并管理页缓存"""
+
+    def __init__(self, path: str, policy: str, drop_interval: int):
+        self.fd = os.open(path, os.O_RDWR)
+        self.policy = policy
+        self.drop_interval = drop_interval
+        self.direct_fd = None
+        self._buffer: Optional[mmap.mmap] = None  # O_DIRECT写入用的页对齐缓冲区
+        self._low = None  # 上次释放页缓存以来写入的范围
+        self._high = 0
+        self._unsynced = 0
+        if policy == IOPolicy.DIRECT:
+            try:
+                self.direct_fd = os.open(path, os.O_WRONLY | os.O_DIRECT)
+            except (AttributeError, OSError) as e:
+                # 不支持O_DIRECT的平台或文件系统（如tmpfs）
+                print(f"无法以O_DIRECT打开文件，改为落盘后释放页缓存：{str(e)}")
+                self.policy = IOPolicy.STREAMING
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def write(self, offset: int, data: bytearray) -> int:
+        """写入一段数据，返回其中以O_DIRECT写入的字节数"""
+        view = memoryview(data)
+        direct = 0
+        if self.direct_fd is not None:
+            head = min(len(view), -offset % DIRECT_ALIGN)
+            direct = (len(view) - head) // DIRECT_ALIGN * DIRECT_ALIGN
+            if direct:
+                if self._buffer is None or len(self._buffer) < direct:
+                    if self._buffer is not None:
+                        self._buffer.close()
+                    self._buffer = mmap.mmap(-1, direct)
+                self._buffer[:direct] = view[head:head + direct]
+                try:
+                    _pwrite_all(self.direct_fd, memoryview(self._buffer)[:direct], offset + head)
+                except OSError as e:
+                    if e.errno != errno.EINVAL:
+                        raise
+                    # 文件系统不接受这种对齐，之后都按STREAMING处理
+                    print(f"O_DIRECT写入失败，改为落盘后释放页缓存：{str(e)}")
+                    self._close_direct()
+                    direct = 0
+            if direct:
+                # 对齐部分之外的首尾仍然经过页缓存
+                _pwrite_all(self.fd, view[:head], offset)
+                _pwrite_all(self.fd, view[head + direct:], offset + head + direct)
+        if not direct:
+            _pwrite_all(self.fd, view, offset)
+        if self.policy != IOPolicy.BUFFERED:
+            self._low = offset if self._low is None else min(self._low, offset)
+            self._high = max(self._high, offset + len(view))
+            self._unsynced += len(view) - direct
+        return direct
+
+    def should_drop(self) -> bool:
+        return self._unsynced >= self.drop_interval
+
+    def drop(self) -> int:
+        """把写入的范围落盘后从页缓存中释放，返回释放范围的字节数"""
+        if self._low is None:
+            return 0
+        low, high = self._low, self._high
+        self._low, self._high, self._unsynced = None, 0, 0
+        # 脏页不会被DONTNEED释放，先等它们写回
+        os.fdatasync(self.fd)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, low, high - low, os.POSIX_FADV_DONTNEED)
+        return high - low
+
+    def _close_direct(self):
+        if self.direct_fd is not None:
+            os.close(self.direct_fd)
+            self.direct_fd = None
+            self.policy = IOPolicy.STREAMING
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+
+    def close(self):
+        self._close_direct()
+        os.close(self.fd)
+
+
+class _IOThread(threading.Thread):
+    """单个I/O线程，独占一部分文件的写入，保证同一文件的写入顺序"""
+
+    def __init__(self, writer: 'DiskWriter', max_pending: int):
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self.files: Dict[str, object] = {}
+        self.dirty: set = set()
+        self._last_fsync = time.time()
+
+    def _get_file(self, path: str):
+        f = self.files.get(path)
+        if f is None:
+            # 已经自行合并缓冲，直接用pwrite写入
+            f = _OutputFile(path, self.writer.io_policy, self.writer.drop_interval)
+            self.files[path] = f
+        return f
+
+    def _drain(self, first: WriteRequest):
+        """取出队列中已有的请求，一次处理一批；遇到文件操作时停下，返回(这一批, 文件操作或None)"""
+        batch = [first]
+        size = len(first.data)
+        while size < self.writer.coalesce_limit:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self.queue.put_nowait(_STOP)
+                break
+            if isinstance(item, FileOp):
+                return batch, item
+            batch.append(item)
+            size += len(item.data)
+        return batch, None
+
+    def _write_batch(self, batch: List[WriteRequest]):
+        # 按文件和偏移排序后合并相邻写入
+        batch.sort(key=lambda r: (r.path, r.offset))
+        runs = []
+        for req in batch:
+            if runs:
+                path, offset, buf, reqs = runs[-1]
+                if path == req.path and offset + len(buf) == req.offset:
+                    buf += req.data
+                    reqs.append(req)
+                    continue
+            runs.append((req.path, req.offset, bytearray(req.data), [req]))
+
+        for path, offset, buf, reqs in runs:
+            error = None
+            direct = dropped = 0
+            try:
+                f = self._get_file(path)
+                direct = f.write(offset, buf)
+                self.dirty.add(path)
+                if f.should_drop():
+                    dropped = f.drop()
+            except Exception as e:
+                error = e
+            self.writer._on_written(path, reqs, len(buf), error, direct, dropped)
+
+    def _fsync_dirty(self):
+        for path in list(self.dirty):
+            f = self.files.get(path)
+            if f is not None:
+                try:
+                    os.fsync(f.fileno())
+                    self.writer._count_fsync()
+                except OSError:
+                    pass
+        self.dirty.clear()
+        self._last_fsync = time.time()
+
+    def call(self, op: str, path: str):
+        """在I/O线程中执行文件操作并等待完成，files和dirty只由I/O线程访问
+
+        线程已经停止时直接在调用方线程执行。
+        """
+        if not self.is_alive():
+            self._apply(op, path)
+            return
+        request = FileOp(op, path)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+    def _handle(self, request: FileOp):
+        try:
+            self._apply(request.op, request.path)
+        except Exception as e:
+            request.error = e
+        finally:
+            request.done.set()
+
+    def _apply(self, op: str, path: str):
+        if op == "close":
+            self._close_file(path)
+            return
+        f = self.files.get(path)
+        if f is None:
+            return
+        if op == "fsync":
+            os.fsync(f.fileno())
+            self.writer._count_fsync()
+            self.dirty.discard(path)
+        elif op == "drop":
+            # 文件写完后释放剩余的页缓存
+            self.writer._count_dropped(f.drop())
+
+    def _close_file(self, path: str):
+        f = self.files.pop(path, None)
+        self.dirty.discard(path)
+        if f is not None:
+            f.close()
+
+    def run(self):
+        register_thread(IO_TASK, "io")
+        while True:
+            try:
+                item = self.queue.get(timeout=self.writer.fsync_interval)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                break
+            if isinstance(item, FileOp):
+                self._handle(item)
+            elif item is not None:
+                batch, request = self._drain(item)
+                self._write_batch(batch)
+                if request is not None:
+                    self._handle(request)
+
+            if (self.writer.fsync_policy == FsyncPolicy.PERIODIC and self.dirty
+                    and time.time() - self._last_fsync >= self.writer.fsync_interval):
+                self._fsync_dirty()
+
+        for path in list(self.files):
+            self._close_file(path)
+
+
+class DiskWriter:
+    """后写式磁盘写入器
+
+    分片线程把填满的缓冲区交给有界队列，由少量I/O线程负责实际写盘，
+    这样慢速磁盘不会直接阻塞网络读取。同一文件总是由同一个I/O线程写入，
+    队列满时submit会阻塞，以此对网络端形成反压。
+    io_policy决定写入的数据是否留在页缓存中，见IOPolicy。
+    """
+
+    def __init__(self, io_threads: int = 2, max_pending: int = 64,
+                 fsync_policy: str = FsyncPolicy.NEVER, fsync_interval: float = 5.0,
+                 coalesce_limit: int = 4 * 1024 * 1024, io_policy: str = IOPolicy.BUFFERED,
+                 drop_interval: int = 32 * 1024 * 1024):
+        if io_policy not in IOPolicy.ALL:
+            raise ValueError(f"未知的I/O策略：{io_policy}")
+        self.io_policy = io_policy
+        self.drop_interval = drop_interval  # STREAMING/DIRECT策略下每个文件每写入这么多字节释放一次页缓存
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.coalesce_limit = coalesce_limit
+        self._cond = threading.Condition()
+        self._pending: Dict[str, int] = {}
+        self._errors: Dict[str, Exception] = {}
+        self._stats = DiskWriterStats()
+        self._rate_time = time.time()
+        self._rate_bytes = 0
+        self._threads = [_IOThread(self, max_pending) for _ in range(max(1, io_threads))]
+        for t in self._threads:
+            t.start()
+
+    def set_fsync_policy(self, policy: str, interval: float = None) -> None:
+        """设置fsync策略"""
+        if policy not in FsyncPolicy.ALL:
+            raise ValueError(f"未知的fsync策略：{policy}")
+        self.fsync_policy = policy
+        if interval is not None:
+            self.fsync_interval = max(0.1, interval)
+
+    def set_io_policy(self, policy: str) -> None:
+        """设置页缓存策略，对之后打开的文件生效"""
+        if policy not in IOPolicy.ALL:
+            raise ValueError(f"未知的I/O策略：{policy}")
+        self.io_policy = policy
+
+    def preallocate(self, path: str, size: int) -> None:
+        """创建（或清空）输出文件并预留大小
+
+        BUFFERED策略只设置文件长度（稀疏文件）；其余策略用fallocate实际分配磁盘空间，
+        减少碎片，空间不足时在开始下载前就报错。
+        """
+        with open(path, 'wb') as f:
+            f.truncate(size)
+            if self.io_policy == IOPolicy.BUFFERED or size <= 0 or not hasattr(os, "posix_fallocate"):
+                return
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise
+                print(f"预分配磁盘空间失败，使用稀疏文件：{str(e)}")
+
+    def _thread_for(self, path: str) -> _IOThread:
+        return self._threads[hash(path) % len(self._threads)]
+
+    def submit(self, path: str, offset: int, data: bytes,
+               callback: Optional[Callable[[int], None]] = None) -> None:
+        """提交一次写入，队列满时阻塞"""
+        if not data:
+            return
+        with self._cond:
+            error = self._errors.get(path)
+            if error is not None:
+                raise error
+            self._pending[path] = self._pending.get(path, 0) + 1
+            self._stats.queue_depth += 1
+            self._stats.queued_bytes += len(data)
+        self._thread_for(path).queue.put(WriteRequest(path, offset, data, callback))
+
+    def _on_written(self, path: str, reqs: List[WriteRequest], nbytes: int, error: Optional[Exception],
+                    direct: int = 0, dropped: int = 0):
+        with self._cond:
+            self._stats.queue_depth -= len(reqs)
+            self._stats.queued_bytes -= nbytes
+            self._stats.direct_bytes += direct
+            self._stats.dropped_bytes += dropped
+            if error is None:
+                self._stats.bytes_written += nbytes
+                self._stats.write_calls += 1
+                self._stats.coalesced += len(reqs) - 1
+                self._rate_bytes += nbytes
+            else:
+                self._errors.setdefault(path, error)
+            self._pending[path] -= len(reqs)
+            if self._pending[path] <= 0:
+                del self._pending[path]
+            self._cond.notify_all()
+        if error is None:
+            for req in reqs:
+                if req.callback is not None:
+                    req.callback(len(req.data))
+
+    def _count_fsync(self):
+        with self._cond:
+            self._stats.fsync_calls += 1
+
+    def _count_dropped(self, nbytes: int):
+        with self._cond:
+            self._stats.dropped_bytes += nbytes
+
+    def flush(self, path: str, chunk_done: bool = False) -> None:
+        """等待指定文件的所有待写数据落盘
+
+        chunk_done为True表示一个分片刚写完，按PER_CHUNK策略时会fsync。
+        写入过程中出现的错误会在这里抛出。
+        """
+        with self._cond:
+            while self._pending.get(path, 0) > 0:
+                self._cond.wait()
+            error = self._errors.get(path)
+        if error is not None:
+            raise error
+        if chunk_done and self.fsync_policy == FsyncPolicy.PER_CHUNK:
+            self._thread_for(path).call("fsync", path)
+
+    def close(self, path: str, sync: bool = None) -> None:
+        """写完并关闭文件；sync为None时，除NEVER策略外都会fsync"""
+        try:
+            self.flush(path)
+            if sync is None:
+                sync = self.fsync_policy != FsyncPolicy.NEVER
+            if sync:
+                self._thread_for(path).call("fsync", path)
+            if self.io_policy != IOPolicy.BUFFERED:
+                self._thread_for(path).call("drop", path)
+        finally:
+            self.discard(path)
+
+    def discard(self, path: str) -> None:
+        """丢弃文件句柄和错误状态（用于取消或出错后的清理）"""
+        with self._cond:
+            while self._pending.get(path, 0) > 0:
+                self._cond.wait()
+            self._errors.pop(path, None)
+        self._thread_for(path).call("close", path)
+
+    def get_stats(self) -> DiskWriterStats:
+        """获取写入统计快照"""
+        with self._cond:
+            now = time.time()
+            elapsed = now - self._rate_time
+            if elapsed >= 1:
+                self._stats.throughput = self._rate_bytes / 1024 / elapsed
+                self._rate_time = now
+                self._rate_bytes = 0
+            return DiskWriterStats(**vars(self._stats))
+
+    def shutdown(self) -> None:
+        """停止所有I/O线程"""
+        for t in self._threads:
+            t.queue.put(_STOP)
+        for t in self._threads:
+            t.join()
@@ -0,0 +1,462 @@
+"""分布式分段下载
+
+协调节点负责探测文件大小、切分字节范围并把范围分发给各个工作节点，
+工作节点下载后把数据传回协调节点（或直接写入共享存储）。
+
+协议（HTTP + JSON）：
+    GET  /lease?worker=ID              领取一个范围，返回 {"job", "url", "start", "end", "path"}；
+                                       暂时没有可领取的范围返回204，全部完成返回410
+    PUT  /result?job=ID&worker=ID      上传该范围的数据（请求体为原始字节）
+    POST /done?job=ID&worker=ID        共享存储模式下，数据已经直接写入path
+    POST /fail?job=ID&worker=ID        下载失败，请求体为错误信息，协调节点会重试
+
+用法：
+    python -m utils.distributed coordinator URL SAVE_PATH [--port 8800] [--shared] [--host 0.0.0.0 --token TOKEN]
+    python -m utils.distributed worker http://协调节点:8800 [--id NAME] [--token TOKEN] [--shared]
+    python -m utils.distributed local URL SAVE_PATH [--workers 4]
+
+协调节点默认只监听127.0.0.1；监听其他地址时必须设置token，否则网络上任何人都能通过/result
+写入输出文件。工作节点只有在本机加了--shared时才会写入协调节点给出的path，否则一律上传数据。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from utils.network import get_session, is_loopback, probe_url
+
+PIECE_SIZE = 4 * 1024 * 1024  # 每次分发的范围大小
+READ_BLOCK = 64 * 1024
+
+
+@dataclass
+class RangeJob:
+    """一个待下载的字节范围"""
+    job_id: int
+    start: int
+    end: int
+    attempts: int = 0
+    done: bool = False
+    leases: Dict[str, float] = field(default_factory=dict)  # 工作节点ID -> 领取时间
+
+
+class Coordinator:
+    """协调节点
+
+    范围按顺序分发；没有新范围时，空闲节点会领取已经被领取最久、仍未完成的范围
+    （备份执行，先完成者生效），慢节点和失联节点不会拖住整个下载。
+    失败的范围重新排队，超过max_retries次后整个下载失败。
+    """
+
+    def __init__(self, url: str, save_path: str, host: str = "127.0.0.1", port: int = 0,
+                 piece_size: int = PIECE_SIZE, max_retries: int = 3, lease_timeout: float = 60.0,
+                 shared_storage: bool = False, token: str = "", proxies: Dict[str, str] = None):
+        if not token and not is_loopback(host):
+            raise ValueError(f"监听非本机地址（{host}）时必须设置token")
+        self.url = url
+        self.save_path = save_path
+        self.part_path = save_path + ".part"
+        self.piece_size = piece_size
+        self.max_retries = max_retries
+        self.lease_timeout = lease_timeout
+        self.shared_storage = shared_storage  # 为True时工作节点直接写入part_path（需所有节点可访问）
+        self.token = token
+        self.proxies = proxies
+        self.total_size = 0
+        self.jobs: List[RangeJob] = []
+        self.pending: deque = deque()
+        self.error = ""
+        self.worker_bytes: Dict[str, int] = {}  # 各工作节点完成的字节数
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        if host in ("0.0.0.0", ""):
+            host = "127.0.0.1"
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        """探测文件并开始接受工作节点的请求"""
+        probe = probe_url(self.url, self.proxies)
+        if probe.total_size == 0:
+            raise ValueError("无法获取文件大小")
+        if not probe.accept_ranges:
+            raise ValueError("服务器不支持断点续传，无法分布式下载")
+        self.total_size = probe.total_size
+
+        with open(self.part_path, 'wb') as f:
+            f.truncate(self.total_size)
+
+        for i, start in enumerate(range(0, self.total_size, self.piece_size)):
+            job = RangeJob(job_id=i, start=start, end=min(start + self.piece_size, self.total_size) - 1)
+            self.jobs.append(job)
+            self.pending.append(job)
+        print(f"协调节点：总大小={self.total_size}字节，范围数={len(self.jobs)}，地址={self.address}")
+
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待下载结束，成功时把.part文件重命名为目标文件"""
+        if not self._finished.wait(timeout):
+            return False
+        self._server.shutdown()
+        self._server.server_close()
+        if self.error:
+            raise Exception(self.error)
+        os.replace(self.part_path, self.save_path)
+        return True
+
+    def _lease(self, worker: str) -> Optional[RangeJob]:
+        with self._lock:
+            now = time.time()
+            # 超时未完成的租约视为失效
+            for job in self.jobs:
+                if not job.done:
+                    for w, leased_at in list(job.leases.items()):
+                        if now - leased_at > self.lease_timeout:
+                            del job.leases[w]
+                            if not job.leases and job not in self.pending:
+                                self.pending.append(job)
+
+            while self.pending:
+                job = self.pending.popleft()
+                if not job.done:
+                    job.leases[worker] = now
+                    return job
+
+            # 没有新范围时，领取被占用最久的未完成范围
+            candidates = [job for job in self.jobs
+                          if not job.done and job.leases and worker not in job.leases]
+            if candidates:
+                job = min(candidates, key=lambda j: min(j.leases.values()))
+                job.leases[worker] = now
+                return job
+            return None
+
+    def _complete(self, job: RangeJob, worker: str, nbytes: int) -> bool:
+        """标记范围完成，返回False表示其他节点已经先完成"""
+        with self._lock:
+            if job.done:
+                return False
+            job.done = True
+            job.leases.clear()
+            self.worker_bytes[worker] = self.worker_bytes.get(worker, 0) + nbytes
+            if all(j.done for j in self.jobs):
+                self._finished.set()
+            return True
+
+    def _fail(self, job: RangeJob, worker: str, message: str):
+        with self._lock:
+            # 上传中断时协调节点和工作节点都会报告失败，只算一次；租约已经失效时范围已经重新排队
+            if job.leases.pop(worker, None) is None or job.done:
+                return
+            job.attempts += 1
+            print(f"范围{job.job_id}在{worker}上失败（第{job.attempts}次）：{message}")
+            if job.attempts > self.max_retries:
+                self.error = f"范围 {job.start}-{job.end} 下载失败：{message}"
+                self._finished.set()
+            elif not job.leases:
+                self.pending.appendleft(job)
+
+    def _write(self, offset: int, rfile, length: int):
+        """把请求体写入.part文件对应的偏移处（各请求写入的范围互不重叠，各自打开文件即可）"""
+        with open(self.part_path, 'r+b') as f:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                data = rfile.read(min(READ_BLOCK, remaining))
+                if not data:
+                    raise IOError("数据不完整")
+                f.write(data)
+                remaining -= len(data)
+
+    def _make_handler(self):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code: int, payload: dict = None):
+                body = json.dumps(payload).encode() if payload is not None else b""
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _params(self):
+                query = parse_qs(urlparse(self.path).query)
+                return {k: v[0] for k, v in query.items()}
+
+            def _job(self, params) -> Optional[RangeJob]:
+                try:
+                    index = int(params.get("job", -1))
+                    return coordinator.jobs[index] if index >= 0 else None
+                except (ValueError, IndexError):
+                    return None
+
+            def _authorized(self) -> bool:
+                if coordinator.token and self.headers.get("X-Token") != coordinator.token:
+                    self._reply(403, {"error": "token错误"})
+                    return False
+                return True
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                if urlparse(self.path).path != "/lease":
+                    return self._reply(404)
+                if coordinator._finished.is_set():
+                    return self._reply(410)
+                worker = self._params().get("worker", self.client_address[0])
+                job = coordinator._lease(worker)
+                if job is None:
+                    return self._reply(204)
+                self._reply(200, {
+                    "job": job.job_id,
+                    "url": coordinator.url,
+                    "start": job.start,
+                    "end": job.end,
+                    "path": coordinator.part_path if coordinator.shared_storage else "",
+                })
+
+            def do_PUT(self):
+                if not self._authorized():
+                    return
+                params = self._params()
+                job = self._job(params)
+                length = int(self.headers.get("Content-Length", 0))
+                if job is None or urlparse(self.path).path != "/result":
+                    return self._reply(404)
+                if job.done or length != job.end - job.start + 1:
+                    # 已被其他节点完成或数据长度不对，读掉请求体后拒绝
+                    self.rfile.read(length)
+                    return self._reply(409)
+                try:
+                    coordinator._write(job.start, self.rfile, length)
+                except Exception as e:
+                    coordinator._fail(job, params.get("worker", ""), str(e))
+                    return self._reply(500, {"error": str(e)})
+                # 其他节点先完成时返回409，工作节点不计入完成数
+                self._reply(200 if coordinator._complete(job, params.get("worker", ""), length) else 409)
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                params = self._params()
+                job = self._job(params)
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8", "replace") if length else ""
+                path = urlparse(self.path).path
+                if job is None:
+                    return self._reply(404)
+                if path == "/done":
+                    if not coordinator._complete(job, params.get("worker", ""), job.end - job.start + 1):
+                        return self._reply(409)
+                elif path == "/fail":
+                    coordinator._fail(job, params.get("worker", ""), body)
+                else:
+                    return self._reply(404)
+                self._reply(200)
+
+        return Handler
+
+
+class _UploadBody:
+    """把范围请求的响应包装成定长的请求体，上传时边下载边发送，不在内存中缓存整个范围"""
+
+    def __init__(self, response, length: int):
+        self._blocks = response.iter_content(chunk_size=READ_BLOCK)
+        self._buffer = b""
+        self.length = length
+        self.sent = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self.length - self.sent
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        while len(self._buffer) < size:
+            block = next(self._blocks, None)
+            if block is None:
+                raise IOError(f"数据长度不符：{self.sent + len(self._buffer)}")
+            self._buffer += block
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.sent += len(data)
+        return data
+
+
+def _write_range(path: str, offset: int, length: int, response) -> None:
+    """共享存储：把范围请求的响应直接写入目标文件对应的偏移处"""
+    written = 0
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        for block in response.iter_content(chunk_size=READ_BLOCK):
+            if written + len(block) > length:
+                raise IOError(f"数据长度不符：超过{length}")
+            f.write(block)
+            written += len(block)
+    if written != length:
+        raise IOError(f"数据长度不符：{written}")
+
+
+def run_worker(coordinator_url: str, worker_id: str = "", token: str = "",
+               proxies: Dict[str, str] = None, idle_wait: float = 0.5, shared_storage: bool = False,
+               max_errors: int = 5) -> int:
+    """工作节点主循环，返回完成的范围数（协调节点确认接受的）
+
+    shared_storage为True时才直接写入协调节点给出的path（本机确认挂载了共享存储），
+    否则即使协调节点给出了path也把数据上传给协调节点。
+    领取范围失败时按指数退避重试，连续max_errors次失败后认为协调节点已经退出。
+    """
+    worker_id = worker_id or f"{os.uname().nodename if hasattr(os, 'uname') else 'worker'}-{uuid.uuid4().hex[:6]}"
+    control = get_session()  # 与协调节点通信不走代理
+    download = get_session(proxies)
+    headers = {"X-Token": token} if token else {}
+    completed = 0
+    errors = 0  # 连续领取失败的次数
+
+    while True:
+        try:
+            response = control.get(f"{coordinator_url}/lease", params={"worker": worker_id},
+                                   headers=headers, timeout=30)
+            if response.status_code == 410:
+                break
+            if response.status_code == 204:
+                errors = 0
+                time.sleep(idle_wait)
+                continue
+            response.raise_for_status()
+            job = response.json()
+        except Exception as e:
+            errors += 1
+            if errors >= max_errors:
+                # 协调节点在下载结束后会关闭服务
+                print(f"工作节点{worker_id}：连续{errors}次无法领取范围（{str(e)}），退出")
+                break
+            delay = min(30.0, idle_wait * 2 ** errors)
+            print(f"工作节点{worker_id}：领取范围失败（{str(e)}），{delay:.1f}秒后重试")
+            time.sleep(delay)
+            continue
+        errors = 0
+        params = {"job": job["job"], "worker": worker_id}
+        length = job["end"] - job["start"] + 1
+
+        try:
+            with download.get(job["url"], headers={"Range": f"bytes={job['start']}-{job['end']}"},
+                              stream=True, timeout=30) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise IOError("服务器未返回部分内容")
+                declared = r.headers.get("content-length")
+                if declared is not None and int(declared) != length:
+                    raise IOError(f"数据长度不符：{declared}")
+
+                if job["path"] and shared_storage:
+                    _write_range(job["path"], job["start"], length, r)
+                    reply = control.post(f"{coordinator_url}/done", params=params, headers=headers, timeout=30)
+                else:
+                    # 边下载边上传
+                    reply = control.put(f"{coordinator_url}/result", params=params, data=_UploadBody(r, length),
+                                        headers=headers, timeout=60)
+            if reply.status_code == 409:
+                print(f"工作节点{worker_id}：范围{job['job']}已由其他节点完成")
+            else:
+                reply.raise_for_status()
+                completed += 1
+        except Exception as e:
+            try:
+                control.post(f"{coordinator_url}/fail", params=params, data=str(e).encode("utf-8"),
+                             headers=headers, timeout=30)
+            except Exception as report_error:
+                print(f"工作节点{worker_id}：无法报告范围{job['job']}失败（{str(report_error)}）")
+            time.sleep(idle_wait)
+
+    print(f"工作节点{worker_id}：完成{completed}个范围")
+    return completed
+
+
+def run_local(url: str, save_path: str, workers: int = 4, **kwargs) -> Coordinator:
+    """在本机启动协调节点和若干工作进程（模拟多节点，用于测试）"""
+    coordinator = Coordinator(url, save_path, host="127.0.0.1", **kwargs)
+    coordinator.start()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cmd = [sys.executable, "-m", "utils.distributed", "worker", coordinator.address]
+    if coordinator.token:
+        cmd += ["--token", coordinator.token]
+    if coordinator.shared_storage:
+        cmd.append("--shared")
+    processes = [subprocess.Popen(cmd + ["--id", f"local-{i}"], cwd=root) for i in range(workers)]
+    try:
+        coordinator.wait()
+    finally:
+        for p in processes:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+    return coordinator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分布式分段下载")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p = sub.add_parser("coordinator", help="启动协调节点")
+    p.add_argument("url")
+    p.add_argument("save_path")
+    p.add_argument("--host", default="127.0.0.1", help="监听地址，不是本机地址时必须设置--token")
+    p.add_argument("--port", type=int, default=8800)
+    p.add_argument("--piece-size", type=int, default=PIECE_SIZE)
+    p.add_argument("--shared", action="store_true", help="工作节点直接写入共享存储")
+    p.add_argument("--token", default="")
+
+    p = sub.add_parser("worker", help="启动工作节点")
+    p.add_argument("coordinator")
+    p.add_argument("--id", default="")
+    p.add_argument("--token", default="")
+    p.add_argument("--shared", action="store_true", help="本机可以访问协调节点的共享存储，直接写入其中的文件")
+
+    p = sub.add_parser("local", help="本机启动协调节点和多个工作进程")
+    p.add_argument("url")
+    p.add_argument("save_path")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--piece-size", type=int, default=PIECE_SIZE)
+
+    args = parser.parse_args(argv)
+    if args.mode == "coordinator":
+        try:
+            coordinator = Coordinator(args.url, args.save_path, args.host, args.port, piece_size=args.piece_size,
+                                      shared_storage=args.shared, token=args.token)
+        except ValueError as e:
+            parser.error(str(e))
+        coordinator.start()
+        coordinator.wait()
+        print(f"下载完成：{args.save_path}，各节点字节数：{coordinator.worker_bytes}")
+    elif args.mode == "worker":
+        run_worker(args.coordinator, args.id, args.token, shared_storage=args.shared)
+    else:
+        coordinator = run_local(args.url, args.save_path, args.workers, piece_size=args.piece_size)
+        print(f"下载完成：{args.save_path}，各节点字节数：{coordinator.worker_bytes}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,36 @@
-import requests
-from typing import Dict, Optional, List
-from PyQt6.QtCore import QObject, pyqtSignal, QThread
+from typing import Dict, Optional, List, Tuple
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
 import os
 from dataclasses import dataclass
 from datetime import datetime
 import time
 import uuid
-from plyer import notification
 import threading
-import tempfile
+from functools import partial
+from concurrent.futures import Future, wait as futures_wait
+from utils.disk_writer import DiskWriter
+from utils.executor import RangeExecutor
+from utils.governor import THROTTLE_STATUS, HostGovernor, HostStats, Throttled, parse_retry_after
+from utils.multirange import (MAX_GAP_SIZE, MAX_RANGES, ByteRangesParser, is_supported, mark_unsupported,
+                              multipart_boundary, parse_content_range, range_header)
+from utils.network import ProbeResult, abort_response, get_session, probe_url
+from utils.notifier import Notifier
+from utils.proxy_pool import ProxyPool, ProxyRouter, ProxyStats
+from utils.interfaces import InterfacePool
+from utils.sync import SyncBatch, SyncItem, SyncWorker
+from utils.preflight import SCHEDULES, PreflightItem, PreflightWorker, ProbeCache, order_items, plan_threads
+from utils.compression import (COMPRESSION_MODES, MIN_COMPRESS_SIZE, TRIAL_SECONDS, HostRates, StreamDecoder,
+                               accept_encoding, is_compressible, prefer_compressed)
+from utils.delta import MANIFEST_SUFFIX, copy_reused, load_manifest, plan_delta
+from utils.history import DEFAULT_PATH, HistoryRecord, HistoryStore
+from utils.rangeset import RangeSet
+from utils.profiler import IO_TASK, OTHER_TASK, SamplingProfiler, register_thread, unregister_thread
+from utils.postprocess import HashStep, PostStep, PostStream, run_steps
+from utils.stream_reader import StreamReader
+from utils.throughput import TransferMeter
+
+SMALL_FILE_LIMIT = 1024 * 1024  # 小于1MB的文件走小文件快速通道（与最小分片大小一致）
+STREAM_PIECE_SIZE = 2 * 1024 * 1024  # 流式模式下每个分片的大小
 
 @dataclass
 class ProxyConfig:
@@ -38,7 +60,10 @@ class DownloadChunk:
     end: int
     downloaded: int = 0
     status: str = "等待中"  # 等待中、下载中、已完成、已暂停、错误
-    temp_file: str = ""
+    speed: float = 0.0  # KB/s
+    written: int = 0  # 已写入磁盘的字节数（从分片起点开始连续）
+    wire: int = 0  # 从网络收到的字节数（压缩传输时小于downloaded）
+    received: int = 0  # 累计收到的字节数，只增不减（重试时重新下载的部分也计入），用于估计速度
 
 @dataclass
 class DownloadTask:
@@ -47,7 +72,7 @@ class DownloadTask:
     save_path: str
     total_size: int = 0
     downloaded_size: int = 0
-    status: str = "等待中"  # 等待中、下载中、已完成、已暂停、错误
+    status: str = "等待中"  # 等待中、下载中、处理中、已完成、已暂停、错误
     speed: float = 0.0  # KB/s
     start_time: Optional[datetime] = None
     error_msg: str = ""
@@ -56,10 +81,35 @@ class DownloadTask:
     chunk_size: int = 10 * 1024 * 1024  # 10MB per chunk
     merge_lock: threading.Lock = None
     thread_count: int = 8  # 默认8线程
+    fast_path: bool = False  # 是否先尝试小文件快速通道（批量下载时启用）
+    post_steps: List[PostStep] = None  # 下载完成后的处理步骤（解压、校验、移动等）
+    post_results: Dict[str, object] = None  # 各处理步骤的结果
+    streaming: bool = False  # 流式模式：优先下载最靠前的缺失数据，边下边读
+    readahead: int = 32 * 1024 * 1024  # 流式模式下读取位置之后优先下载的范围
+    stream_position: int = 0  # 流式读取的当前位置
+    proxy_pool: str = ""  # 指定使用的代理池名称，为空时按主机规则或默认代理池选择
+    etag: str = ""  # 服务器返回的ETag，用于增量同步时判断文件是否变化
+    last_modified: str = ""  # 服务器返回的Last-Modified
+    delta_source: str = ""  # 本地旧版本路径，设置后只下载与旧版本不同的块
+    delta_manifest: str = ""  # 块校验清单的URL，为空时使用 url + ".blocks.json"
+    delta_reused: int = 0  # 从旧版本复用的字节数
+    probe: Optional[ProbeResult] = None  # 预检得到的HEAD结果，有时开始下载不再发HEAD
+    compression: str = "auto"  # 传输压缩：auto自动比较、on总是请求压缩、off不压缩，见utils.compression
+    content_type: str = ""  # 服务器返回的Content-Type
+    content_encoding: str = ""  # 实际使用的传输压缩编码，为空表示未压缩
+    wire_bytes: int = 0  # 从网络收到的字节数，downloaded_size为解压后的字节数
+    eta: Optional[float] = None  # 预计剩余秒数，速度为0或大小未知时为None，见utils.throughput
+    ranges: RangeSet = None  # 已经写入.part文件的字节区间，下载状态以它为准（分片只是调度单位），见utils.rangeset
+    ranges_lock: threading.Lock = None
 
     def __post_init__(self):
         self.chunks = []
         self.merge_lock = threading.Lock()
+        self.ranges = RangeSet()
+        self.ranges_lock = threading.Lock()
+        if self.post_steps is None:
+            self.post_steps = []
+        self.post_results = {}
 
     def calculate_chunk_size(self):
         """根据文件大小和线程数计算分片大小"""
@@ -69,23 +119,94 @@ class DownloadTask:
             chunk_size = max(min_chunk, self.total_size // self.thread_count)
             self.chunk_size = chunk_size
 
-class ChunkDownloader(QThread):
-    """分片下载线程"""
-    progress = pyqtSignal(int)  # 下载进度
-    completed = pyqtSignal()    # 完成信号
-    error = pyqtSignal(str)     # 错误信号
-    speed = pyqtSignal(float)   # 下载速度信号
-    status = pyqtSignal(str)    # 状态信号
+    def mark_written(self, offset: int, nbytes: int):
+        """记录一次落盘的写入（写入线程回调）"""
+        with self.ranges_lock:
+            self.ranges.add(offset, offset + nbytes)
 
-    def __init__(self, url: str, chunk: DownloadChunk, proxies: Dict = None):
-        super().__init__()
+    def contiguous_from(self, offset: int) -> int:
+        """从offset开始已经连续写入磁盘的字节数"""
+        with self.ranges_lock:
+            return self.ranges.contiguous_from(offset)
+
+    def missing_ranges(self, start: int = 0, end: int = None, limit: int = None) -> List[Tuple[int, int]]:
+        """[start, end)中还没有写入磁盘的区间（最多limit个），end默认为文件大小"""
+        with self.ranges_lock:
+            return self.ranges.gaps(start, self.total_size if end is None else end, limit)
+
+    def written_in(self, start: int, end: int) -> int:
+        """[start, end)中已经写入磁盘的字节数"""
+        with self.ranges_lock:
+            return self.ranges.covered_in(start, end)
+
+    def written_size(self) -> int:
+        """已经写入磁盘的总字节数（界面和守护进程显示的进度以它为准）"""
+        with self.ranges_lock:
+            return self.ranges.covered
+
+    def largest_gap(self) -> Optional[Tuple[int, int]]:
+        """最大的未写入区间[start, end)，全部写完或大小未知时为None"""
+        with self.ranges_lock:
+            return self.ranges.largest_gap(self.total_size) if self.total_size > 0 else None
+
+    def ranges_snapshot(self) -> RangeSet:
+        """已写入区间的副本，可以在锁外遍历或序列化"""
+        with self.ranges_lock:
+            return self.ranges.copy()
+
+    def available_prefix(self) -> int:
+        """文件开头已经完整可读的字节数"""
+        return self.contiguous_from(0)
+
+class ChunkDownloader:
+    """分片下载作业
+
+    在共享线程池（RangeExecutor）中运行，进度、速度和状态直接记录在DownloadChunk上，
+    由DownloadWorker定时汇总。作业按task.ranges只请求分片中还没有写入磁盘的区间，
+    每个空洞一个范围请求。暂停时作业返回并交还线程和连接，继续时重新提交，
+    从已经提交写盘的位置接着下载。每个连接先向HostGovernor申请，服务器限流或连接
+    被重置时作业把状态改回“等待中”后退出，由DownloadWorker在主机允许时重新提交。
+    """
+
+    write_buffer_size = 256 * 1024  # 攒满256KB再交给写入线程
+
+    max_proxy_attempts = 3  # 使用代理池或多个源地址时，换用不同线路的最大尝试次数
+
+    max_retries = 10  # 限流或连接错误后重新排队的最大连续次数（收到新数据后重新计数）
+
+    def __init__(self, url: str, chunk: DownloadChunk, proxies: Dict = None,
+                 disk_writer: DiskWriter = None, part_path: str = "", on_data=None,
+                 proxy_pool: ProxyPool = None, source_pool: InterfacePool = None, task_id: str = "",
+                 compression: str = "", governor: HostGovernor = None, resumable: bool = True,
+                 task: DownloadTask = None):
         self.url = url
+        self.task_id = task_id
+        self.task = task  # 落盘的区间记录到task.ranges，为None时只累计chunk.written
         self.chunk = chunk
+        self.compression = compression  # 请求压缩时的Accept-Encoding，只用于从头下载整个文件
+        self.content_encoding = None  # 收到响应头后为实际的Content-Encoding（未压缩为空串）
         self.proxies = proxies
+        self.proxy_pool = proxy_pool  # 设置后每次连接从代理池中选择代理
+        self.source_pool = source_pool  # 设置后每次连接绑定到其中一个本机源地址
+        self.disk_writer = disk_writer
+        self.part_path = part_path
+        self.on_data = on_data  # 按顺序收到数据时的回调（用于流式后处理）
+        self.governor = governor or HostGovernor()  # 按主机分配连接
+        self.future: Optional[Future] = None  # 当前这次提交的作业
+        self.resumable = resumable  # 服务器支持范围请求，暂停时可以断开连接
+        self.error = ""  # 分片失败时的错误信息
+        self._holding = False  # 是否占用着主机的一个连接名额
+        self._retries = 0  # 连续重新排队的次数
+        self._retry_offset = chunk.start  # 上次重新排队时的提交位置
+        # 已经提交写盘的位置（分片开头已经写入磁盘时从第一个空洞继续）
+        self._offset = chunk.start + (self._written_prefix(chunk) if on_data is None else 0)
+        self._fed = chunk.start  # 已经交给on_data的位置
+        self._latency = 0.0
+        self._response = None  # 正在读取的响应，取消时从其他线程直接断开
         self.is_paused = False
         self.is_cancelled = False
         self._last_download_time = time.time()
-        self._downloaded_in_period = 0
+        self._received_in_period = chunk.received
         self.current_speed = 0.0
         self._speed_limit = 0  # KB/s
         self._speed_limit_sleep = 0.1  # 限速检查间隔
@@ -94,86 +215,328 @@ class ChunkDownloader(QThread):
         """设置速度限制 (KB/s)"""
         self._speed_limit = limit
 
+    def _written_prefix(self, chunk: DownloadChunk) -> int:
+        """分片开头已经连续写入磁盘的字节数"""
+        if self.task is None:
+            return chunk.written
+        return min(chunk.end + 1 - chunk.start, self.task.contiguous_from(chunk.start))
+
+    def _skips_written(self) -> bool:
+        """是否跳过已经写入磁盘的区间：需要task.ranges和范围请求，流式后处理要按顺序收到全部数据时不跳过"""
+        return self.task is not None and self.resumable and self.on_data is None
+
+    def _progress(self, chunk: DownloadChunk, offset: int) -> int:
+        """分片已经下载的字节数：offset之前已经提交写盘的部分，加上offset之后已经写入磁盘的区间"""
+        if not self._skips_written():
+            return offset - chunk.start
+        return offset - chunk.start + self.task.written_in(offset, chunk.end + 1)
+
+    def _next_span(self) -> Optional[Tuple[int, int]]:
+        """下一个要请求的区间[start, end)：从提交位置跳到下一个空洞，到空洞末尾为止，分片已经完整时返回None"""
+        end = self.chunk.end + 1
+        # 压缩只能从头传输整个文件，不按空洞切开
+        if self._skips_written() and not (self.compression and self._offset == 0):
+            gaps = self.task.missing_ranges(self._offset, end, limit=1)
+            if not gaps:
+                self._offset = end
+                return None
+            self._offset, end = gaps[0]
+        return (self._offset, end) if self._offset < end else None
+
+    def start(self, executor: RangeExecutor) -> bool:
+        """申请主机连接后提交到线程池（暂停或重新排队后再次调用），主机连接已满时返回False"""
+        if not self.governor.acquire(self.url):
+            return False
+        self._holding = True
+        self.chunk.status = "等待中"
+        self.future = executor.submit(self.run)
+        return True
+
+    def done(self) -> bool:
+        return self.future is None or self.future.done()
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待作业结束，超时返回False"""
+        if self.future is None:
+            return True
+        futures_wait([self.future], timeout)
+        return self.future.done()
+
     def run(self):
         try:
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(delete=False) as tf:
-                self.chunk.temp_file = tf.name
-
-            headers = {'Range': f'bytes={self.chunk.start}-{self.chunk.end}'}
-            response = requests.get(
-                self.url,
-                headers=headers,
-                stream=True,
-                proxies=self.proxies,
-                timeout=30,
-                allow_redirects=True
-            )
-            response.raise_for_status()
-
-            self.status.emit("下载中")
-            self.chunk.status = "下载中"
+            self._run()
+        finally:
+            if self._holding:
+                self._holding = False
+                self.governor.release(self.url)
 
-            with open(self.chunk.temp_file, 'wb') as f:
-                start_time = time.time()
-                chunk_size = 8192  # 8KB
-                
-                for data in response.iter_content(chunk_size=chunk_size):
+    def _run(self):
+        import requests
+        import urllib3
+        # 连接被重置、超时等可以重试的错误（直接读取原始响应体时是urllib3的异常）
+        retryable = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                     requests.exceptions.ChunkedEncodingError, urllib3.exceptions.ProtocolError,
+                     urllib3.exceptions.ReadTimeoutError, ConnectionError)
+        if self.is_cancelled:
+            return
+        if self.is_paused:
+            self.chunk.status = "已暂停"
+            return
+        register_thread(self.task_id, "chunk")
+        attempt = 0
+        tried = []  # 本分片已经失败过的代理
+        tried_sources = []  # 本分片已经失败过的源地址
+        try:
+            while True:
+                proxy = self.proxy_pool.acquire(tuple(tried)) if self.proxy_pool is not None else None
+                proxies = proxy.get_proxy_dict() if proxy is not None else self.proxies
+                source = None
+                if self.source_pool is not None:
+                    # 所有源地址都失败过时不再排除，仍然从配置的地址中选择
+                    source = self.source_pool.acquire(tuple(tried_sources)) or self.source_pool.acquire()
+                started = time.time()
+                received = self._received()
+                try:
+                    finished = self._transfer(proxies, source)
+                except Throttled:
+                    # 限流与线路无关，不计入代理和源地址的错误
+                    if proxy is not None:
+                        self.proxy_pool.release(proxy)
+                    if source is not None:
+                        self.source_pool.release(source)
+                    raise
+                except Exception as e:
                     if self.is_cancelled:
+                        # 取消时主动断开的连接不算线路故障
+                        if proxy is not None:
+                            self.proxy_pool.release(proxy)
+                        if source is not None:
+                            self.source_pool.release(source)
                         return
-                        
-                    if self.is_paused:
-                        self.status.emit("已暂停")
-                        self.chunk.status = "已暂停"
-                        while self.is_paused and not self.is_cancelled:
-                            time.sleep(0.1)
-                        if self.is_cancelled:
-                            return
-                        self.status.emit("下载中")
-                        self.chunk.status = "下载中"
-                        start_time = time.time()  # 重置计时
-
-                    if data:
-                        f.write(data)
-                        self.chunk.downloaded += len(data)
-                        
-                        # 计算进度
-                        progress = int((self.chunk.downloaded / (self.chunk.end - self.chunk.start + 1)) * 100)
-                        self.progress.emit(progress)
-                        
-                        # 计算速度
-                        current_time = time.time()
-                        elapsed = current_time - self._last_download_time
-                        if elapsed >= 1:
-                            self.current_speed = (self.chunk.downloaded - self._downloaded_in_period) / 1024 / elapsed  # KB/s
-                            self.speed.emit(self.current_speed)
-                            self._last_download_time = current_time
-                            self._downloaded_in_period = self.chunk.downloaded
-                        
-                        # 速度限制
-                        if self._speed_limit > 0:
-                            actual_speed = len(data) / 1024  # KB
-                            if actual_speed > self._speed_limit * self._speed_limit_sleep:
-                                sleep_time = actual_speed / self._speed_limit - self._speed_limit_sleep
-                                if sleep_time > 0:
-                                    time.sleep(sleep_time)
-
-            self.status.emit("已完成")
-            self.chunk.status = "已完成"
-            self.completed.emit()
+                    if proxy is None and source is None:
+                        raise
+                    route = []
+                    if proxy is not None:
+                        self.proxy_pool.report(proxy, ok=False)
+                        tried.append(self.proxy_pool.key(proxy))
+                        route.append(f"代理 {self.proxy_pool.key(proxy)}")
+                    if source is not None:
+                        self.source_pool.report(source, ok=False)
+                        tried_sources.append(source)
+                        route.append(f"源地址 {source}")
+                    attempt += 1
+                    if attempt >= self.max_proxy_attempts or self.is_cancelled:
+                        raise
+                    print(f"分片通过{'、'.join(route)}下载失败，换用其他线路重试：{str(e)}")
+                    continue
+
+                nbytes = self._received() - received
+                seconds = time.time() - started
+                if proxy is not None:
+                    self.proxy_pool.report(proxy, ok=True, latency=self._latency, nbytes=nbytes, seconds=seconds)
+                if source is not None:
+                    self.source_pool.report(source, ok=True, latency=self._latency, nbytes=nbytes, seconds=seconds)
+                if not finished:
+                    return
+                break
+
+            self._complete()
+
+        except Throttled as e:
+            if self.is_cancelled:
+                return
+            delay = self.governor.throttle(self.url, e.retry_after)
+            self._requeue(str(e) if e.retry_after is not None else f"{e}，{delay:.0f}秒后重试", e)
+
+        except retryable as e:
+            if self.is_cancelled:
+                return
+            self.governor.failure(self.url)
+            self._requeue(f"连接错误：{str(e)}", e)
 
         except Exception as e:
-            self.status.emit("错误")
-            self.chunk.status = "错误"
-            self.error.emit(str(e))
-            print(f"分片下载错误：{str(e)}")  # 添加错误日志
+            if self.is_cancelled:
+                return
+            self._set_error(str(e))
 
         finally:
-            if self.is_cancelled and os.path.exists(self.chunk.temp_file):
-                try:
-                    os.remove(self.chunk.temp_file)
-                except:
-                    pass
+            self._response = None
+            unregister_thread()
+
+    def _received(self) -> int:
+        return self.chunk.received
+
+    def _complete(self):
+        """传输完成：等待数据落盘"""
+        self.disk_writer.flush(self.part_path, chunk_done=True)
+        self.governor.success(self.url)
+        self.chunk.status = "已完成"
+
+    def is_active(self) -> bool:
+        """是否占用任务的一个线程名额（正在运行或等待重新提交）"""
+        return self.chunk.status not in ("已完成", "错误")
+
+    def _requeue(self, reason: str, error: Exception):
+        """限流或连接错误：已经提交写盘的数据保留，作业退出后等待重新提交
+
+        不支持范围请求的服务器只有在还没有收到数据时才能重新开始；
+        连续max_retries次没有收到新数据时分片失败。
+        """
+        if self._offset > self._retry_offset:
+            self._retries = 0
+            self._retry_offset = self._offset
+        self._retries += 1
+        if (not self.resumable and self._offset > self.chunk.start) or self._retries > self.max_retries:
+            self._set_error(str(error))
+            return
+        self.chunk.downloaded = self._progress(self.chunk, self._offset)
+        self.chunk.speed = 0.0
+        self.chunk.status = "等待中"
+        print(f"分片{reason}，重新排队（第{self._retries}次）")
+
+    def _set_error(self, message: str):
+        self.error = message
+        self.chunk.status = "错误"
+        print(f"分片下载错误：{message}")  # 添加错误日志
+
+    def _transfer(self, proxies: Dict, source: str = None) -> bool:
+        """从已经提交写盘的位置开始，依次请求分片中还没有写入磁盘的区间，返回False表示被取消或暂停"""
+        # 上次失败时缓冲区中未提交的数据已经丢失，从提交位置重新请求
+        while True:
+            span = self._next_span()
+            self.chunk.downloaded = self._progress(self.chunk, self._offset)
+            if span is None:
+                return True  # 分片的其余部分已经在磁盘上（其他作业或上次运行写过）
+            if not self._transfer_span(proxies, source, *span):
+                return False
+
+    def _transfer_span(self, proxies: Dict, source: str, offset: int, end: int) -> bool:
+        """下载[offset, end)，返回False表示被取消或暂停"""
+        # 压缩只能从头传输整个文件；范围请求明确要求不压缩，保证收到的字节与偏移对应
+        compressed = bool(self.compression) and offset == 0
+        if compressed:
+            headers = {'Accept-Encoding': self.compression}
+        else:
+            headers = {'Range': f'bytes={offset}-{end - 1}', 'Accept-Encoding': 'identity'}
+        request_time = time.time()
+        response = get_session(proxies, source).get(
+            self.url,
+            headers=headers,
+            stream=True,
+            timeout=30,
+            allow_redirects=True
+        )
+        self._response = response
+        if self.is_cancelled:
+            # 等待响应头期间被取消
+            response.close()
+            return False
+        # 归还连接（中途退出时不关闭会一直占用连接池）
+        with response:
+            if response.status_code in THROTTLE_STATUS:
+                raise Throttled(response.status_code, parse_retry_after(response.headers.get('retry-after')))
+            response.raise_for_status()
+            self._latency = time.time() - request_time
+            encoding = response.headers.get('content-encoding', '').strip().lower()
+            if encoding == 'identity':
+                encoding = ''
+            if encoding and not compressed:
+                raise Exception(f"服务器对范围请求返回了压缩数据（{encoding}）")
+            decoder = StreamDecoder(encoding) if encoding else None
+            self.content_encoding = encoding
+            self.chunk.status = "下载中"
+
+            # 数据直接写入.part文件中分片对应的偏移处，写盘交给写入线程
+            buffer = bytearray()
+            position = offset
+            chunk_size = 64 * 1024  # 64KB
+
+            for data in self._iter_body(response, decoder, chunk_size):
+                if self.is_cancelled:
+                    return False
+
+                if self.is_paused and self.resumable and not decoder:
+                    # 提交已收到的数据后交还线程，继续时用范围请求接着下载
+                    # （压缩传输和不支持范围请求的服务器无法从中间继续，保持连接等待）
+                    self._submit(buffer)
+                    self.chunk.downloaded = self._progress(self.chunk, self._offset)
+                    self.chunk.status = "已暂停"
+                    self.chunk.speed = 0.0
+                    return False
+                while self.is_paused and not self.is_cancelled:
+                    self.chunk.status = "已暂停"
+                    time.sleep(0.1)
+                if self.is_cancelled:
+                    return False
+                self.chunk.status = "下载中"
+
+                if data:
+                    # 重试时只把之前没有处理过的数据交给流式后处理
+                    if self.on_data is not None and position + len(data) > self._fed:
+                        self.on_data(data[max(0, self._fed - position):])
+                        self._fed = position + len(data)
+                    position += len(data)
+                    buffer += data
+                    if len(buffer) >= self.write_buffer_size:
+                        self._submit(buffer)
+                        buffer.clear()
+                    self.chunk.downloaded += len(data)
+                    self.chunk.received += len(data)
+                    
+                    # 计算速度
+                    current_time = time.time()
+                    elapsed = current_time - self._last_download_time
+                    if elapsed >= 1:
+                        self.current_speed = (self.chunk.received - self._received_in_period) / 1024 / elapsed  # KB/s
+                        self.chunk.speed = self.current_speed
+                        self._last_download_time = current_time
+                        self._received_in_period = self.chunk.received
+                        self.governor.success(self.url)
+                        if self.resumable and not decoder and self.governor.shed(self.url):
+                            # 主机连接数减少后多出的连接：提交已收到的数据，交还连接后重新排队
+                            self._holding = False
+                            self._submit(buffer)
+                            self.chunk.downloaded = self._progress(self.chunk, self._offset)
+                            self.chunk.status = "等待中"
+                            self.chunk.speed = 0.0
+                            return False
+                    
+                    # 速度限制
+                    if self._speed_limit > 0:
+                        actual_speed = len(data) / 1024  # KB
+                        if actual_speed > self._speed_limit * self._speed_limit_sleep:
+                            sleep_time = actual_speed / self._speed_limit - self._speed_limit_sleep
+                            if sleep_time > 0:
+                                time.sleep(sleep_time)
+
+            self._submit(buffer)
+            if decoder is not None and position != self.chunk.end + 1:
+                raise Exception(f"解压后的大小与文件大小不符（{position} != {self.chunk.end + 1}）")
+            if position < end:
+                # 按重置的连接处理，重新排队后从提交位置继续
+                raise ConnectionError(f"响应提前结束（{position} < {end}）")
+        return True
+
+    def _iter_body(self, response, decoder: Optional[StreamDecoder], chunk_size: int):
+        """逐块读取原始响应体并统计网络字节数，压缩传输时在这里解压"""
+        for raw in response.raw.stream(chunk_size, decode_content=False):
+            self.chunk.wire += len(raw)
+            yield decoder.decompress(raw) if decoder is not None else raw
+        if decoder is not None:
+            yield decoder.flush()
+
+    def _submit(self, buffer: bytearray):
+        """把缓冲区中的数据交给写入线程，提交位置后移"""
+        if buffer:
+            self.disk_writer.submit(self.part_path, self._offset, bytes(buffer),
+                                    partial(self._on_written, self.chunk, self._offset))
+            self._offset += len(buffer)
+
+    def _on_written(self, chunk: DownloadChunk, offset: int, nbytes: int):
+        """写入线程落盘后的回调"""
+        chunk.written += nbytes
+        if self.task is not None:
+            self.task.mark_written(offset, nbytes)
 
     def pause(self):
         self.is_paused = True
@@ -182,55 +545,296 @@ class ChunkDownloader(QThread):
         self.is_paused = False
 
     def cancel(self):
+        """取消下载，可以从任意线程调用，立即断开正在读取的连接"""
         self.is_cancelled = True
         if self.is_paused:
             self.resume()
+        response = self._response
+        if response is not None:
+            abort_response(response)
+
+
+class MultiRangeDownloader(ChunkDownloader):
+    """多范围请求作业：一个请求下载多个分散的小分片
+
+    服务器返回multipart/byteranges时流式解析，数据按偏移分给各分片；服务器把几个范围
+    合并成一个206响应时同样处理，分片之外的字节丢弃。作业只运行一次，结束后没有下载完的
+    分片交还给DownloadWorker重新调度；服务器不支持多范围请求（返回200或漏掉了范围）
+    时设置fallback，之后改为逐个范围下载。
+    """
+
+    def __init__(self, url: str, chunks: List[DownloadChunk], proxies: Dict = None,
+                 disk_writer: DiskWriter = None, part_path: str = "", proxy_pool: ProxyPool = None,
+                 source_pool: InterfacePool = None, task_id: str = "", governor: HostGovernor = None,
+                 task: DownloadTask = None):
+        super().__init__(url, chunks[0], proxies, disk_writer, part_path, None, proxy_pool, source_pool,
+                         task_id, governor=governor, task=task)
+        self.chunks = chunks
+        self.fallback = False
+        self._committed = [chunk.start + self._written_prefix(chunk) for chunk in chunks]  # 各分片已经提交写盘的位置
+        self._next = list(self._committed)  # 各分片下一个需要的字节
+        self._gaps = [[] for _ in chunks]  # 各分片还需要请求的空洞[start, end)，第一个是正在接收的
+        self._buffers = [bytearray() for _ in chunks]
+
+    def _received(self) -> int:
+        return sum(chunk.received for chunk in self.chunks)
+
+    def is_active(self) -> bool:
+        return not self.done()
+
+    def _set_status(self, status: str):
+        """设置所有没有下载完的分片的状态"""
+        for i, chunk in enumerate(self.chunks):
+            if self._committed[i] <= chunk.end:
+                chunk.status = status
+                chunk.speed = 0.0
+
+    def _transfer(self, proxies: Dict, source: str = None) -> bool:
+        # 上次失败时缓冲区中未提交的数据已经丢失，从提交位置重新请求
+        for i, chunk in enumerate(self.chunks):
+            self._buffers[i].clear()
+            # 只请求还没有写入磁盘的空洞，跳过其他作业或上次运行已经写过的部分
+            if self.task is not None:
+                self._gaps[i] = self.task.missing_ranges(self._committed[i], chunk.end + 1)
+            else:
+                self._gaps[i] = [(self._committed[i], chunk.end + 1)] if self._committed[i] <= chunk.end else []
+            self._committed[i] = self._gaps[i][0][0] if self._gaps[i] else chunk.end + 1
+            chunk.downloaded = self._progress(chunk, self._committed[i])
+        self._next = list(self._committed)
+        ranges = [(start, end - 1) for gaps in self._gaps for start, end in gaps]
+        if not ranges:
+            return True
+        response = get_session(proxies, source).get(
+            self.url,
+            headers={'Range': range_header(ranges), 'Accept-Encoding': 'identity'},
+            stream=True,
+            timeout=30,
+            allow_redirects=True
+        )
+        self._response = response
+        if self.is_cancelled:
+            response.close()
+            return False
+        with response:
+            if response.status_code in THROTTLE_STATUS:
+                raise Throttled(response.status_code, parse_retry_after(response.headers.get('retry-after')))
+            response.raise_for_status()
+            if response.status_code != 206:
+                # 服务器忽略了Range，返回了整个文件
+                self._fall_back(f"服务器对多范围请求返回了HTTP {response.status_code}")
+                return False
+            boundary = multipart_boundary(response.headers.get('content-type', ''))
+            parser = ByteRangesParser(boundary) if boundary else None
+            position = None
+            if parser is None:
+                # 只有一个部分（服务器合并了范围）
+                span = parse_content_range(response.headers.get('content-range', ''))
+                if span is None:
+                    self._fall_back("服务器的206响应缺少Content-Range")
+                    return False
+                position = span[0]
+            self._set_status("下载中")
+            last_report = time.time()
+
+            for data in self._iter_body(response, None, 64 * 1024):
+                if self.is_cancelled:
+                    return False
+                if self.is_paused:
+                    self._commit_all()
+                    self._set_status("已暂停")
+                    return False
+                if parser is not None:
+                    for offset, piece in parser.feed(data):
+                        self._accept(offset, piece)
+                elif data:
+                    self._accept(position, data)
+                    position += len(data)
 
-class DownloadWorker(QThread):
-    """下载管理线程"""
-    chunk_progress = pyqtSignal(str, int, int, float, str)  # task_id, chunk_index, progress, speed, status
+                if time.time() - last_report >= 1:
+                    last_report = time.time()
+                    self.governor.success(self.url)
+                    if self.governor.shed(self.url):
+                        self._holding = False
+                        self._commit_all()
+                        self._set_status("等待中")
+                        return False
 
-    def __init__(self, task_id: str, task: DownloadTask, progress_handler: 'DownloadProgress', proxy_config: 'ProxyConfig'):
+            self._commit_all()
+        missing = sum(1 for i, chunk in enumerate(self.chunks) if self._next[i] <= chunk.end)
+        if missing:
+            self._fall_back(f"服务器的响应缺少{missing}个范围")
+        return True
+
+    def _accept(self, position: int, data: bytes):
+        """把从position开始的数据分给对应的分片，分片已有或不需要的字节丢弃"""
+        end = position + len(data)
+        for i, chunk in enumerate(self.chunks):
+            gaps = self._gaps[i]
+            # 服务器合并范围时一段数据可能跨过分片的几个空洞
+            while gaps and position <= self._next[i] < end:
+                expected = self._next[i]
+                stop = min(end, gaps[0][1])
+                self._buffers[i] += data[expected - position:stop - position]
+                chunk.received += stop - expected
+                chunk.downloaded += stop - expected
+                self._next[i] = stop
+                if stop == gaps[0][1]:
+                    # 空洞收完，提交后跳到下一个空洞
+                    self._commit(i)
+                    gaps.pop(0)
+                    self._committed[i] = self._next[i] = gaps[0][0] if gaps else chunk.end + 1
+                elif len(self._buffers[i]) >= self.write_buffer_size:
+                    self._commit(i)
+
+    def _commit(self, i: int):
+        buffer = self._buffers[i]
+        if buffer:
+            self.disk_writer.submit(self.part_path, self._committed[i], bytes(buffer),
+                                    partial(self._on_written, self.chunks[i], self._committed[i]))
+            self._committed[i] += len(buffer)
+            buffer.clear()
+
+    def _commit_all(self):
+        for i in range(len(self.chunks)):
+            self._commit(i)
+
+    def _fall_back(self, reason: str, remember: bool = True):
+        """改为逐个范围下载；remember为True时表示服务器不支持，该主机之后的任务也不再合并请求"""
+        print(f"{reason}，改为逐个范围下载")
+        self.fallback = True
+        if remember:
+            mark_unsupported(self.url)
+
+    def _complete(self):
+        self.disk_writer.flush(self.part_path, chunk_done=True)
+        self.governor.success(self.url)
+        for i, chunk in enumerate(self.chunks):
+            chunk.status = "已完成" if self._committed[i] > chunk.end else "等待中"
+
+    def _requeue(self, reason: str, error: Exception):
+        """限流时分片交还DownloadWorker稍后重新合并请求，其他错误改为逐个范围下载"""
+        self._commit_all()
+        self._set_status("等待中")
+        if isinstance(error, Throttled):
+            print(f"多范围请求{reason}，稍后重试")
+        else:
+            self._fall_back(f"多范围请求{reason}", remember=False)
+
+    def _set_error(self, message: str):
+        self._commit_all()
+        self._set_status("等待中")
+        self._fall_back(f"多范围请求失败：{message}")
+
+
+class DownloadWorker(QObject):
+    """下载任务
+
+    不占用专门的线程：探测、准备、合并和后处理作为作业提交到任务线程池，各分片作为作业
+    提交到分片线程池；传输期间由Downloader的定时器在界面线程调用tick()，调度分片并
+    汇总进度。
+    """
+    finished = pyqtSignal()  # 任务结束（完成、失败或取消）
+
+    teardown_timeout = 3.0  # 取消后等待分片作业退出的最长时间（秒）
+
+    def __init__(self, task_id: str, task: DownloadTask, progress_handler: 'DownloadProgress', proxy_config: 'ProxyConfig',
+                 disk_writer: DiskWriter = None, post_pool=None, notifier: Notifier = None,
+                 proxy_router: ProxyRouter = None, source_pool: InterfacePool = None,
+                 host_rates: HostRates = None, executor: RangeExecutor = None,
+                 task_executor: RangeExecutor = None, governor: HostGovernor = None,
+                 meter: TransferMeter = None):
         super().__init__()
         self.task_id = task_id
         self.task = task
         self.progress_handler = progress_handler
         self.proxy_config = proxy_config
+        self.disk_writer = disk_writer or DiskWriter()
+        self.part_path = task.save_path + ".part"  # 下载过程中的文件，完成后重命名
+        self.post_pool = post_pool  # 执行后处理的进程池，为None时在本线程执行
+        self.notifier = notifier
+        self.proxy_pool = proxy_router.pool_for(task.url, task.proxy_pool) if proxy_router else None
+        self.source_pool = source_pool
+        self.post_stream: Optional[PostStream] = None
+        self.executor = executor or RangeExecutor(task.thread_count, "range")  # 分片作业
+        self.task_executor = task_executor or RangeExecutor(1, "task")  # 探测、合并等作业
+        self.governor = governor or HostGovernor()  # 所有任务共用的按主机连接控制
+        self.meter = meter or TransferMeter()  # 所有任务共用的速度统计
+        self.phase = "等待"  # 等待 / 准备 / 传输 / 收尾 / 结束
         self.is_paused = False
         self.is_cancelled = False
-        self.chunk_threads: List[ChunkDownloader] = []
+        self.chunk_jobs: List[ChunkDownloader] = []
+        self._started: set = set()  # 已经提交过作业的分片序号
+        self._accept_ranges = True
+        self._multirange = True  # 剩余的小分片是否合并成多范围请求
+        self._switching = None  # 压缩试下载改为分段下载时正在停止的作业和原本的分片数
+        self._done = threading.Event()
+        self._proxies: Dict = {}
+        self._on_data = None
+        self._compression = ""  # 请求压缩时的Accept-Encoding
+        self._response = None  # 快速通道正在读取的响应
+        self.host_rates = host_rates
+        self._planned_chunks: Optional[List[DownloadChunk]] = None  # 压缩试下载期间原本的分片
+        self._trial_deadline = 0.0
         self._speed_limit = 0.0
-        self._last_download_time = time.time()
-        self._downloaded_in_period = 0
+        self._last_speed_report = 0.0
+
+    def _request_session(self):
+        """探测等单次请求使用的会话：有代理池或多个源地址时取当前最优的线路，否则使用全局代理"""
+        proxies = self.proxy_config.get_proxy_dict()
+        if self.proxy_pool is not None:
+            proxy = self.proxy_pool.acquire(reserve=False)
+            if proxy is not None:
+                proxies = proxy.get_proxy_dict()
+        source = self.source_pool.acquire(reserve=False) if self.source_pool is not None else None
+        return get_session(proxies, source)
 
     def _init_download(self):
         """初始化下载，获取文件大小并创建分片"""
+        import requests
+        if self.task.probe is not None:
+            # 预检阶段已经探测过
+            self._create_chunks(requests.structures.CaseInsensitiveDict(self.task.probe.headers))
+            return
         try:
             # 先发送HEAD请求获取文件大小
-            response = requests.head(
+            response = self._request_session().head(
                 self.task.url,
-                proxies=self.proxy_config.get_proxy_dict(),
+                headers={'Accept-Encoding': 'identity'},  # 取未压缩的大小
                 timeout=30,
                 allow_redirects=True  # 允许重定向
             )
             response.raise_for_status()
-            
-            # 检查是否支持断点续传
-            if 'accept-ranges' not in response.headers:
-                # 不支持断点续传，使用单线程下载
-                self.task.thread_count = 1
-                self.task.total_size = int(response.headers.get('content-length', 0))
-                if self.task.total_size == 0:
-                    raise ValueError("无法获取文件大小")
-                self.task.chunks = [DownloadChunk(start=0, end=self.task.total_size-1)]
-                return
+            self._create_chunks(response.headers)
+
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"初始化下载失败：{str(e)}")
 
-            total_size = int(response.headers.get('content-length', 0))
-            if total_size == 0:
+    def _create_chunks(self, headers):
+        """根据响应头中的文件大小和断点续传支持情况创建分片"""
+        self._record_validators(headers)
+        self.task.content_type = headers.get('content-type', '')
+        # 检查是否支持断点续传
+        if 'accept-ranges' not in headers:
+            # 不支持断点续传，使用单线程下载
+            self._accept_ranges = False
+            self.task.thread_count = 1
+            self.task.total_size = int(headers.get('content-length', 0))
+            if self.task.total_size == 0:
                 raise ValueError("无法获取文件大小")
+            self.task.chunks = [DownloadChunk(start=0, end=self.task.total_size-1)]
+            return
 
-            self.task.total_size = total_size
-            
+        total_size = int(headers.get('content-length', 0))
+        if total_size == 0:
+            raise ValueError("无法获取文件大小")
+
+        self.task.total_size = total_size
+
+        if self.task.streaming:
+            # 流式模式切成小分片，按读取位置逐个调度，线程数只表示并发连接数
+            chunk_size = STREAM_PIECE_SIZE
+            chunk_count = (total_size + chunk_size - 1) // chunk_size
+        else:
             # 根据线程数计算分片大小
             chunk_size = total_size // self.task.thread_count
             
@@ -240,187 +844,584 @@ class DownloadWorker(QThread):
                 chunk_size = min_chunk_size
                 thread_count = max(1, total_size // chunk_size)
                 self.task.thread_count = thread_count
-            
-            # 创建分片
-            chunks = []
-            for i in range(self.task.thread_count):
-                start = i * chunk_size
-                if i == self.task.thread_count - 1:
-                    # 最后一个分片包含剩余的所有数据
-                    end = total_size - 1
-                else:
-                    end = start + chunk_size - 1
-                chunks.append(DownloadChunk(start=start, end=end))
-            
-            self.task.chunks = chunks
-            print(f"初始化下载：总大小={total_size}字节，分片数={len(chunks)}")
+            chunk_count = self.task.thread_count
+        
+        # 创建分片
+        chunks = []
+        for i in range(chunk_count):
+            start = i * chunk_size
+            if i == chunk_count - 1:
+                # 最后一个分片包含剩余的所有数据
+                end = total_size - 1
+            else:
+                end = start + chunk_size - 1
+            chunks.append(DownloadChunk(start=start, end=end))
+        
+        self.task.chunks = chunks
+        print(f"初始化下载：总大小={total_size}字节，分片数={len(chunks)}")
+        if len(chunks) <= 32:
             for i, chunk in enumerate(chunks):
                 print(f"分片{i+1}: {chunk.start}-{chunk.end}")
 
+    def _fast_download(self) -> bool:
+        """小文件快速通道
+
+        不发HEAD，直接在连接池上GET一次，响应体小于SMALL_FILE_LIMIT时在内存中
+        攒齐后一次写入目标文件，不创建分片线程和.part文件。返回True表示已下载完成；
+        响应体过大时返回False，交给多分片流程继续处理。
+        """
+        import requests
+        try:
+            response = self._request_session().get(
+                self.task.url,
+                headers={'Accept-Encoding': 'identity'} if self.task.compression == "off" else None,
+                stream=True,
+                timeout=30,
+                allow_redirects=True
+            )
         except requests.exceptions.RequestException as e:
-            raise Exception(f"初始化下载失败：{str(e)}")
+            raise Exception(f"下载失败：{str(e)}")
+
+        self._response = response
+        if self.is_cancelled:
+            response.close()
+            return True
+
+        with response:
+            response.raise_for_status()
+            self._record_validators(response.headers)
+            length = int(response.headers.get('content-length', 0) or 0)
+            if length > SMALL_FILE_LIMIT:
+                # 已经拿到响应头，直接用它创建分片，省掉一次HEAD；
+                # 压缩响应的Content-Length不是文件大小，这时仍需HEAD
+                if not response.headers.get('content-encoding'):
+                    self._create_chunks(response.headers)
+                return False
+
+            body = bytearray()
+            for data in response.iter_content(chunk_size=64 * 1024):
+                if self.is_cancelled:
+                    return True
+                body += data
+                if len(body) > SMALL_FILE_LIMIT:
+                    # 没有Content-Length且实际内容较大，改走多分片流程
+                    return False
+
+        # 先写.part再重命名，覆盖已有文件时不会留下写了一半的文件
+        with open(self.part_path, 'wb') as f:
+            f.write(body)
+        os.replace(self.part_path, self.task.save_path)
+        self.task.total_size = len(body)
+        self.task.downloaded_size = len(body)
+        self.task.mark_written(0, len(body))
+        return True
+
+    def _apply_delta(self):
+        """增量更新：从旧版本复制未变化的块，只为变化的区间创建分片
+
+        拿不到块清单或清单与文件不符时照常下载完整文件。
+        """
+        manifest_url = self.task.delta_manifest or self.task.url + MANIFEST_SUFFIX
+        try:
+            response = self._request_session().get(manifest_url, timeout=30)
+            response.raise_for_status()
+            manifest = load_manifest(response.json())
+        except Exception as e:
+            print(f"获取块清单失败，下载完整文件：{str(e)}")
+            return
+        if manifest["size"] != self.task.total_size:
+            print(f"块清单与文件大小不符（{manifest['size']} != {self.task.total_size}），下载完整文件")
+            return
+
+        # 只比较相同偏移处的块：在任务线程中运行，滚动查找会让开始传输前的准备时间过长
+        plan = plan_delta(manifest, self.task.delta_source, rolling=False)
+        copy_reused(plan, self.task.delta_source, self.part_path)
+
+        # 复用的区间记为已写入（显示为已完成的分片），其余空洞按原来的分片大小切开
+        chunks = []
+        for dst, _, n in plan.reuse:
+            self.task.mark_written(dst, n)
+            chunks.append(DownloadChunk(start=dst, end=dst + n - 1, downloaded=n, status="已完成", written=n))
+        piece = max(manifest["block_size"], self.task.total_size // max(1, self.task.thread_count))
+        for start, end in self.task.missing_ranges():
+            for pos in range(start, end, piece):
+                chunks.append(DownloadChunk(start=pos, end=min(end, pos + piece) - 1))
+        self.task.chunks = sorted(chunks, key=lambda c: c.start)
+        self.task.delta_reused = plan.reused_bytes
+
+        # 合并后校验整个文件，放在其他后处理步骤之前
+        if manifest.get("sha256"):
+            self.task.post_steps = [HashStep("sha256", manifest["sha256"])] + (self.task.post_steps or [])
+        print(f"增量更新：复用{plan.reused_bytes}字节，需要下载"
+              f"{self.task.total_size - plan.reused_bytes}字节（{len(plan.missing)}个区间）")
+
+    def _plan_compression(self):
+        """决定是否请求压缩传输
+
+        压缩只能用于单连接从头下载整个文件。不能分段下载（只有一个分片）时直接请求压缩；
+        自动模式下可以分段时先用压缩单连接试下载TRIAL_SECONDS秒，再由_check_compression
+        比较两种方式的速度。流式模式和增量更新需要按范围下载，不使用压缩。
+        """
+        task = self.task
+        if task.compression == "off" or task.streaming or task.delta_source or task.total_size <= 0:
+            return
+        if task.compression == "auto" and (task.total_size < MIN_COMPRESS_SIZE
+                                            or not is_compressible(task.content_type, task.url)):
+            return
+        if len(task.chunks) > 1:
+            if task.compression == "auto":
+                self._planned_chunks = task.chunks
+                self._trial_deadline = time.time() + TRIAL_SECONDS
+            task.chunks = [DownloadChunk(start=0, end=task.total_size - 1)]
+            task.thread_count = 1
+        self._compression = accept_encoding()
+
+    def _check_compression(self):
+        """试下载结束或服务器没有压缩时，决定继续压缩单连接还是改为分段下载
+
+        改为分段下载时已经收到的开头部分保留为已完成的分片，只为剩余部分创建分片。
+        """
+        if self._switching is not None:
+            self._split_after_trial()
+            return
+        if self._planned_chunks is None or not self.chunk_jobs:
+            return
+        job = self.chunk_jobs[0]
+        chunk = self.task.chunks[0]
+        if job.content_encoding is None and time.time() < self._trial_deadline + 30:
+            return  # 还没有收到响应头
+        if job.content_encoding and time.time() < self._trial_deadline:
+            return
+        planned = self._planned_chunks
+        self._planned_chunks = None
+        if chunk.status == "已完成":
+            return
+
+        elapsed = max(1e-3, time.time() - (self._trial_deadline - TRIAL_SECONDS))
+        decoded_rate = chunk.downloaded / elapsed
+        wire_rate = chunk.wire / elapsed
+        host_rate = self.host_rates.get(self.task.url) if self.host_rates is not None else None
+        if job.content_encoding and prefer_compressed(decoded_rate, wire_rate, len(planned), host_rate):
+            print(f"使用{job.content_encoding}压缩单连接下载：解压后{decoded_rate / 1024:.0f}KB/s，"
+                  f"网络{wire_rate / 1024:.0f}KB/s")
+            return
+
+        reason = "服务器未压缩" if not job.content_encoding else \
+            f"压缩单连接解压后{decoded_rate / 1024:.0f}KB/s，慢于分段下载"
+        print(f"{reason}，改为{len(planned)}个连接分段下载")
+        # 停止压缩连接，作业退出后再重新切分
+        job.cancel()
+        self._switching = (job, len(planned))
+        self._split_after_trial()
+
+    def _split_after_trial(self):
+        """压缩试下载的作业退出后，保留已经提交写盘的开头部分，为剩余部分创建分片"""
+        job, count = self._switching
+        if not job.done():
+            return
+        self._switching = None
+        chunk = job.chunk
+        prefix = job._offset
+        chunks = []
+        if prefix > 0:
+            chunk.end = prefix - 1
+            chunk.downloaded = prefix
+            chunk.status = "已完成"
+            chunks.append(chunk)
+        piece = max(1024 * 1024, (self.task.total_size - prefix + count - 1) // count)
+        for start in range(prefix, self.task.total_size, piece):
+            chunks.append(DownloadChunk(start=start, end=min(self.task.total_size - 1, start + piece - 1)))
+        self.task.chunks = chunks
+        self.task.thread_count = count
+        self.chunk_jobs = []
+        if self.post_stream is not None:
+            # 流式后处理只能按顺序接收整个文件，改为下载完成后再处理
+            self.post_stream.abort()
+            self.post_stream = None
+            self._on_data = None
+        self._started = {0} if prefix > 0 else set()
+        self._compression = ""
+        print(f"保留压缩试下载已收到的{prefix}字节")
+
+    def _record_rate(self):
+        """记录压缩方式和该主机多连接下载的总速度，供以后的压缩决策参考"""
+        if self._compression and self.chunk_jobs:
+            self.task.content_encoding = self.chunk_jobs[0].content_encoding or ""
+        elif self.host_rates is not None and len(self.task.chunks) > 1 and self.task.start_time:
+            elapsed = (datetime.now() - self.task.start_time).total_seconds()
+            if elapsed > 0:
+                self.host_rates.update(self.task.url, (self.task.total_size - self.task.delta_reused) / elapsed)
+
+    def _record_validators(self, headers):
+        """记录响应头中的ETag和Last-Modified"""
+        self.task.etag = headers.get('etag', '')
+        self.task.last_modified = headers.get('last-modified', '')
+
+    def _prepare_part_file(self):
+        """创建.part文件并预留文件大小（按I/O策略预分配磁盘空间），各分片直接写入自己的偏移处"""
+        self.disk_writer.preallocate(self.part_path, self.task.total_size)
 
     def _merge_chunks(self):
-        """合并下载的分片"""
-        with open(self.task.save_path, 'wb') as outfile:
-            for chunk in self.task.chunks:
-                if os.path.exists(chunk.temp_file):
-                    with open(chunk.temp_file, 'rb') as infile:
-                        outfile.write(infile.read())
-                    # 删除临时文件
-                    try:
-                        os.remove(chunk.temp_file)
-                    except:
-                        pass
+        """合并下载的分片
 
-    def run(self):
+        分片已经直接写入.part文件，这里只需等待写入完成并重命名为目标文件
+        """
+        with self.task.merge_lock:
+            self.disk_writer.close(self.part_path)
+            os.replace(self.part_path, self.task.save_path)
+
+    def _post_process(self):
+        """执行后处理步骤
+
+        已经在下载过程中流式完成的步骤直接取结果，其余步骤交给进程池，
+        避免解压、哈希等CPU密集的工作和传输线程争抢GIL。
+        """
+        if not self.task.post_steps:
+            return
+        self.task.status = "处理中"
+        self.progress_handler.status.emit(self.task_id, "处理中")
+
+        done = self.post_stream.close() if self.post_stream is not None else {}
+        self.post_stream = None
+        if self.post_pool is not None:
+            future = self.post_pool.submit(run_steps, self.task.post_steps, self.task.save_path, done)
+            path, results = future.result()
+        else:
+            path, results = run_steps(self.task.post_steps, self.task.save_path, done)
+        self.task.save_path = path
+        self.task.post_results.update(results)
+
+    def start(self):
+        """开始任务：提交准备作业"""
+        self.phase = "准备"
+        self.task_executor.submit(self._guard, self._prepare)
+
+    def wait(self, msecs: int = None) -> bool:
+        """等待任务结束，超时返回False"""
+        return self._done.wait(None if msecs is None else msecs / 1000)
+
+    def isFinished(self) -> bool:
+        return self._done.is_set()
+
+    def _guard(self, step):
+        """在任务线程池中执行一个阶段，出错时结束任务"""
+        register_thread(self.task_id, "worker")
         try:
-            # 初始化下载
+            step()
+        except Exception as e:
+            if self.is_cancelled:
+                # 取消时主动断开连接引起的异常
+                self._close()
+                return
+            self._fail(str(e))
+        finally:
+            unregister_thread()
+
+    def _fail(self, message: str):
+        """任务失败：停止分片作业并通知"""
+        self._teardown()
+        self.task.status = "错误"
+        self.task.error_msg = message
+        self.progress_handler.error.emit(self.task_id, message)
+
+        # 显示错误通知
+        filename = os.path.basename(self.task.save_path)
+        self._show_notification(
+            "下载失败",
+            f"文件 {filename} 下载失败：{message}",
+            success=False
+        )
+        self._cleanup()
+
+    def _prepare(self):
+        """探测文件、创建分片和.part文件，之后进入传输阶段"""
+        if self.task.fast_path:
+            if self._fast_download():
+                if not self.is_cancelled:
+                    self._post_process()
+                    self.task.status = "已完成"
+                    self.progress_handler.progress.emit(self.task_id, 100)
+                    self.progress_handler.status.emit(self.task_id, "已完成")
+                    self.progress_handler.completed.emit(self.task_id)
+                    self._show_notification(
+                        "下载完成",
+                        f"文件 {os.path.basename(self.task.save_path)} 已下载完成"
+                    )
+                self._cleanup()
+                return
+
+        # 初始化下载（快速通道已经创建好分片时跳过HEAD）
+        if not self.task.chunks:
             self._init_download()
-            
-            self.task.start_time = datetime.now()
+
+        self._prepare_part_file()
+        if self.task.delta_source:
+            self._apply_delta()
+        self._plan_compression()
+
+        self.task.start_time = datetime.now()
+        if not self.is_paused:
             self.task.status = "下载中"
             self.progress_handler.status.emit(self.task_id, "下载中")
 
-            # 创建并启动分片下载线程
-            proxies = self.proxy_config.get_proxy_dict()
-            for i, chunk in enumerate(self.task.chunks):
-                downloader = ChunkDownloader(self.task.url, chunk, proxies)
-                downloader.progress.connect(lambda p, i=i: self._update_chunk_progress(i, p))
-                downloader.speed.connect(lambda s, i=i: self._update_chunk_speed(i, s))
-                downloader.status.connect(lambda st, i=i: self._update_chunk_status(i, st))
-                downloader.error.connect(lambda e: self.progress_handler.error.emit(self.task_id, e))
-                self.chunk_threads.append(downloader)
-                downloader.start()
-
-            # 等待所有分片完成
-            while True:
-                if self.is_cancelled:
-                    for thread in self.chunk_threads:
-                        thread.cancel()
-                    for thread in self.chunk_threads:
-                        thread.wait()
-                    return
+        # 单个分片从头下载整个文件时边下边做后处理
+        on_data = None
+        if self.task.post_steps and len(self.task.chunks) == 1 and self.task.chunks[0].start == 0:
+            self.post_stream = PostStream(self.task.post_steps, self.task.save_path)
+            on_data = self.post_stream.feed
 
-                if self.is_paused:
-                    for thread in self.chunk_threads:
-                        thread.pause()
-                    continue
+        self._proxies = self.proxy_config.get_proxy_dict()
+        self._on_data = on_data
+        # 之后由tick()调度分片（流式模式下按读取位置逐步启动）
+        self.phase = "传输"
+
+    def tick(self):
+        """传输阶段的定时处理（在界面线程中调用）：调度分片、汇总进度和速度"""
+        if self.phase != "传输":
+            return
+        if self.is_cancelled:
+            self.phase = "收尾"
+            self.task_executor.submit(self._guard, self._close)
+            return
+        if self.is_paused:
+            return
+        try:
+            self._tick()
+        except Exception as e:
+            self.phase = "收尾"
+            message = str(e)
+            self.task_executor.submit(self._guard, lambda: self._fail(message))
 
-                # 检查是否所有分片都完成
-                all_completed = True
-                total_downloaded = 0
-                for chunk in self.task.chunks:
-                    if chunk.status != "已完成":
-                        all_completed = False
-                    total_downloaded += chunk.downloaded
-
-                # 更新总进度
-                self.task.downloaded_size = total_downloaded
-                progress = int((total_downloaded / self.task.total_size) * 100)
-                self.progress_handler.progress.emit(self.task_id, progress)
-
-                # 计算速度
-                current_time = time.time()
-                elapsed = current_time - self._last_download_time
-                if elapsed >= 1:
-                    speed = (total_downloaded - self._downloaded_in_period) / 1024 / elapsed  # KB/s
-                    self.task.speed = speed
-                    self.progress_handler.speed.emit(self.task_id, speed)
-                    self._last_download_time = current_time
-                    self._downloaded_in_period = total_downloaded
-
-                if all_completed:
+    def _tick(self):
+        self._check_compression()
+        for job in self.chunk_jobs:
+            if job.error:
+                raise Exception(job.error)
+        self._release_groups()
+        # 暂停后继续、限流或连接错误后重新排队的分片作业，在主机允许时重新提交
+        for job in self.chunk_jobs:
+            if job.chunk.status in ("已暂停", "等待中") and job.done():
+                if not job.start(self.executor):
                     break
+        self._schedule_chunks()
 
-                time.sleep(0.1)
+        # 检查是否所有分片都完成
+        all_completed = True
+        total_received = 0
+        total_wire = 0
+        for chunk in self.task.chunks:
+            if chunk.status != "已完成":
+                all_completed = False
+            total_received += chunk.received
+            total_wire += chunk.wire
 
-            # 合并分片
-            self._merge_chunks()
+        # 更新总进度：以已经写入磁盘的区间为准（分片之间重叠或跳过已写区间时按分片累加会不准）
+        total_downloaded = self.task.written_size()
+        self.task.downloaded_size = total_downloaded
+        self.task.wire_bytes = total_wire
+        progress = int((total_downloaded / self.task.total_size) * 100)
+        self.progress_handler.progress.emit(self.task_id, progress)
 
-            self.task.status = "已完成"
-            self.progress_handler.status.emit(self.task_id, "已完成")
-            self.progress_handler.completed.emit(self.task_id)
+        # 速度和剩余时间由共用的TransferMeter估计，每秒通知一次界面
+        rates = self.meter.sample(self.task_id, self.task.url, total_received, total_downloaded, self.task.total_size)
+        current_time = time.time()
+        if current_time - self._last_speed_report >= 1:
+            self.task.speed = rates.rate / 1024  # KB/s
+            self.task.eta = rates.eta
+            self.progress_handler.speed.emit(self.task_id, self.task.speed)
+            self._last_speed_report = current_time
 
-            # 显示完成通知
-            filename = os.path.basename(self.task.save_path)
-            self._show_notification(
-                "下载完成",
-                f"文件 {filename} 已下载完成"
-            )
+        if all_completed and self._switching is None:
+            self.phase = "收尾"
+            self.task_executor.submit(self._guard, self._finish)
 
-        except Exception as e:
-            self.task.status = "错误"
-            self.task.error_msg = str(e)
-            self.progress_handler.error.emit(self.task_id, str(e))
-
-            # 显示错误通知
-            filename = os.path.basename(self.task.save_path)
-            self._show_notification(
-                "下载失败",
-                f"文件 {filename} 下载失败：{str(e)}"
-            )
+    def _finish(self):
+        """所有分片完成后合并、后处理并通知"""
+        self._record_rate()
 
-        finally:
-            # 清理临时文件
-            for chunk in self.task.chunks:
-                if os.path.exists(chunk.temp_file):
-                    try:
-                        os.remove(chunk.temp_file)
-                    except:
-                        pass
-
-    def _update_chunk_progress(self, chunk_index: int, progress: int):
-        """更新分片下载进度"""
-        chunk = self.task.chunks[chunk_index]
-        chunk_size = chunk.end - chunk.start + 1
-        chunk.downloaded = int(chunk_size * progress / 100)
-        self.chunk_progress.emit(self.task_id, chunk_index, progress, 
-                               self.chunk_threads[chunk_index].current_speed,
-                               chunk.status)
-
-    def _update_chunk_speed(self, chunk_index: int, speed: float):
-        """更新分片下载速度"""
-        self.chunk_progress.emit(self.task_id, chunk_index, 
-                               int((self.task.chunks[chunk_index].downloaded / 
-                                   (self.task.chunks[chunk_index].end - 
-                                    self.task.chunks[chunk_index].start + 1)) * 100),
-                               speed,
-                               self.task.chunks[chunk_index].status)
-
-    def _update_chunk_status(self, chunk_index: int, status: str):
-        """更新分片状态"""
-        self.task.chunks[chunk_index].status = status
-        self.chunk_progress.emit(self.task_id, chunk_index,
-                               int((self.task.chunks[chunk_index].downloaded /
-                                   (self.task.chunks[chunk_index].end -
-                                    self.task.chunks[chunk_index].start + 1)) * 100),
-                               self.chunk_threads[chunk_index].current_speed,
-                               status)
-
-    def _show_notification(self, title: str, message: str):
+        # 合并分片
+        self._merge_chunks()
+
+        # 后处理（解压、校验、移动等）
+        self._post_process()
+
+        self.task.status = "已完成"
+        self.progress_handler.status.emit(self.task_id, "已完成")
+        self.progress_handler.completed.emit(self.task_id)
+
+        # 显示完成通知
+        filename = os.path.basename(self.task.save_path)
+        self._show_notification(
+            "下载完成",
+            f"文件 {filename} 已下载完成"
+        )
+        self._cleanup()
+
+    def _close(self):
+        """取消后等待分片作业退出（有时间上限）并清理"""
+        self._teardown()
+        self._cleanup()
+
+    def _cleanup(self):
+        """任务结束：中止流式后处理，删除未完成的.part文件"""
+        if self._done.is_set():
+            return
         try:
-            notification.notify(
-                title=title,
-                message=message,
-                app_icon=None,
-                timeout=10,
-            )
-        except Exception:
-            pass
+            if self.post_stream is not None:
+                self.post_stream.abort()
+                self.post_stream = None
+
+            # 清理未完成的.part文件
+            if os.path.exists(self.part_path):
+                self.disk_writer.discard(self.part_path)
+                try:
+                    os.remove(self.part_path)
+                except:
+                    pass
+        finally:
+            self.phase = "结束"
+            self._done.set()
+            self.finished.emit()
+
+    def _start_chunk(self, chunk_index: int) -> bool:
+        """创建并启动一个分片下载作业，主机连接已满时返回False"""
+        i = chunk_index
+        job = ChunkDownloader(self.task.url, self.task.chunks[i], self._proxies,
+                              self.disk_writer, self.part_path, self._on_data, self.proxy_pool,
+                              self.source_pool, self.task_id,
+                              self._compression if self.task.chunks[i].start == 0 else "",
+                              governor=self.governor, resumable=self._accept_ranges, task=self.task)
+        if not job.start(self.executor):
+            return False
+        self.chunk_jobs.append(job)
+        self._started.add(i)
+        return True
+
+    def _start_group(self, indexes: List[int]) -> bool:
+        """用一个多范围请求下载几个小分片，主机连接已满时返回False"""
+        job = MultiRangeDownloader(self.task.url, [self.task.chunks[i] for i in indexes], self._proxies,
+                                   self.disk_writer, self.part_path, self.proxy_pool, self.source_pool,
+                                   self.task_id, self.governor, self.task)
+        job.indexes = indexes
+        if not job.start(self.executor):
+            return False
+        self.chunk_jobs.append(job)
+        self._started.update(indexes)
+        return True
+
+    def _release_groups(self):
+        """结束的多范围请求作业中没有下载完的分片重新参与调度"""
+        for job in [job for job in self.chunk_jobs if isinstance(job, MultiRangeDownloader) and job.done()]:
+            self.chunk_jobs.remove(job)
+            if job.fallback:
+                self._multirange = False
+            for i in job.indexes:
+                if self.task.chunks[i].status != "已完成":
+                    self._started.discard(i)
+
+    def _schedule_groups(self, pending: List[int], slots: int) -> tuple:
+        """把剩余不超过MAX_GAP_SIZE的分片分成若干组，每组用一个多范围请求下载
+
+        组数不超过空闲的线程名额，每组最多MAX_RANGES个范围；返回剩下的分片和名额。
+        """
+        small = []
+        for i in pending:
+            chunk = self.task.chunks[i]
+            if chunk.end + 1 - chunk.start - self.task.written_in(chunk.start, chunk.end + 1) <= MAX_GAP_SIZE:
+                small.append(i)
+        if len(small) < 2:
+            return pending, slots
+        groups = min(slots, (len(small) + 1) // 2)
+        size = min(MAX_RANGES, (len(small) + groups - 1) // groups)
+        for n in range(groups):
+            group = small[n * size:(n + 1) * size]
+            if not group:
+                break
+            started = self._start_group(group) if len(group) > 1 else self._start_chunk(group[0])
+            if not started:
+                break
+            slots -= 1
+        pending = [i for i in pending if i not in self._started]
+        return pending, slots
+
+    def _schedule_chunks(self):
+        """启动待下载的分片
+
+        最多同时运行thread_count个作业（已经完成的分片不需要启动），同时受主机连接数限制，
+        主机连接已满时剩余的分片留到下次tick。服务器支持时，分散的小分片先合并成多范围请求。
+        普通模式按顺序启动；
+        流式模式优先下载读取位置之后预读窗口内的分片，其次是更靠后的分片，
+        读取位置之前的分片（读者已经跳过）最后下载。
+        """
+        pending = [i for i, chunk in enumerate(self.task.chunks)
+                   if i not in self._started and chunk.status != "已完成"]
+        if not pending:
+            return
+
+        active = sum(1 for job in self.chunk_jobs if job.is_active())
+        slots = self.task.thread_count - active
+        if slots <= 0:
+            return
+
+        if not self.task.streaming:
+            if self._multirange and self._accept_ranges and not self._compression and is_supported(self.task.url):
+                pending, slots = self._schedule_groups(pending, slots)
+            for i in pending[:slots]:
+                if not self._start_chunk(i):
+                    break
+            return
+
+        position = self.task.stream_position
+        window_end = position + self.task.readahead
+
+        def priority(i: int):
+            chunk = self.task.chunks[i]
+            if chunk.end < position:
+                return (2, chunk.start)
+            if chunk.start < window_end:
+                return (0, chunk.start)
+            return (1, chunk.start)
+
+        for i in sorted(pending, key=priority)[:slots]:
+            if not self._start_chunk(i):
+                break
+
+    def _show_notification(self, title: str, message: str, success: bool = True):
+        """交给后台通知线程发送，不阻塞下载线程"""
+        if self.notifier is not None:
+            self.notifier.notify(title, message, success)
+
+    def _teardown(self):
+        """取消所有分片作业，最多等待teardown_timeout秒，超时的作业在线程池中自行结束"""
+        deadline = time.time() + self.teardown_timeout
+        jobs = list(self.chunk_jobs)
+        for job in jobs:
+            job.cancel()
+        for job in jobs:
+            job.wait(max(0.0, deadline - time.time()))
 
     def pause(self):
+        """暂停：分片作业提交已收到的数据后退出，交还线程和连接"""
         self.is_paused = True
+        for job in list(self.chunk_jobs):
+            job.pause()
 
     def resume(self):
         self.is_paused = False
-        for thread in self.chunk_threads:
-            thread.resume()
+        for job in list(self.chunk_jobs):
+            job.resume()
 
     def cancel(self):
+        """取消任务，不等待线程退出；可以从界面线程调用"""
         self.is_cancelled = True
         if self.is_paused:
             self.resume()
+        # 立即断开所有连接，阻塞在读取中的分片作业马上返回
+        for job in list(self.chunk_jobs):
+            job.cancel()
+        response = self._response
+        if response is not None:
+            abort_response(response)
 
 class DownloadProgress(QObject):
     """下载进度信号类"""
@@ -429,23 +1430,140 @@ class DownloadProgress(QObject):
     speed = pyqtSignal(str, float)   # 任务ID, 速度
     error = pyqtSignal(str, str)     # 任务ID, 错误信息
     completed = pyqtSignal(str)      # 任务ID
+    sync_finished = pyqtSignal(object)  # 增量同步结束，参数为SyncSummary
+    bulk_status = pyqtSignal(list, str)  # 任务ID列表, 状态（批量暂停、继续、取消）
+    task_archived = pyqtSignal(str)  # 任务ID，任务结束后已写入历史并从内存中移除
+    task_added = pyqtSignal(str)     # 任务ID，批量下载和同步创建了任务（界面需要添加对应的行）
+    url_probed = pyqtSignal(str, object)  # URL, ProbeResult，输入URL后预先探测完成
 
 class Downloader:
-    def __init__(self):
+    def __init__(self, history_path: str = DEFAULT_PATH):
         self.progress_handler = DownloadProgress()
         self.tasks: Dict[str, DownloadTask] = {}
         self.workers: Dict[str, DownloadWorker] = {}
         self.global_speed_limit: float = 0.0  # KB/s
         self.proxy_config = ProxyConfig()
         self.default_thread_count: int = 8  # 默认线程数
+        self.disk_writer = DiskWriter()  # 所有任务共用的后写式写盘线程
+        self._post_pool = None  # 后处理进程池
+        self.notifier = Notifier()  # 后台通知线程，合并批量任务的完成通知
+        self.notifier.start()
+        self.proxy_router = ProxyRouter()  # 代理池及按主机选择代理池的规则
+        self.source_pool: Optional[InterfacePool] = None  # 多网卡时分片连接使用的本机源地址
+        self._sync_workers: List[SyncWorker] = []  # 正在检查URL列表的同步线程
+        self._sync_batches: List[SyncBatch] = []  # 正在下载的同步批次
+        self.profiler: Optional[SamplingProfiler] = None  # 开启性能分析时的采样线程
+        self.history = HistoryStore(history_path)  # 已结束的任务只保存在历史数据库中
+        self.probe_cache = ProbeCache()  # 预检得到的HEAD结果
+        self.host_rates = HostRates()  # 各主机多连接下载的总速度，用于决定是否压缩传输
+        self.governor = HostGovernor()  # 按主机控制所有任务的连接总数，限流时退避
+        self.meter = TransferMeter()  # 按任务、主机和全局估计速度和剩余时间
+        self.default_compression = "auto"  # 新任务的传输压缩方式
+        self.executor = RangeExecutor(64, "range")  # 所有任务的分片作业共用的线程池
+        self.task_executor = RangeExecutor(16, "task")  # 探测、合并、后处理等作业
+        # 传输阶段的任务由这个定时器在界面线程中统一调度和汇总进度
+        self._bridge = QTimer()
+        self._bridge.setInterval(100)
+        self._bridge.timeout.connect(self._tick)
+        self._bridge.start()
+        self.max_active_tasks: int = 0  # 同时下载的最大任务数，0表示不限制
+        self._queue: List[str] = []  # 等待开始的任务ID（按调度顺序）
+        self._running: set = set()  # 已经启动线程的任务ID
+        self._preflight_workers: List[PreflightWorker] = []  # 正在预检的批量任务
+        self._warming: set = set()  # 正在预先探测的URL
     
     def set_default_thread_count(self, count: int) -> None:
         """设置默认线程数"""
         self.default_thread_count = max(1, min(32, count))  # 限制在1-32之间
+
+    def set_max_connections(self, count: int) -> None:
+        """设置所有任务共用的分片线程数（即同时下载的连接总数），运行中立即生效"""
+        self.executor.resize(max(1, count))
+
+    def set_host_connection_limit(self, count: int) -> None:
+        """设置每个主机所有任务合计的最大连接数"""
+        self.governor.set_max_limit(count)
+
+    def get_host_stats(self) -> Dict[str, HostStats]:
+        """获取各主机的连接控制状态（当前连接数上限、限流次数等）"""
+        return self.governor.get_stats()
+
+    def set_default_compression(self, mode: str) -> None:
+        """设置新任务的传输压缩方式（auto/on/off）"""
+        if mode not in COMPRESSION_MODES:
+            raise ValueError(f"未知的压缩方式：{mode}")
+        self.default_compression = mode
+
+    def get_settings(self) -> Dict[str, object]:
+        """当前的下载设置（设置对话框和守护进程的客户端读取）"""
+        return {
+            "default_thread_count": self.default_thread_count,
+            "max_active_tasks": self.max_active_tasks,
+            "max_connections": self.executor.max_workers,
+            "host_connection_limit": self.governor.max_limit,
+            "default_compression": self.default_compression,
+            "io_policy": self.disk_writer.io_policy,
+            "speed_limit": self.global_speed_limit,
+        }
+
+    def get_proxy_settings(self) -> Dict[str, object]:
+        """全局代理和默认代理池的设置，代理池为[(主机, 端口, 用户名, 密码)]"""
+        pool = self.proxy_router.pools.get("default")
+        config = self.proxy_config
+        return {
+            "enabled": config.enabled, "host": config.host, "port": config.port,
+            "username": config.username, "password": config.password,
+            "pool": [(p.host, p.port, p.username, p.password) for p in pool.proxies] if pool is not None else [],
+        }
+
+    def _tick(self) -> None:
+        for worker in list(self.workers.values()):
+            worker.tick()
+        self.meter.tick()
+
+    def get_rates(self) -> Dict[str, object]:
+        """按任务、主机和全局的速度（字节/秒，EWMA）和预计剩余时间，见utils.throughput"""
+        return self.meter.snapshot()
+
+    def set_max_active_tasks(self, count: int) -> None:
+        """设置同时下载的最大任务数，0表示不限制；超出的任务排队等待"""
+        self.max_active_tasks = max(0, count)
+        self._start_queued()
     
-    def add_task(self, task_id: str, url: str, save_path: str, thread_count: int = None) -> DownloadWorker:
-        """添加下载任务"""
-        task = DownloadTask(url=url, save_path=save_path)
+    def _get_post_pool(self):
+        """获取后处理进程池（首次使用时创建）"""
+        if self._post_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # 本进程中有Qt、线程池和写盘线程，fork出的子进程可能继承被占用的锁而死锁，改用spawn
+            self._post_pool = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2),
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        return self._post_pool
+
+    def add_task(self, task_id: str, url: str, save_path: str, thread_count: int = None,
+                 fast_path: bool = False, post_steps: List[PostStep] = None,
+                 streaming: bool = False, proxy_pool: str = "", delta_source: str = "",
+                 delta_manifest: str = "", probe: ProbeResult = None, compression: str = None) -> DownloadWorker:
+        """添加下载任务
+
+        post_steps为下载完成后依次执行的处理步骤，见utils.postprocess；
+        streaming为True时按顺序优先下载，可通过open_stream边下边读；
+        proxy_pool指定该任务使用的代理池；
+        delta_source为本地旧版本时按服务器上的块清单（见utils.delta）只下载变化的块；
+        probe为已有的HEAD结果（没有时使用预检缓存），开始下载时不再重复探测；
+        compression为传输压缩方式（auto/on/off，见utils.compression），默认使用default_compression。
+        设置了max_active_tasks且下载中的任务已满时，任务排队等待。
+        """
+        if probe is None:
+            probe = self.probe_cache.pop(url)
+        task = DownloadTask(url=url, save_path=save_path, fast_path=fast_path, post_steps=post_steps,
+                            streaming=streaming, proxy_pool=proxy_pool, delta_source=delta_source,
+                            delta_manifest=delta_manifest, probe=probe)
+        if probe is not None:
+            task.total_size = probe.total_size
+        task.compression = compression or self.default_compression
+        if task.compression not in COMPRESSION_MODES:
+            raise ValueError(f"未知的压缩方式：{task.compression}")
         if thread_count is not None:
             task.thread_count = max(1, min(32, thread_count))
         else:
@@ -453,20 +1571,203 @@ class Downloader:
         self.tasks[task_id] = task
         
         # 创建并启动下载线程
-        worker = DownloadWorker(task_id, task, self.progress_handler, self.proxy_config)
+        post_pool = self._get_post_pool() if task.post_steps else None
+        worker = DownloadWorker(task_id, task, self.progress_handler, self.proxy_config, self.disk_writer, post_pool,
+                                self.notifier, self.proxy_router, self.source_pool, self.host_rates,
+                                self.executor, self.task_executor, self.governor, self.meter)
         worker.speed_limit = self.global_speed_limit
+        worker.finished.connect(lambda task_id=task_id: self._on_worker_finished(task_id))
         self.workers[task_id] = worker
-        worker.start()
+        self._queue.append(task_id)
+        self._start_queued()
+        if task_id in self._queue:
+            task.status = "排队中"
+            self.progress_handler.status.emit(task_id, "排队中")
         return worker  # 返回worker实例
+
+    def _start_queued(self) -> None:
+        """按队列顺序启动任务，直到下载中的任务数达到上限；已暂停的排队任务跳过"""
+        for task_id in list(self._queue):
+            if self.max_active_tasks and len(self._running) >= self.max_active_tasks:
+                return
+            worker = self.workers[task_id]
+            if worker.is_paused:
+                continue
+            self._queue.remove(task_id)
+            self._running.add(task_id)
+            worker.start()
     
-    def add_batch_tasks(self, urls: list[str], save_dir: str, thread_count: int = None) -> None:
-        """批量添加下载任务"""
-        for url in urls:
-            filename = url.split('/')[-1]
+    def warm_up(self, url: str) -> None:
+        """输入URL后、选择保存位置之前提前探测
+
+        在任务线程池中发出HEAD请求：DNS解析、TCP和TLS握手后的连接留在共享连接池中，
+        探测结果放进预检缓存，稍后add_task直接使用，不再重复探测。完成后发出url_probed信号。
+        """
+        if url in self._warming or self.probe_cache.get(url) is not None:
+            return
+        self._warming.add(url)
+        self.task_executor.submit(self._warm_up, url)
+
+    def _warm_up(self, url: str) -> None:
+        try:
+            probe = probe_url(url, self.proxy_config.get_proxy_dict(), timeout=10)
+        except Exception as e:
+            # 只是预热，失败时添加任务后照常探测并报告错误
+            print(f"预先探测失败：{str(e)}")
+            return
+        finally:
+            self._warming.discard(url)
+        self.probe_cache.put(probe)
+        self.progress_handler.url_probed.emit(url, probe)
+
+    def add_batch_tasks(self, urls: list[str], save_dir: str, thread_count: int = None,
+                        sync: bool = False, schedule: str = "fifo") -> None:
+        """批量添加下载任务
+
+        schedule为sjf（小文件优先）或ljf（大文件优先）时先并行预检所有URL（见utils.preflight），
+        得到大小后排序，并按文件大小决定每个文件的线程数（不超过thread_count）；fifo按添加顺序，
+        不预检，直接创建任务走小文件快速通道（大文件在快速通道中发现后再分片）。
+        创建的任务通过task_added信号通知界面。
+        sync为True时为增量同步：并行发送条件HEAD请求，跳过本地未变化的文件，只下载新增和
+        有变化的文件（下载完成后才替换旧文件），要下载的文件同样按schedule排序、按大小决定线程数，
+        结束时发出sync_finished信号。
+        """
+        if schedule not in SCHEDULES:
+            raise ValueError(f"未知的调度策略：{schedule}")
+        if sync:
+            worker = SyncWorker(urls, save_dir, self.proxy_config.get_proxy_dict())
+            worker.planned.connect(lambda result: self._start_sync(*result, thread_count, schedule))
+            worker.finished.connect(lambda: self._sync_workers.remove(worker))
+            self._sync_workers.append(worker)
+            worker.start()
+            return
+
+        max_threads = thread_count or self.default_thread_count
+        if schedule == "fifo":
+            # 顺序与大小无关，不为每个文件多发一次HEAD
+            self._start_batch([PreflightItem(url, thread_count=max_threads) for url in urls], save_dir)
+            return
+        worker = PreflightWorker(urls, max_threads, schedule, self.proxy_config.get_proxy_dict(), self.probe_cache)
+        worker.probed.connect(lambda items: self._start_batch(items, save_dir))
+        worker.finished.connect(lambda: self._preflight_workers.remove(worker))
+        self._preflight_workers.append(worker)
+        worker.start()
+
+    def _start_batch(self, items: List[PreflightItem], save_dir: str) -> None:
+        """按排好的顺序创建任务（预检结果交给任务后从缓存中删除）"""
+        for item in items:
+            if item.probe is not None:
+                self.probe_cache.pop(item.url)
+            filename = os.path.basename(item.probe.filename) if item.probe else ""
+            if not filename:
+                filename = item.url.split('/')[-1]
             if not filename:
                 filename = 'download_' + str(uuid.uuid4())[:8]
             save_path = os.path.join(save_dir, filename)
-            self.add_task(str(uuid.uuid4()), url, save_path, thread_count)
+            task_id = str(uuid.uuid4())
+            # 小文件和大小未知的文件先尝试快速通道，大文件直接按预检结果分片
+            fast_path = item.probe is None or item.size < SMALL_FILE_LIMIT
+            self.add_task(task_id, item.url, save_path, item.thread_count, fast_path=fast_path,
+                          probe=item.probe)
+            self.progress_handler.task_added.emit(task_id)
+    
+    def _start_sync(self, batch: SyncBatch, items: List[SyncItem], thread_count: int = None,
+                    schedule: str = "fifo") -> None:
+        """检查完成后为新增和变化的文件创建下载任务，与普通批量任务一样按schedule排序并按大小决定线程数"""
+        max_threads = thread_count or self.default_thread_count
+        planned = []
+        for item in items:
+            if item.action in ("new", "changed"):
+                # 条件HEAD返回200时的探测结果就是预检结果，不需要再探测一次
+                probe = item.probe if item.probe is not None and item.probe.status_code == 200 else None
+                planned.append((PreflightItem(item.url, probe, thread_count=plan_threads(probe, max_threads)), item))
+        ordered = order_items([entry for entry, _ in planned], schedule)
+        sync_items = {id(entry): item for entry, item in planned}
+        for entry in ordered:
+            item = sync_items[id(entry)]
+            task_id = str(uuid.uuid4())
+            batch.add_task(task_id, item)
+            fast_path = entry.probe is None or entry.size < SMALL_FILE_LIMIT
+            self.add_task(task_id, item.url, item.save_path, entry.thread_count, fast_path=fast_path,
+                          probe=entry.probe)
+            self.progress_handler.task_added.emit(task_id)
+        print(f"同步检查完成：需要下载{len(batch.pending)}个文件，未变化{len(batch.summary.unchanged)}个")
+        if batch.done():
+            self._finish_sync(batch)
+        else:
+            self._sync_batches.append(batch)
+
+    def _on_sync_task_finished(self, task_id: str, task: DownloadTask, status: str) -> None:
+        """任务写入历史时调用（完成、失败或取消都会经过这里），同步批次的任务全部结束后发出汇总"""
+        for batch in self._sync_batches:
+            if task_id in batch.pending:
+                if batch.task_finished(task_id, task, status):
+                    self._sync_batches.remove(batch)
+                    self._finish_sync(batch)
+                return
+
+    def _finish_sync(self, batch: SyncBatch) -> None:
+        summary = batch.summary
+        print(summary.text())
+        self.notifier.notify("同步完成", summary.text().split("\n")[1], success=not summary.failed)
+        self.progress_handler.sync_finished.emit(summary)
+
+    def set_proxy(self, enabled: bool, host: str, port: int, username: str = "", password: str = "") -> None:
+        """设置全局代理（没有代理池时使用）"""
+        self.proxy_config = ProxyConfig(enabled, host, port, username, password)
+
+    def set_proxy_pool(self, name: str, proxies: List[ProxyConfig]) -> None:
+        """设置代理池，name为"default"时作为所有任务的默认代理池；proxies为空时删除该代理池"""
+        self.proxy_router.set_pool(name, proxies)
+
+    def add_proxy_rule(self, pattern: str, pool_name: str) -> None:
+        """主机名匹配pattern（如 *.example.com）的任务使用指定代理池"""
+        self.proxy_router.add_rule(pattern, pool_name)
+
+    def get_proxy_stats(self) -> Dict[str, Dict[str, ProxyStats]]:
+        """获取各代理池中每个代理的延迟、速度和错误率"""
+        return {name: pool.get_stats() for name, pool in self.proxy_router.pools.items()}
+
+    def set_source_addresses(self, sources: List[str]) -> None:
+        """设置分片连接绑定的本机源地址或网卡名，为空时恢复使用默认路由
+
+        只对之后添加的任务生效。
+        """
+        self.source_pool = InterfacePool(sources) if sources else None
+
+    def get_interface_stats(self) -> Dict[str, ProxyStats]:
+        """获取每个源地址的延迟、吞吐量和错误率"""
+        return self.source_pool.get_stats() if self.source_pool is not None else {}
+
+    def start_profiling(self, interval: float = 0.01) -> None:
+        """开始对所有下载线程采样（可在下载过程中随时开启）"""
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(interval)
+            self.profiler.start()
+
+    def stop_profiling(self, output_dir: str) -> str:
+        """停止采样，把每个任务的折叠栈文件和汇总写入output_dir，返回汇总文本"""
+        if self.profiler is None:
+            return ""
+        profiler, self.profiler = self.profiler, None
+        profiler.stop()
+        names = {task_id: f"{os.path.basename(task.save_path)}-{task_id[:8]}"
+                 for task_id, task in self.tasks.items()}
+        names[IO_TASK] = "disk_writer"
+        names[OTHER_TASK] = "other"
+        return profiler.dump(output_dir, names)
+
+    def set_fsync_policy(self, policy: str, interval: float = None) -> None:
+        """设置写盘fsync策略（FsyncPolicy.NEVER / PER_CHUNK / PERIODIC）"""
+        self.disk_writer.set_fsync_policy(policy, interval)
+
+    def set_io_policy(self, policy: str) -> None:
+        """设置输出文件的页缓存策略（IOPolicy.BUFFERED / STREAMING / DIRECT），对之后开始的任务生效"""
+        self.disk_writer.set_io_policy(policy)
+
+    def get_io_stats(self):
+        """获取磁盘写入统计（队列深度、写入速度等）"""
+        return self.disk_writer.get_stats()
     
     def set_speed_limit(self, speed: float) -> None:
         """设置全局限速（KB/s）"""
@@ -492,17 +1793,105 @@ class Downloader:
         if task_id in self.workers:
             worker = self.workers[task_id]
             worker.resume()
-            self.tasks[task_id].status = "下载中"
-            self.progress_handler.status.emit(task_id, "下载中")
+            status = "排队中" if task_id in self._queue else "下载中"
+            self.tasks[task_id].status = status
+            self.progress_handler.status.emit(task_id, status)
+            self._start_queued()
     
     def cancel_task(self, task_id: str) -> None:
-        """取消下载任务"""
+        """取消下载任务
+
+        不等待线程退出：连接立即断开，线程结束后任务写入历史并发出task_archived。
+        """
         if task_id in self.workers:
             self.workers[task_id].cancel()
-            self.workers[task_id].wait()
-            del self.workers[task_id]
-            del self.tasks[task_id]
+            self.tasks[task_id].status = "已取消"
+            self.progress_handler.status.emit(task_id, "已取消")
+            self._drop_queued([task_id])
+
+    def _drop_queued(self, task_ids: List[str]) -> None:
+        """还在排队的任务取消后没有线程可等，直接写入历史"""
+        for task_id in task_ids:
+            if task_id in self._queue:
+                self._queue.remove(task_id)
+                self._archive(task_id, "已取消")
+
+    def _apply_bulk(self, task_ids: Optional[List[str]], action: str, status: str) -> List[str]:
+        """对多个任务执行同一操作，只发出一次bulk_status信号"""
+        ids = [t for t in (list(self.workers) if task_ids is None else task_ids)
+               if t in self.workers and self.tasks[t].status not in ("已完成", "已取消", "错误")]
+        for task_id in ids:
+            getattr(self.workers[task_id], action)()
+            self.tasks[task_id].status = "排队中" if action == "resume" and task_id in self._queue else status
+        if ids:
+            self.progress_handler.bulk_status.emit(ids, status)
+        if action == "cancel":
+            self._drop_queued(ids)
+        elif action == "resume":
+            self._start_queued()
+        return ids
+
+    def pause_tasks(self, task_ids: List[str] = None) -> List[str]:
+        """批量暂停，task_ids为None时暂停全部任务，返回实际暂停的任务"""
+        return self._apply_bulk(task_ids, "pause", "已暂停")
+
+    def resume_tasks(self, task_ids: List[str] = None) -> List[str]:
+        """批量继续，task_ids为None时继续全部任务"""
+        return self._apply_bulk(task_ids, "resume", "下载中")
+
+    def cancel_tasks(self, task_ids: List[str] = None) -> List[str]:
+        """批量取消，task_ids为None时取消全部任务；不等待线程退出"""
+        return self._apply_bulk(task_ids, "cancel", "已取消")
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """退出程序前调用：取消所有任务，最多等待timeout秒"""
+        self.cancel_tasks()
+        self._bridge.stop()
+        deadline = time.time() + timeout
+        for worker in list(self.workers.values()):
+            # 界面线程阻塞在这里，由这里推进已取消任务的收尾
+            while not worker.wait(100) and time.time() < deadline:
+                worker.tick()
+        self.executor.shutdown()
+        self.task_executor.shutdown()
+        self.disk_writer.shutdown()
+
+    def _on_worker_finished(self, task_id: str) -> None:
+        """下载线程结束后把任务写入历史，并从内存中移除"""
+        worker = self.workers.get(task_id)
+        if worker is not None:
+            # 取消后线程可能又改写了状态，以取消为准
+            self._archive(task_id, "已取消" if worker.is_cancelled else None)
+        self._running.discard(task_id)
+        self._start_queued()
+
+    def _archive(self, task_id: str, status: str = None) -> None:
+        self.workers.pop(task_id, None)
+        self.meter.remove(task_id)
+        task = self.tasks.pop(task_id, None)
+        if task is None:
+            return
+        status = status or task.status
+        self._on_sync_task_finished(task_id, task, status)
+        self.history.add(HistoryRecord(
+            task_id=task_id,
+            url=task.url,
+            filename=os.path.basename(task.save_path),
+            save_path=task.save_path,
+            size=task.total_size,
+            status=status,
+            error=task.error_msg,
+            started_at=task.start_time.timestamp() if task.start_time else 0.0,
+            finished_at=time.time(),
+        ))
+        self.progress_handler.task_archived.emit(task_id)
     
     def get_task(self, task_id: str) -> Optional[DownloadTask]:
         """获取下载任务信息"""
-        return self.tasks.get(task_id) 
\ No newline at end of file
+        return self.tasks.get(task_id)
+
+    def open_stream(self, task_id: str, timeout: float = None) -> Optional[StreamReader]:
+        """打开边下边读的文件对象，只能读到已经连续下载完成的部分"""
+        if task_id not in self.workers:
+            return None
+        return StreamReader(self.tasks[task_id], self.workers[task_id].part_path, timeout) 
\ No newline at end of file
@@ -0,0 +1,88 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+
+class RangeExecutor:
+    """所有任务共用的线程池
+
+    线程按需创建并复用，空闲idle_timeout秒后退出；最多max_workers个线程，超出的作业排队。
+    运行中可以调用resize调整大小：扩大时立即为排队的作业补充线程，缩小时多余的线程
+    做完手头的作业后退出。
+    """
+
+    def __init__(self, max_workers: int, name: str = "range", idle_timeout: float = 60.0):
+        self.max_workers = max(1, max_workers)
+        self.name = name
+        self.idle_timeout = idle_timeout
+        self._queue: deque = deque()  # (Future, 函数, 参数)
+        self._cond = threading.Condition()
+        self._threads: set = set()
+        self._idle = 0  # 正在等待作业的线程数
+        self._seq = 0
+        self._shutdown = False
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """提交一个作业，返回concurrent.futures.Future"""
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("线程池已关闭")
+            self._queue.append((future, fn, args))
+            self._wake()
+        return future
+
+    def _wake(self) -> None:
+        """唤醒空闲线程，空闲线程不够时在上限内创建新线程（需持有锁）"""
+        if self._idle:
+            self._cond.notify(min(self._idle, len(self._queue)))
+        spawn = min(len(self._queue) - self._idle, self.max_workers - len(self._threads))
+        for _ in range(max(0, spawn)):
+            self._seq += 1
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{self._seq}", daemon=True)
+            self._threads.add(thread)
+            thread.start()
+
+    def _work(self) -> None:
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                while not self._queue and not self._shutdown and len(self._threads) <= self.max_workers:
+                    self._idle += 1
+                    woken = self._cond.wait(self.idle_timeout)
+                    self._idle -= 1
+                    if not woken and not self._queue:
+                        break
+                if not self._queue or len(self._threads) > self.max_workers:
+                    # 空闲超时、已关闭或线程池缩小
+                    self._threads.discard(me)
+                    return
+                future, fn, args = self._queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def resize(self, max_workers: int) -> None:
+        """调整线程数上限"""
+        with self._cond:
+            self.max_workers = max(1, max_workers)
+            self._wake()
+            # 让空闲的多余线程检查上限后退出
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"max_workers": self.max_workers, "threads": len(self._threads),
+                    "idle": self._idle, "queued": len(self._queue)}
+
+    def shutdown(self) -> None:
+        """不再接受新作业，排队的作业执行完后线程退出"""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
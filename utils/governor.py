@@ -0,0 +1,157 @@
+import email.utils
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+THROTTLE_STATUS = (429, 503)  # 服务器要求降低请求频率的状态码
+
+
+class Throttled(Exception):
+    """服务器限流（429/503），分片重新排队而不是失败"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        message = f"服务器限流（HTTP {status}）"
+        if retry_after is not None:
+            message += f"，{retry_after:.0f}秒后重试"
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """解析Retry-After（秒数或HTTP日期），返回需要等待的秒数"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+@dataclass
+class HostStats:
+    """单个主机的连接控制状态"""
+    limit: int                  # 当前允许的连接数
+    active: int = 0             # 正在使用（或已分配给排队作业）的连接数
+    blocked_until: float = 0.0  # 限流后在此时间（time.time()）之前不建立新连接
+    throttles: int = 0          # 累计限流次数
+    failures: int = 0           # 累计连接错误次数
+    streak: int = 0             # 连续限流次数，决定没有Retry-After时的退避时间
+    last_increase: float = 0.0  # 上次增加limit的时间
+    last_decrease: float = 0.0  # 上次减小limit的时间
+
+
+class HostGovernor:
+    """按主机控制所有任务的连接总数（AIMD）
+
+    每个主机的连接数从initial_limit开始，连接数用满且传输正常时每INCREASE_INTERVAL秒加1，
+    最多max_limit；收到429/503或连接被重置时减半，DECREASE_INTERVAL秒内的多次错误只减一次。
+    有Retry-After时在指定时间内不建立新连接，没有时按连续限流次数指数退避。
+    """
+
+    INCREASE_INTERVAL = 1.0  # 加性增加的间隔
+    DECREASE_INTERVAL = 2.0  # 同一次拥塞引起的多个错误只减半一次
+    BACKOFF = 1.0            # 没有Retry-After时的初始退避时间
+    MAX_BACKOFF = 60.0       # 退避时间上限（也是Retry-After的上限）
+
+    def __init__(self, initial_limit: int = 8, max_limit: int = 32):
+        self.initial_limit = max(1, initial_limit)
+        self.max_limit = max(self.initial_limit, max_limit)
+        self.stats: Dict[str, HostStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host(url: str) -> str:
+        return (urlparse(url).netloc or "").lower()
+
+    def _stats(self, url: str) -> HostStats:
+        """取主机的状态，没有时创建（需持有锁）"""
+        host = self.host(url)
+        stats = self.stats.get(host)
+        if stats is None:
+            stats = self.stats[host] = HostStats(limit=self.initial_limit)
+        return stats
+
+    def acquire(self, url: str) -> bool:
+        """为一个分片作业分配连接，主机连接已满或正在退避时返回False，作业继续排队"""
+        with self._lock:
+            stats = self._stats(url)
+            if stats.active >= stats.limit or stats.blocked_until > time.time():
+                return False
+            stats.active += 1
+            return True
+
+    def release(self, url: str) -> None:
+        """作业结束，归还连接"""
+        with self._lock:
+            stats = self._stats(url)
+            stats.active = max(0, stats.active - 1)
+
+    def shed(self, url: str) -> bool:
+        """连接数超过限制时让一个正在传输的作业交还连接，返回True表示调用者应当退出"""
+        with self._lock:
+            stats = self._stats(url)
+            if stats.active <= stats.limit:
+                return False
+            stats.active -= 1
+            return True
+
+    def success(self, url: str) -> None:
+        """传输正常：连接数用满时加性增加"""
+        with self._lock:
+            stats = self._stats(url)
+            now = time.time()
+            stats.streak = 0
+            if (stats.active >= stats.limit and stats.limit < self.max_limit and stats.blocked_until <= now
+                    and now - max(stats.last_increase, stats.last_decrease) >= self.INCREASE_INTERVAL):
+                stats.limit += 1
+                stats.last_increase = now
+
+    def throttle(self, url: str, retry_after: Optional[float] = None) -> float:
+        """服务器限流：连接数减半并暂停建立新连接，返回退避的秒数"""
+        with self._lock:
+            stats = self._stats(url)
+            stats.throttles += 1
+            stats.streak += 1
+            if retry_after is None:
+                retry_after = self.BACKOFF * 2 ** (stats.streak - 1)
+            delay = min(self.MAX_BACKOFF, retry_after)
+            stats.blocked_until = max(stats.blocked_until, time.time() + delay)
+            self._decrease(stats)
+            return delay
+
+    def failure(self, url: str) -> None:
+        """连接被重置或超时：连接数减半"""
+        with self._lock:
+            stats = self._stats(url)
+            stats.failures += 1
+            self._decrease(stats)
+
+    def _decrease(self, stats: HostStats) -> None:
+        now = time.time()
+        if now - stats.last_decrease < self.DECREASE_INTERVAL:
+            return
+        limit = max(1, stats.limit // 2)
+        if limit != stats.limit:
+            print(f"主机连接数由{stats.limit}减为{limit}")
+        stats.limit = limit
+        stats.last_decrease = now
+
+    def set_max_limit(self, count: int) -> None:
+        """设置每个主机的最大连接数，已经超过的主机立即降到上限"""
+        with self._lock:
+            self.max_limit = max(1, count)
+            self.initial_limit = min(self.initial_limit, self.max_limit)
+            for stats in self.stats.values():
+                stats.limit = min(stats.limit, self.max_limit)
+
+    def get_stats(self) -> Dict[str, HostStats]:
+        """获取各主机状态的快照"""
+        with self._lock:
+            return {host: HostStats(**vars(stats)) for host, stats in self.stats.items()}
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".downloader", "history.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id          INTEGER PRIMARY KEY,
+    task_id     TEXT NOT NULL,
+    url         TEXT NOT NULL COLLATE NOCASE,
+    filename    TEXT NOT NULL COLLATE NOCASE,
+    save_path   TEXT NOT NULL,
+    size        INTEGER NOT NULL DEFAULT 0,
+    status      TEXT NOT NULL,
+    error       TEXT NOT NULL DEFAULT '',
+    started_at  REAL NOT NULL DEFAULT 0,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_finished ON history(finished_at);
+CREATE INDEX IF NOT EXISTS idx_history_status ON history(status, finished_at);
+CREATE INDEX IF NOT EXISTS idx_history_url ON history(url);
+CREATE INDEX IF NOT EXISTS idx_history_filename ON history(filename);
+"""
+
+
+@dataclass
+class HistoryRecord:
+    """一条下载历史"""
+    task_id: str
+    url: str
+    filename: str
+    save_path: str
+    size: int = 0
+    status: str = "已完成"
+    error: str = ""
+    started_at: float = 0.0
+    finished_at: float = 0.0
+    id: int = 0
+
+
+class HistoryStore:
+    """基于SQLite的下载历史
+
+    按结束时间倒序分页，用(结束时间, id)做游标，翻到多深都只需要走索引取一页，
+    不会像OFFSET那样越往后越慢；按URL、文件名、状态和时间查询都有索引。
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    def add(self, record: HistoryRecord) -> int:
+        """写入一条历史，返回其id"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO history (task_id, url, filename, save_path, size, status, error, started_at, finished_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record.task_id, record.url, record.filename, record.save_path, record.size, record.status,
+                 record.error, record.started_at, record.finished_at or time.time()))
+            self._conn.commit()
+            return cursor.lastrowid
+
+    @staticmethod
+    def _where(query: str, status: str, since: float, until: float) -> Tuple[str, list]:
+        """拼接查询条件
+
+        query包含"://"时按URL前缀匹配，否则按文件名前缀匹配（不区分大小写），
+        前缀匹配可以使用索引。
+        """
+        clauses, params = [], []
+        if query:
+            pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            column = "url" if "://" in query else "filename"
+            clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+            params.append(pattern)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if since:
+            clauses.append("finished_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("finished_at < ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, query: str = "", status: str = "", since: float = 0, until: float = 0) -> int:
+        where, params = self._where(query, status, since, until)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM history{where}", params).fetchone()[0]
+
+    def page(self, after: Optional[Tuple[float, int]] = None, limit: int = 200, query: str = "",
+             status: str = "", since: float = 0, until: float = 0) -> List[HistoryRecord]:
+        """按结束时间倒序取一页，after为上一页最后一条的(finished_at, id)"""
+        where, params = self._where(query, status, since, until)
+        if after is not None:
+            where += (" AND " if where else " WHERE ") + "(finished_at, id) < (?, ?)"
+            params += list(after)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task_id, url, filename, save_path, size, status, error, started_at, finished_at, id"
+                f" FROM history{where} ORDER BY finished_at DESC, id DESC LIMIT ?",
+                params + [limit]).fetchall()
+        return [HistoryRecord(*row) for row in rows]
+
+    def delete(self, record_id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM history WHERE id = ?", (record_id,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM history")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
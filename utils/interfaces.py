@@ -0,0 +1,43 @@
+import ipaddress
+import socket
+import struct
+import sys
+from typing import List
+
+from utils.proxy_pool import ProxyPool
+
+SIOCGIFADDR = 0x8915  # Linux获取网卡IPv4地址的ioctl
+
+
+def resolve_source(source: str) -> str:
+    """把本机IP地址或网卡名（如 eth1）解析成用于绑定的源地址"""
+    try:
+        return str(ipaddress.ip_address(source))
+    except ValueError:
+        pass
+    if not sys.platform.startswith('linux'):
+        raise ValueError(f"无效的源地址：{source}（当前系统只支持填写IP地址）")
+    import fcntl
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack('256s', source[:15].encode()))
+        except OSError:
+            raise ValueError(f"找不到网卡或网卡没有IPv4地址：{source}")
+    return socket.inet_ntoa(packed[20:24])
+
+
+class InterfacePool(ProxyPool):
+    """本机出口地址池
+
+    每个分片连接绑定到一个源地址，按各地址实测的吞吐量分配连接，
+    多条上行链路的带宽可以叠加；持续出错的地址会被暂时摘除。
+    """
+
+    kind = "网卡"
+
+    def __init__(self, sources: List[str]):
+        super().__init__("interfaces", [resolve_source(s) for s in sources])
+
+    @staticmethod
+    def key(address: str) -> str:
+        return address
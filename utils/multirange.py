@@ -0,0 +1,107 @@
+"""多范围请求（multipart/byteranges）
+
+断点续传或增量更新后文件中可能有几十个分散的小缺口，每个缺口单独发一个范围请求时
+请求数和往返延迟都很可观。这里把多个缺口合并成一个 Range: bytes=a-b,c-d,... 请求，
+流式解析服务器返回的multipart/byteranges响应；服务器不支持时记住该主机，改回单范围请求。
+"""
+import re
+import threading
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+MAX_GAP_SIZE = 1024 * 1024  # 剩余不超过1MB的分片才合并请求，更大的分片单独请求时连接开销占比已经很小
+MAX_RANGES = 32  # 每个请求最多包含的范围数（很多服务器限制范围数，请求头也不宜过长）
+MAX_HEADER_SIZE = 64 * 1024  # 分隔行和部分头的最大长度，超过时认为响应格式错误
+
+_CONTENT_RANGE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)", re.IGNORECASE)
+_BOUNDARY = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+
+_unsupported: set = set()  # 不支持多范围请求的主机
+_lock = threading.Lock()
+
+
+def is_supported(url: str) -> bool:
+    with _lock:
+        return (urlparse(url).netloc or "").lower() not in _unsupported
+
+
+def mark_unsupported(url: str) -> None:
+    """记住该主机不支持多范围请求，之后的任务直接用单范围请求"""
+    with _lock:
+        _unsupported.add((urlparse(url).netloc or "").lower())
+
+
+def range_header(ranges: List[Tuple[int, int]]) -> str:
+    return "bytes=" + ",".join(f"{start}-{end}" for start, end in ranges)
+
+
+def parse_content_range(value: str) -> Optional[Tuple[int, int]]:
+    """解析Content-Range，返回(起点, 终点)，格式不对时返回None"""
+    match = _CONTENT_RANGE.search(value or "")
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def multipart_boundary(content_type: str) -> Optional[str]:
+    """multipart/byteranges响应的分隔符，不是这种响应时返回None"""
+    if not (content_type or "").lower().startswith("multipart/byteranges"):
+        return None
+    match = _BOUNDARY.search(content_type)
+    return match.group(1) if match else None
+
+
+class ByteRangesParser:
+    """流式解析multipart/byteranges响应体
+
+    feed()每次返回[(文件偏移, 数据)]。每个部分的长度由它的Content-Range决定，
+    部分内容直接透传，只有分隔行和部分头需要缓冲。
+    """
+
+    def __init__(self, boundary: str):
+        self._delimiter = b"--" + boundary.encode("latin-1")
+        self._buffer = bytearray()
+        self._position = 0   # 当前部分下一个字节在文件中的偏移
+        self._remaining = 0  # 当前部分还没收到的字节数
+        self.finished = False  # 已经收到结束分隔行
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        parts = []
+        while data and not self.finished:
+            if self._remaining:
+                piece = data[:self._remaining]
+                parts.append((self._position, piece))
+                self._position += len(piece)
+                self._remaining -= len(piece)
+                data = data[len(piece):]
+                continue
+
+            self._buffer += data
+            data = b""
+            start = self._buffer.find(self._delimiter)
+            if start < 0:
+                # 保留末尾可能是半个分隔行的部分
+                del self._buffer[:max(0, len(self._buffer) - len(self._delimiter))]
+                break
+            after = start + len(self._delimiter)
+            if len(self._buffer) < after + 2:
+                break
+            if self._buffer[after:after + 2] == b"--":
+                self.finished = True
+                break
+            end = self._buffer.find(b"\r\n\r\n", after)
+            if end < 0:
+                if len(self._buffer) - start > MAX_HEADER_SIZE:
+                    raise ValueError("multipart/byteranges响应的部分头过长")
+                break
+            headers = bytes(self._buffer[after:end]).decode("latin-1")
+            span = None
+            for line in headers.split("\r\n"):
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-range":
+                    span = parse_content_range(value)
+            if span is None:
+                raise ValueError("multipart/byteranges响应的部分缺少Content-Range")
+            self._position = span[0]
+            self._remaining = span[1] - span[0] + 1
+            data = bytes(self._buffer[end + 4:])
+            self._buffer.clear()
+        return parts
@@ -0,0 +1,140 @@
+import ipaddress
+import re
+import socket
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from urllib.parse import unquote, urlparse
+
+_sessions: Dict[tuple, "requests.Session"] = {}
+_lock = threading.Lock()
+
+POOL_SIZE = 64  # 每个主机保持的最大连接数
+
+
+def preload() -> None:
+    """在后台线程中预先导入网络库，窗口显示后调用，首次下载时不必再等待导入"""
+    def _import():
+        import requests  # noqa: F401
+    threading.Thread(target=_import, daemon=True).start()
+
+
+def _make_adapter(source_address: Optional[str]):
+    """创建连接池适配器，指定source_address时所有连接（包括经过代理的连接）都从该地址发出"""
+    from requests.adapters import HTTPAdapter
+
+    if not source_address:
+        return HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+
+    class SourceAddressAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs['source_address'] = (source_address, 0)
+            super().init_poolmanager(*args, **kwargs)
+
+        def proxy_manager_for(self, proxy, **proxy_kwargs):
+            proxy_kwargs['source_address'] = (source_address, 0)
+            return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+    return SourceAddressAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+
+
+def get_session(proxies: Optional[Dict[str, str]] = None,
+                source_address: Optional[str] = None) -> "requests.Session":
+    """获取共享的连接池会话
+
+    同一代理配置和源地址下的所有请求复用同一个会话，避免每次请求都重新建立TCP/TLS连接。
+    requests在这里才导入，避免拖慢程序启动。
+    """
+    import requests
+
+    key = (tuple(sorted((proxies or {}).items())), source_address or "")
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = _make_adapter(source_address)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if proxies:
+                session.proxies.update(proxies)
+            _sessions[key] = session
+        return session
+
+
+def is_loopback(host: str) -> bool:
+    """host是否只能从本机访问（监听其他地址的服务必须要求token）"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def abort_response(response) -> None:
+    """从其他线程立即中断正在读取的流式响应
+
+    只调用close()时阻塞在recv中的线程要等到读超时才会返回，这里先shutdown底层socket，
+    读取线程会马上收到连接错误。连接随之关闭，不会放回连接池。
+    """
+    raw = getattr(response, 'raw', None)
+    connection = getattr(raw, '_connection', None) or getattr(raw, 'connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        # 连接已经从urllib3的响应上解除关联时，从http.client的响应中找socket
+        fp = getattr(raw, '_fp', None)
+        sock = getattr(getattr(getattr(fp, 'fp', None), 'raw', None), '_sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    try:
+        response.close()
+    except Exception:
+        pass
+
+
+@dataclass
+class ProbeResult:
+    """HEAD探测结果"""
+    url: str
+    total_size: int = 0
+    accept_ranges: bool = False
+    etag: str = ""
+    last_modified: str = ""
+    filename: str = ""  # Content-Disposition中的文件名，没有时取URL最后一段
+    status_code: int = 200
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+def filename_from_headers(url: str, headers) -> str:
+    """从Content-Disposition或URL中取得文件名"""
+    disposition = headers.get('content-disposition', '')
+    match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.IGNORECASE)
+    if match:
+        return unquote(match.group(1).strip().strip('"'))
+    match = re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE)
+    if match:
+        return match.group(1).strip()
+    return unquote(urlparse(url).path.split('/')[-1])
+
+
+def probe_url(url: str, proxies: Optional[Dict[str, str]] = None, timeout: float = 30,
+              headers: Optional[Dict[str, str]] = None) -> ProbeResult:
+    """发送HEAD请求获取文件大小、断点续传支持和缓存校验信息"""
+    # 要求不压缩，Content-Length才是文件本身的大小
+    headers = {'Accept-Encoding': 'identity', **(headers or {})}
+    response = get_session(proxies).head(url, headers=headers, timeout=timeout, allow_redirects=True)
+    response.raise_for_status()
+    result = ProbeResult(
+        url=url,
+        total_size=int(response.headers.get('content-length', 0) or 0),
+        accept_ranges='accept-ranges' in response.headers,
+        etag=response.headers.get('etag', ''),
+        last_modified=response.headers.get('last-modified', ''),
+        filename=filename_from_headers(url, response.headers),
+        status_code=response.status_code,
+        headers=dict(response.headers),
+    )
+    return result
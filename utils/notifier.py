@@ -0,0 +1,65 @@
+import queue
+import threading
+import time
+from typing import List, Tuple
+
+
+class Notifier(threading.Thread):
+    """后台桌面通知线程
+
+    下载线程只把通知放进队列，不会被通知后端阻塞。短时间内到达的多条通知会被合并，
+    批量下载时只弹出一条汇总通知。通知后端（plyer）在第一次发送时才导入。
+    """
+
+    def __init__(self, window: float = 2.0, max_individual: int = 3):
+        super().__init__(daemon=True)
+        self.window = window                  # 合并窗口（秒）
+        self.max_individual = max_individual  # 窗口内不超过这个数量时逐条显示
+        self.queue: "queue.Queue" = queue.Queue()
+        self.enabled = True
+
+    def notify(self, title: str, message: str, success: bool = True) -> None:
+        """提交一条通知（不阻塞）"""
+        if self.enabled:
+            self.queue.put((title, message, success))
+
+    def _collect(self, first) -> List[Tuple[str, str, bool]]:
+        """收集合并窗口内的所有通知"""
+        events = [first]
+        deadline = time.time() + self.window
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                events.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return events
+
+    def _show(self, title: str, message: str):
+        try:
+            from plyer import notification
+            notification.notify(
+                title=title,
+                message=message,
+                app_icon=None,
+                timeout=10,
+            )
+        except Exception:
+            pass
+
+    def run(self):
+        while True:
+            events = self._collect(self.queue.get())
+            if len(events) <= self.max_individual:
+                for title, message, _ in events:
+                    self._show(title, message)
+                continue
+
+            succeeded = sum(1 for _, _, success in events if success)
+            failed = len(events) - succeeded
+            if failed:
+                self._show("批量下载", f"{succeeded} 个文件下载完成，{failed} 个文件下载失败")
+            else:
+                self._show("批量下载完成", f"{succeeded} 个文件已下载完成")
@@ -0,0 +1,315 @@
+import bz2
+import hashlib
+import lzma
+import os
+import queue
+import shutil
+import tarfile
+import threading
+import zipfile
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+READ_BLOCK = 1024 * 1024  # 从磁盘回读时每次读取1MB
+
+
+def _split_archive_name(path: str) -> Tuple[str, str, str]:
+    """解析归档类型，返回(去掉扩展名后的文件名, 压缩方式, 容器类型)
+
+    压缩方式为 gz/bz2/xz/zst 或空串，容器类型为 tar/zip/file。
+    """
+    name = os.path.basename(path)
+    lower = name.lower()
+    for ext, compression in ((".tar.gz", "gz"), (".tgz", "gz"), (".tar.bz2", "bz2"),
+                             (".tar.xz", "xz"), (".tar.zst", "zst"), (".tzst", "zst"),
+                             (".tar", "")):
+        if lower.endswith(ext):
+            return name[:-len(ext)], compression, "tar"
+    if lower.endswith(".zip"):
+        return name[:-4], "", "zip"
+    for ext, compression in ((".gz", "gz"), (".bz2", "bz2"), (".xz", "xz"), (".zst", "zst")):
+        if lower.endswith(ext):
+            return name[:-len(ext)], compression, "file"
+    return name, "", ""
+
+
+def _make_decompressor(compression: str):
+    """创建流式解压对象（具有decompress方法）"""
+    if compression == "gz":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == "bz2":
+        return bz2.BZ2Decompressor()
+    if compression == "xz":
+        return lzma.LZMADecompressor()
+    if compression == "zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("解压.zst文件需要安装zstandard：pip install zstandard")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+class _PipeReader:
+    """把队列包装成只读文件对象，供tarfile以流模式读取"""
+
+    def __init__(self, q: "queue.Queue"):
+        self.queue = q
+        self.buffer = b""
+        self.eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            data = self.queue.get()
+            if data is None:
+                self.eof = True
+            else:
+                self.buffer += data
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class _TarSink:
+    """在后台线程中以流模式解包tar"""
+
+    def __init__(self, dest_dir: str):
+        self.queue: "queue.Queue" = queue.Queue(maxsize=16)
+        self.error: Optional[Exception] = None
+        self.thread = threading.Thread(target=self._extract, args=(dest_dir,), daemon=True)
+        self.thread.start()
+
+    def _extract(self, dest_dir: str):
+        try:
+            with tarfile.open(fileobj=_PipeReader(self.queue), mode="r|") as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(dest_dir, filter="data")
+                else:
+                    tar.extractall(dest_dir)
+        except Exception as e:
+            self.error = e
+
+    def _put(self, data):
+        # 解包线程结束后（读到归档结尾或出错）不再阻塞写入方
+        while self.thread.is_alive():
+            try:
+                self.queue.put(data, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data: bytes):
+        if data:
+            self._put(data)
+
+    def close(self):
+        self._put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class StreamExtractor:
+    """流式解压/解包，数据按顺序到达时边收边处理"""
+
+    def __init__(self, archive_path: str, dest_dir: str):
+        base, compression, container = _split_archive_name(archive_path)
+        if container not in ("tar", "file"):
+            raise ValueError(f"不支持流式解压：{os.path.basename(archive_path)}")
+        self.decompressor = _make_decompressor(compression)
+        os.makedirs(dest_dir, exist_ok=True)
+        if container == "tar":
+            self.sink = _TarSink(dest_dir)
+            self.output = dest_dir
+        else:
+            self.output = os.path.join(dest_dir, base)
+            self.sink = open(self.output, "wb")
+
+    def feed(self, data: bytes):
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        self.sink.write(data)
+
+    def close(self) -> str:
+        if self.decompressor is not None and hasattr(self.decompressor, "flush"):
+            self.sink.write(self.decompressor.flush())
+        self.sink.close()
+        return self.output
+
+
+class _HashSink:
+    def __init__(self, algorithm: str, expected: str):
+        self.hasher = hashlib.new(algorithm)
+        self.expected = expected
+
+    def feed(self, data: bytes):
+        self.hasher.update(data)
+
+    def close(self) -> str:
+        digest = self.hasher.hexdigest()
+        if self.expected and digest.lower() != self.expected.lower():
+            raise ValueError(f"校验失败：期望 {self.expected}，实际 {digest}")
+        return digest
+
+
+def _feed_file(sink, path: str):
+    """从磁盘回读文件喂给sink"""
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_BLOCK)
+            if not data:
+                break
+            sink.feed(data)
+    return sink.close()
+
+
+class PostStep:
+    """后处理步骤基类
+
+    子类实现run()，在下载完成的文件上执行并返回(新路径, 结果)。
+    若能在数据按顺序到达时处理，再实现open_stream()返回具有feed/close方法的对象，
+    单线程顺序下载时会边下边处理，完成后不再回读文件。
+    步骤会被送到进程池执行，必须可以被pickle。
+    """
+    name = "step"
+
+    def run(self, path: str) -> Tuple[str, object]:
+        raise NotImplementedError
+
+    def open_stream(self, path: str):
+        return None
+
+    def finish_stream(self, path: str):
+        """流式处理完成、文件已落盘后调用，用于收尾（例如删除归档）"""
+        pass
+
+
+class HashStep(PostStep):
+    """计算文件哈希，给出expected时校验"""
+    name = "hash"
+
+    def __init__(self, algorithm: str = "sha256", expected: str = ""):
+        self.algorithm = algorithm
+        self.expected = expected
+
+    def run(self, path: str) -> Tuple[str, object]:
+        return path, _feed_file(_HashSink(self.algorithm, self.expected), path)
+
+    def open_stream(self, path: str):
+        return _HashSink(self.algorithm, self.expected)
+
+
+class ExtractStep(PostStep):
+    """解压 .tar.gz/.tgz/.tar.zst/.tar.xz/.tar.bz2/.tar/.zip/.gz/.zst 等归档
+
+    dest_dir为空时解压到归档所在目录；zip需要读取文件末尾的目录，只能在下载完成后解压。
+    """
+    name = "extract"
+
+    def __init__(self, dest_dir: str = "", remove_archive: bool = False):
+        self.dest_dir = dest_dir
+        self.remove_archive = remove_archive
+
+    def _dest(self, path: str) -> str:
+        return self.dest_dir or os.path.dirname(os.path.abspath(path))
+
+    def run(self, path: str) -> Tuple[str, object]:
+        dest = self._dest(path)
+        if _split_archive_name(path)[2] == "zip":
+            with zipfile.ZipFile(path) as zf:
+                zf.extractall(dest)
+            output = dest
+        else:
+            output = _feed_file(StreamExtractor(path, dest), path)
+        if self.remove_archive:
+            os.remove(path)
+        return path, output
+
+    def open_stream(self, path: str):
+        if _split_archive_name(path)[2] not in ("tar", "file"):
+            return None
+        return StreamExtractor(path, self._dest(path))
+
+    def finish_stream(self, path: str):
+        if self.remove_archive:
+            os.remove(path)
+
+
+class MoveStep(PostStep):
+    """把下载好的文件移动到目标位置（目标是目录时保留文件名）"""
+    name = "move"
+
+    def __init__(self, target: str):
+        self.target = target
+
+    def run(self, path: str) -> Tuple[str, object]:
+        target = self.target
+        if os.path.isdir(target) or target.endswith(os.sep):
+            target = os.path.join(target, os.path.basename(path))
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        try:
+            os.replace(path, target)
+        except OSError:
+            # 跨文件系统时无法直接重命名
+            shutil.move(path, target)
+        return target, target
+
+
+def run_steps(steps: List[PostStep], path: str, done: Dict[int, object] = None) -> Tuple[str, Dict[str, object]]:
+    """依次执行后处理步骤（在进程池中运行）
+
+    done为已经在下载过程中流式完成的步骤序号及其结果，这些步骤不再执行。
+    返回最终文件路径和各步骤结果。
+    """
+    done = done or {}
+    results = {}
+    for i, step in enumerate(steps):
+        if i in done:
+            step.finish_stream(path)
+            results[step.name] = done[i]
+            continue
+        path, results[step.name] = step.run(path)
+    return path, results
+
+
+class PostStream:
+    """单线程顺序下载时的流式后处理，把到达的数据同时喂给所有支持流式处理的步骤"""
+
+    def __init__(self, steps: List[PostStep], path: str):
+        self.sinks = {}
+        for i, step in enumerate(steps):
+            sink = step.open_stream(path)
+            if sink is not None:
+                self.sinks[i] = sink
+
+    def feed(self, data: bytes):
+        for i, sink in list(self.sinks.items()):
+            try:
+                sink.feed(data)
+            except Exception as e:
+                # 流式处理失败的步骤留到下载完成后重新执行
+                print(f"流式后处理失败，将在下载完成后重试：{str(e)}")
+                del self.sinks[i]
+
+    def close(self) -> Dict[int, object]:
+        """结束流式处理，返回完成的步骤序号及其结果"""
+        done = {}
+        for i, sink in self.sinks.items():
+            try:
+                done[i] = sink.close()
+            except ValueError:
+                # 校验失败不需要重试
+                raise
+            except Exception as e:
+                print(f"流式后处理失败，将在下载完成后重试：{str(e)}")
+        return done
+
+    def abort(self):
+        """下载失败或取消时结束流式处理，丢弃结果"""
+        for sink in self.sinks.values():
+            try:
+                sink.close()
+            except Exception:
+                pass
+        self.sinks = {}
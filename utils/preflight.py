@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from utils.network import ProbeResult, probe_url
+
+SCHEDULES = ("fifo", "sjf", "ljf")  # 按添加顺序 / 小文件优先 / 大文件优先
+MIN_BYTES_PER_THREAD = 4 * 1024 * 1024  # 每个线程至少分到4MB，再小时多开连接的握手开销大于收益
+
+
+@dataclass
+class PreflightItem:
+    """批量任务中一个URL的预检结果"""
+    url: str
+    probe: Optional[ProbeResult] = None
+    error: str = ""
+    thread_count: int = 1
+
+    @property
+    def size(self) -> int:
+        return self.probe.total_size if self.probe else 0
+
+
+class ProbeCache:
+    """HEAD探测结果缓存，同一URL在ttl秒内不重复探测"""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._entries: Dict[str, tuple] = {}  # URL -> (探测时间, ProbeResult)
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[ProbeResult]:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self._entries[url]
+                return None
+            return entry[1]
+
+    def put(self, probe: ProbeResult) -> None:
+        with self._lock:
+            self._entries[probe.url] = (time.time(), probe)
+
+    def pop(self, url: str) -> Optional[ProbeResult]:
+        """取出并删除缓存，任务开始下载后探测结果就不再需要"""
+        with self._lock:
+            entry = self._entries.pop(url, None)
+        return entry[1] if entry and time.time() - entry[0] <= self.ttl else None
+
+
+def plan_threads(probe: Optional[ProbeResult], max_threads: int) -> int:
+    """按文件大小决定线程数：不支持断点续传或大小未知时为1，否则每个线程至少MIN_BYTES_PER_THREAD"""
+    if probe is None or not probe.accept_ranges or probe.total_size <= 0:
+        return 1
+    return max(1, min(max_threads, probe.total_size // MIN_BYTES_PER_THREAD))
+
+
+def order_items(items: List[PreflightItem], schedule: str = "fifo") -> List[PreflightItem]:
+    """按调度策略排序，大小未知的文件总是排在最后（保持原有顺序）"""
+    if schedule == "fifo":
+        return list(items)
+    known = [item for item in items if item.size > 0]
+    unknown = [item for item in items if item.size <= 0]
+    known.sort(key=lambda item: item.size, reverse=(schedule == "ljf"))
+    return known + unknown
+
+
+def preflight(urls: List[str], max_threads: int, proxies: Optional[Dict[str, str]] = None,
+              cache: Optional[ProbeCache] = None, workers: int = 16) -> List[PreflightItem]:
+    """并行探测URL列表，最多同时发出workers个HEAD请求，已缓存的URL不再探测
+
+    所有请求走共享的连接池会话，同一主机的连接可以复用。
+    """
+    def check(url: str) -> PreflightItem:
+        item = PreflightItem(url)
+        probe = cache.get(url) if cache is not None else None
+        if probe is None:
+            try:
+                probe = probe_url(url, proxies)
+            except Exception as e:
+                # 探测失败的任务照常下载，由下载线程报告具体错误
+                item.error = str(e)
+                return item
+            if cache is not None:
+                cache.put(probe)
+        item.probe = probe
+        item.thread_count = plan_threads(probe, max_threads)
+        return item
+
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as executor:
+        return list(executor.map(check, urls))
+
+
+class PreflightWorker(QThread):
+    """在后台线程中预检批量任务，避免阻塞界面"""
+    probed = pyqtSignal(object)  # List[PreflightItem]，已按调度策略排好序
+
+    def __init__(self, urls: List[str], max_threads: int, schedule: str = "fifo",
+                 proxies: Optional[Dict[str, str]] = None, cache: Optional[ProbeCache] = None):
+        super().__init__()
+        self.urls = urls
+        self.max_threads = max_threads
+        self.schedule = schedule
+        self.proxies = proxies
+        self.cache = cache
+
+    def run(self):
+        items = preflight(self.urls, self.max_threads, self.proxies, self.cache)
+        failed = sum(1 for item in items if item.error)
+        total = sum(item.size for item in items)
+        print(f"预检完成：{len(items)}个文件，共{total}字节，探测失败{failed}个")
+        self.probed.emit(order_items(items, self.schedule))
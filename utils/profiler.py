@@ -0,0 +1,150 @@
+import linecache
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+IO_TASK = "__io__"        # 写盘线程不属于某个任务，单独归为一组
+OTHER_TASK = "__other__"  # 没有登记的线程（界面线程、通知线程等）
+
+# 线程ident -> (任务ID, 角色)，线程启动时自己登记，开销只有一次字典赋值
+_threads: Dict[int, Tuple[str, str]] = {}
+
+
+def register_thread(task_id: str, role: str) -> None:
+    """登记当前线程所属的任务和角色（chunk / worker / io），采样时据此按任务归类"""
+    _threads[threading.get_ident()] = (task_id, role)
+
+
+def unregister_thread() -> None:
+    _threads.pop(threading.get_ident(), None)
+
+
+# 按栈帧所在的模块和代码行判断线程当前在做什么
+_NETWORK_FILES = ("socket.py", "ssl.py", "selectors.py")
+_NETWORK_PACKAGES = ("urllib3", "http" + os.sep + "client", "requests")
+
+
+def _classify(filename: str, line: str) -> Optional[str]:
+    """单个栈帧的分类，看不出来时返回None，交给外层的帧判断"""
+    if "sleep(" in line:
+        return "等待"
+    if "queue.get(" in line:
+        return "空闲"
+    if ".emit(" in line:
+        return "信号"
+    if filename.endswith("disk_writer.py") or ".write(" in line or "fsync" in line:
+        return "写盘"
+    if filename.endswith(_NETWORK_FILES) or any(p in filename for p in _NETWORK_PACKAGES):
+        return "网络"
+    return None
+
+
+class SamplingProfiler(threading.Thread):
+    """采样分析器
+
+    定时用sys._current_frames()抓取所有线程的调用栈，按线程登记的任务归类，
+    累计成火焰图工具可以直接读取的折叠栈格式（frame1;frame2;... 次数）。
+    每次采样只遍历栈帧，帧标签按(代码对象, 行号)缓存，默认每秒100次采样，
+    可以在正常下载时开启。
+    """
+
+    def __init__(self, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = 0
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+        self.stacks: Dict[str, Counter] = {}      # 任务ID -> 折叠栈计数
+        self.categories: Dict[str, Counter] = {}  # 任务ID -> 栈顶分类计数
+        self._labels: Dict[tuple, Tuple[str, Optional[str]]] = {}  # (代码对象, 行号) -> (标签, 分类)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def _label(self, code, lineno: int) -> Tuple[str, Optional[str]]:
+        key = (code, lineno)
+        label = self._labels.get(key)
+        if label is None:
+            line = linecache.getline(code.co_filename, lineno).strip()
+            label = (f"{os.path.basename(code.co_filename)}:{code.co_name}", _classify(code.co_filename, line))
+            self._labels[key] = label
+        return label
+
+    def _sample(self):
+        me = threading.get_ident()
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                task_id, role = _threads.get(ident, (OTHER_TASK, "thread"))
+                lineno = frame.f_lineno
+                labels = []
+                category = None  # 从栈顶往外第一个能判断出分类的帧决定整个样本的分类
+                while frame is not None:
+                    label, cat = self._label(frame.f_code, frame.f_lineno)
+                    labels.append(label)
+                    if category is None:
+                        category = cat
+                    frame = frame.f_back
+                # 栈顶帧带上行号，方便定位热点
+                labels[0] = f"{labels[0]}:{lineno}"
+                labels.append(role)
+                labels.reverse()
+                self.stacks.setdefault(task_id, Counter())[";".join(labels)] += 1
+                self.categories.setdefault(task_id, Counter())[category or "Python"] += 1
+            self.samples += 1
+
+    def run(self):
+        self.started_at = time.time()
+        next_time = time.perf_counter()
+        while not self._stop_event.is_set():
+            self._sample()
+            next_time += self.interval
+            delay = next_time - time.perf_counter()
+            if delay < 0:
+                # 采样本身跟不上时不补采，避免占满CPU
+                next_time = time.perf_counter()
+                delay = 0
+            self._stop_event.wait(delay)
+        self.stopped_at = time.time()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def summary(self, names: Optional[Dict[str, str]] = None) -> str:
+        """各任务的分类占比和最热的栈顶位置"""
+        names = names or {}
+        elapsed = (self.stopped_at or time.time()) - self.started_at
+        lines = [f"采样{self.samples}次，耗时{elapsed:.1f}秒，间隔{self.interval * 1000:.0f}毫秒"]
+        with self._lock:
+            for task_id in sorted(self.stacks, key=lambda t: -sum(self.stacks[t].values())):
+                total = sum(self.categories[task_id].values())
+                share = "，".join(f"{cat} {n * 100 / total:.0f}%"
+                                  for cat, n in self.categories[task_id].most_common())
+                lines.append(f"\n[{names.get(task_id, task_id)}] {share}")
+                leaves = Counter()
+                for stack, n in self.stacks[task_id].items():
+                    leaves[stack.rsplit(";", 1)[-1]] += n
+                for leaf, n in leaves.most_common(5):
+                    lines.append(f"    {n * 100 / total:5.1f}%  {leaf}")
+        return "\n".join(lines)
+
+    def dump(self, directory: str, names: Optional[Dict[str, str]] = None) -> str:
+        """写出每个任务的折叠栈文件（可用flamegraph.pl或speedscope打开）和汇总，返回汇总文本"""
+        names = names or {}
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            for task_id, stacks in self.stacks.items():
+                name = names.get(task_id, task_id)
+                safe = "".join(c if c.isalnum() or c in "._-" else "_" for c in name)
+                with open(os.path.join(directory, f"{safe}.collapsed"), 'w', encoding='utf-8') as f:
+                    for stack, n in stacks.most_common():
+                        f.write(f"{stack} {n}\n")
+        text = self.summary(names)
+        with open(os.path.join(directory, "summary.txt"), 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        return text
@@ -0,0 +1,160 @@
+import fnmatch
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+
+@dataclass
+class ProxyStats:
+    """单个代理的健康统计"""
+    latency: float = 0.0       # 建立连接到收到响应头的耗时（秒，指数加权平均）
+    throughput: float = 0.0    # 下载速度（KB/s，指数加权平均）
+    error_rate: float = 0.0    # 错误率（0~1，指数加权平均）
+    requests: int = 0          # 累计请求数
+    errors: int = 0            # 累计错误数
+    active: int = 0            # 当前正在使用的连接数
+    drained_until: float = 0.0  # 被摘除到此时间（time.time()），0表示正常
+
+
+class ProxyPool:
+    """代理池
+
+    把分片连接分散到多个代理上：优先选择 (当前连接数+1)/估计速度 最小的代理，
+    错误率过高的代理会被暂时摘除，冷却后重新参与分配。
+    """
+
+    EWMA_ALPHA = 0.3        # 指数加权平均系数
+    DRAIN_ERROR_RATE = 0.5  # 错误率超过该值时摘除
+    DRAIN_MIN_REQUESTS = 3  # 至少有这么多请求后才判断是否摘除
+    DRAIN_SECONDS = 60.0    # 摘除后的冷却时间
+    kind = "代理"            # 日志中的名称
+
+    def __init__(self, name: str = "default", proxies: List['ProxyConfig'] = None):
+        self.name = name
+        self.proxies: List['ProxyConfig'] = []
+        self.stats: Dict[str, ProxyStats] = {}
+        self._lock = threading.Lock()
+        for proxy in proxies or []:
+            self.add(proxy)
+
+    @staticmethod
+    def key(proxy: 'ProxyConfig') -> str:
+        return f"{proxy.host}:{proxy.port}"
+
+    def add(self, proxy: 'ProxyConfig') -> None:
+        """加入一个代理"""
+        with self._lock:
+            if self.key(proxy) not in self.stats:
+                self.proxies.append(proxy)
+                self.stats[self.key(proxy)] = ProxyStats()
+
+    def remove(self, proxy: 'ProxyConfig') -> None:
+        """移除一个代理"""
+        with self._lock:
+            self.proxies = [p for p in self.proxies if self.key(p) != self.key(proxy)]
+            self.stats.pop(self.key(proxy), None)
+
+    def __len__(self) -> int:
+        return len(self.proxies)
+
+    def acquire(self, exclude: Tuple[str, ...] = (), reserve: bool = True) -> Optional['ProxyConfig']:
+        """为一个新连接选择代理，没有可用代理时返回None
+
+        reserve为True时计入连接数，使用完毕后必须调用report()。
+        """
+        with self._lock:
+            now = time.time()
+            healthy = [p for p in self.proxies
+                       if self.stats[self.key(p)].drained_until <= now and self.key(p) not in exclude]
+            if not healthy:
+                # 全部被摘除时仍然选一个冷却最快结束的，避免任务直接失败
+                healthy = [p for p in self.proxies if self.key(p) not in exclude]
+                if not healthy:
+                    return None
+                healthy = [min(healthy, key=lambda p: self.stats[self.key(p)].drained_until)]
+
+            # 没有测速数据的代理按已测代理的平均速度估计，保证新代理也能分到连接
+            measured = [self.stats[self.key(p)].throughput for p in healthy
+                        if self.stats[self.key(p)].throughput > 0]
+            default = sum(measured) / len(measured) if measured else 1.0
+
+            def load(p):
+                stats = self.stats[self.key(p)]
+                speed = stats.throughput or default
+                return (stats.active + 1) / speed * (1 + stats.error_rate)
+
+            proxy = min(healthy, key=load)
+            if reserve:
+                self.stats[self.key(proxy)].active += 1
+            return proxy
+
+    def release(self, proxy: 'ProxyConfig') -> None:
+        """连接被主动取消，只归还连接数，不计入统计"""
+        with self._lock:
+            stats = self.stats.get(self.key(proxy))
+            if stats is not None:
+                stats.active = max(0, stats.active - 1)
+
+    def report(self, proxy: 'ProxyConfig', ok: bool, latency: float = 0.0,
+               nbytes: int = 0, seconds: float = 0.0) -> None:
+        """报告一次连接的结果"""
+        with self._lock:
+            stats = self.stats.get(self.key(proxy))
+            if stats is None:
+                return
+            a = self.EWMA_ALPHA
+            stats.active = max(0, stats.active - 1)
+            stats.requests += 1
+            stats.error_rate = (1 - a) * stats.error_rate + a * (0.0 if ok else 1.0)
+            if ok:
+                if latency > 0:
+                    stats.latency = latency if stats.latency == 0 else (1 - a) * stats.latency + a * latency
+                if seconds > 0 and nbytes > 0:
+                    speed = nbytes / 1024 / seconds
+                    stats.throughput = speed if stats.throughput == 0 else (1 - a) * stats.throughput + a * speed
+                stats.drained_until = 0.0
+            else:
+                stats.errors += 1
+                if stats.requests >= self.DRAIN_MIN_REQUESTS and stats.error_rate > self.DRAIN_ERROR_RATE:
+                    stats.drained_until = time.time() + self.DRAIN_SECONDS
+                    # 冷却后以中等错误率重新试用
+                    stats.error_rate = self.DRAIN_ERROR_RATE / 2
+                    print(f"{self.kind}{self.key(proxy)}错误率过高，暂停使用{self.DRAIN_SECONDS:.0f}秒")
+
+    def get_stats(self) -> Dict[str, ProxyStats]:
+        """获取各代理统计的快照"""
+        with self._lock:
+            return {k: ProxyStats(**vars(v)) for k, v in self.stats.items()}
+
+
+class ProxyRouter:
+    """按任务或主机模式选择代理池"""
+
+    def __init__(self):
+        self.pools: Dict[str, ProxyPool] = {}
+        self.rules: List[Tuple[str, str]] = []  # (主机模式, 代理池名称)，按顺序匹配
+
+    def set_pool(self, name: str, proxies: List['ProxyConfig']) -> Optional[ProxyPool]:
+        """创建或替换代理池，proxies为空时删除"""
+        if not proxies:
+            self.pools.pop(name, None)
+            return None
+        pool = ProxyPool(name, proxies)
+        self.pools[name] = pool
+        return pool
+
+    def add_rule(self, pattern: str, pool_name: str) -> None:
+        """主机名匹配pattern（如 *.example.com）的请求使用指定代理池"""
+        self.rules.append((pattern.lower(), pool_name))
+
+    def pool_for(self, url: str, pool_name: str = "") -> Optional[ProxyPool]:
+        """依次按任务指定、主机规则、默认代理池选择，都没有时返回None"""
+        if pool_name:
+            return self.pools.get(pool_name)
+        host = (urlparse(url).hostname or "").lower()
+        for pattern, name in self.rules:
+            if fnmatch.fnmatch(host, pattern) and name in self.pools:
+                return self.pools[name]
+        return self.pools.get("default")
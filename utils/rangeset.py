@@ -0,0 +1,359 @@
+"""稀疏区间集合
+
+任务已经写入磁盘的字节用一组互不相交、互不相邻的半开区间[start, end)表示，可以描述任意位置的
+空洞：从任意空洞继续下载、拆分区间、多个来源的数据合并都只是对集合做加减。
+
+区间按起点排序后分块存放（每块不超过2*LOAD个），另存各块最后一个区间的终点：定位时先在块索引上
+二分，再在块内二分，插入和删除只移动一个块内的元素，add、remove、contiguous_from都是O(log n)
+（加上被合并或删除的区间数）。内部的空洞放在带惰性删除的大顶堆中，largest_gap()摊还O(log n)。
+to_bytes()把相邻端点的差值按64位整数zlib压缩，规则的区间压缩后每个只占几个字节。
+"""
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import heapify, heappop, heappush
+from itertools import accumulate, chain
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+LOAD = 512  # 每块的目标区间数
+FORMAT_VERSION = 1  # to_bytes()编码格式的版本号（第一个字节）
+
+
+class RangeSet:
+    """互不相交的半开区间集合，加入时与重叠或相邻的区间合并
+
+    不是线程安全的，多个线程共用时由调用方加锁（见DownloadTask.ranges_lock）。
+    """
+
+    def __init__(self, ranges: Iterable[Tuple[int, int]] = ()):
+        self._starts: List[List[int]] = []  # 各块的区间起点
+        self._ends: List[List[int]] = []    # 各块的区间终点（不含）
+        self._maxes: List[int] = []         # 各块最后一个区间的终点
+        self._count = 0
+        self._covered = 0
+        self._gaps: List[Tuple[int, int, int]] = []  # 内部空洞(-长度, 起点, 终点)，可能含已失效的项
+        for start, end in ranges:
+            self.add(start, end)
+
+    def __len__(self) -> int:
+        """区间数"""
+        return self._count
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        for starts, ends in zip(self._starts, self._ends):
+            yield from zip(starts, ends)
+
+    def __contains__(self, offset: int) -> bool:
+        return self.contiguous_from(offset) > 0
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, RangeSet):
+            return NotImplemented
+        return self._count == other._count and self._covered == other._covered and list(self) == list(other)
+
+    def __repr__(self) -> str:
+        head = ", ".join(f"[{s}, {e})" for s, e in self.ranges(limit=4))
+        more = f", …共{self._count}个" if self._count > 4 else ""
+        return f"RangeSet({head}{more})"
+
+    @property
+    def covered(self) -> int:
+        """覆盖的字节数"""
+        return self._covered
+
+    def copy(self) -> "RangeSet":
+        result = RangeSet()
+        result._starts = [list(block) for block in self._starts]
+        result._ends = [list(block) for block in self._ends]
+        result._maxes = list(self._maxes)
+        result._count = self._count
+        result._covered = self._covered
+        result._gaps = list(self._gaps)
+        return result
+
+    def clear(self) -> None:
+        self._starts, self._ends, self._maxes, self._gaps = [], [], [], []
+        self._count = self._covered = 0
+
+    # 修改
+
+    def add(self, start: int, end: int) -> None:
+        """加入[start, end)，与重叠或相邻的区间合并"""
+        if start >= end:
+            return
+        lo = self._locate(start)
+        first = self._get(lo)
+        if first is None or first[0] > end:
+            self._splice(lo, lo, [(start, end)])  # 不与任何区间相接
+            return
+        if first[0] <= start and first[1] >= end:
+            return  # 已经包含
+        b, i = lo
+        starts, ends = self._starts[b], self._ends[b]
+        if i + 1 < len(starts):
+            after = starts[i + 1]
+        else:
+            after = self._starts[b + 1][0] if b + 1 < len(self._starts) else None
+        if after is None or after > end:
+            # 只与一个区间相接（顺序下载时的常见情况）：原地扩展
+            old_start, old_end = first
+            start, end = min(start, old_start), max(end, old_end)
+            starts[i], ends[i] = start, end
+            if i + 1 == len(ends):
+                self._maxes[b] = end
+            self._covered += (end - start) - (old_end - old_start)
+            if start < old_start:
+                before = ends[i - 1] if i > 0 else (self._ends[b - 1][-1] if b > 0 else None)
+                if before is not None:
+                    heappush(self._gaps, (before - start, before, start))
+            if end > old_end and after is not None:
+                heappush(self._gaps, (end - after, end, after))
+            if len(self._gaps) > 2 * self._count + 64:
+                self._rebuild_gaps()
+            return
+        b, i = self._locate(end)
+        last = self._get((b, i))
+        if last is not None and last[0] <= end:
+            hi = (b, i + 1)
+            end = last[1]
+        else:
+            hi = (b, i)
+        self._splice(lo, hi, [(min(start, first[0]), end)])
+
+    def remove(self, start: int, end: int) -> None:
+        """去掉[start, end)，跨过边界的区间被截断或拆成两段"""
+        if start >= end:
+            return
+        lo = self._locate(start, right=True)
+        first = self._get(lo)
+        if first is None or first[0] >= end:
+            return  # 没有重叠
+        b, i = self._locate(end)
+        last = self._get((b, i))
+        pieces = []
+        if first[0] < start:
+            pieces.append((first[0], start))
+        if last is not None and last[0] < end:
+            hi = (b, i + 1)
+            if last[1] > end:
+                pieces.append((end, last[1]))
+        else:
+            hi = (b, i)
+        self._splice(lo, hi, pieces)
+
+    def update(self, ranges: Iterable[Tuple[int, int]]) -> None:
+        """加入多个区间（如合并另一个来源的RangeSet）"""
+        for start, end in ranges:
+            self.add(start, end)
+
+    # 查询
+
+    def contiguous_from(self, offset: int) -> int:
+        """从offset开始连续覆盖的字节数，offset不在集合中时为0"""
+        found = self._get(self._locate(offset, right=True))
+        if found is None or found[0] > offset:
+            return 0
+        return found[1] - offset
+
+    def covers(self, start: int, end: int) -> bool:
+        """[start, end)是否全部在集合中"""
+        return start >= end or self.contiguous_from(start) >= end - start
+
+    def ranges(self, start: int = 0, end: int = None, limit: int = None) -> List[Tuple[int, int]]:
+        """与[start, end)重叠的区间（截到边界内），最多limit个"""
+        result = []
+        for s, e in self._iter_from(self._locate(start, right=True)):
+            if (end is not None and s >= end) or (limit is not None and len(result) >= limit):
+                break
+            result.append((max(s, start), e if end is None else min(e, end)))
+        return result
+
+    def covered_in(self, start: int, end: int) -> int:
+        """[start, end)中覆盖的字节数"""
+        return sum(e - s for s, e in self.ranges(start, end))
+
+    def gaps(self, start: int, end: int, limit: int = None) -> List[Tuple[int, int]]:
+        """[start, end)中不在集合中的区间，最多limit个"""
+        result = []
+        position = start
+        for s, e in self._iter_from(self._locate(start, right=True)):
+            if s >= end or (limit is not None and len(result) >= limit):
+                break
+            if s > position:
+                result.append((position, s))
+            position = max(position, e)
+        if position < end and (limit is None or len(result) < limit):
+            result.append((position, end))
+        return result
+
+    def largest_gap(self, size: int = None) -> Optional[Tuple[int, int]]:
+        """最大的空洞（包括开头0之前的部分，给出size时还包括末尾到size的部分），没有时返回None
+
+        长度相同时返回靠前的一个。
+        """
+        if not self._count:
+            return (0, size) if size else None
+        best = None
+        gaps = self._gaps
+        while gaps:
+            _, start, end = gaps[0]
+            if self._is_gap(start, end):
+                best = (start, end)
+                break
+            heappop(gaps)
+        # 开头的空洞在最前面，长度相同时优先；末尾的空洞在最后面，长度更大时才选
+        head = self._starts[0][0]
+        if head > 0 and (best is None or head >= best[1] - best[0]):
+            best = (0, head)
+        tail = self._maxes[-1]
+        if size is not None and size > tail and (best is None or size - tail > best[1] - best[0]):
+            best = (tail, size)
+        return best
+
+    # 序列化
+
+    def to_bytes(self) -> bytes:
+        """紧凑编码：版本号 + zlib压缩的端点差值（64位无符号小端整数）"""
+        points = list(chain.from_iterable(zip(chain.from_iterable(self._starts), chain.from_iterable(self._ends))))
+        deltas = array("Q", [b - a for a, b in zip(chain((0,), points), points)])
+        if sys.byteorder == "big":
+            deltas.byteswap()
+        return bytes([FORMAT_VERSION]) + zlib.compress(deltas.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "RangeSet":
+        """从to_bytes()的结果恢复，数据无效时抛出ValueError"""
+        if not data or data[0] != FORMAT_VERSION:
+            raise ValueError("不支持的区间集合格式")
+        try:
+            raw = zlib.decompress(data[1:])
+        except zlib.error as e:
+            raise ValueError(f"区间集合数据损坏：{e}")
+        deltas = array("Q")
+        if len(raw) % deltas.itemsize or len(raw) // deltas.itemsize % 2:
+            raise ValueError("区间集合数据长度不正确")
+        deltas.frombytes(raw)
+        if sys.byteorder == "big":
+            deltas.byteswap()
+        # 除第一个起点外，端点必须严格递增（区间非空且不相邻）
+        if deltas[1:].count(0):
+            raise ValueError("区间集合数据中有空区间或相邻区间")
+        points = list(accumulate(deltas))
+        result = cls()
+        result._load(points[0::2], points[1::2])
+        return result
+
+    # 内部实现
+
+    def _load(self, starts: List[int], ends: List[int]) -> None:
+        """用已排序、互不相邻的区间重建"""
+        self._starts = [starts[i:i + LOAD] for i in range(0, len(starts), LOAD)]
+        self._ends = [ends[i:i + LOAD] for i in range(0, len(ends), LOAD)]
+        self._maxes = [block[-1] for block in self._ends]
+        self._count = len(starts)
+        self._covered = sum(ends) - sum(starts)
+        self._rebuild_gaps()
+
+    def _locate(self, x: int, right: bool = False) -> Tuple[int, int]:
+        """第一个终点>=x（right为True时>x）的区间的位置(块, 块内序号)，没有时为(块数, 0)"""
+        find = bisect_right if right else bisect_left
+        b = find(self._maxes, x)
+        if b == len(self._maxes):
+            return b, 0
+        return b, find(self._ends[b], x)
+
+    def _get(self, position: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        b, i = position
+        if b < len(self._starts) and i < len(self._starts[b]):
+            return self._starts[b][i], self._ends[b][i]
+        return None
+
+    def _iter_from(self, position: Tuple[int, int]) -> Iterator[Tuple[int, int]]:
+        b, i = position
+        if b < len(self._starts):
+            yield from zip(self._starts[b][i:], self._ends[b][i:])
+        for b in range(b + 1, len(self._starts)):
+            yield from zip(self._starts[b], self._ends[b])
+
+    def _is_gap(self, start: int, end: int) -> bool:
+        """[start, end)是否正好是两个相邻区间之间的空洞"""
+        b, i = self._locate(start)
+        if self._get((b, i)) is None or self._ends[b][i] != start:
+            return False
+        if i + 1 < len(self._starts[b]):
+            return self._starts[b][i + 1] == end
+        return b + 1 < len(self._starts) and self._starts[b + 1][0] == end
+
+    def _splice(self, lo: Tuple[int, int], hi: Tuple[int, int], pieces: List[Tuple[int, int]]) -> None:
+        """把位置lo到hi（不含）之间的区间替换为pieces，并记录两侧新的空洞"""
+        if not self._starts:
+            if pieces:
+                self._load([s for s, _ in pieces], [e for _, e in pieces])
+            return
+        last = len(self._starts) - 1
+        (b1, i1), (b2, i2) = [(last, len(self._starts[last])) if b > last else (b, i) for b, i in (lo, hi)]
+
+        # 两侧相邻区间的终点和起点不受替换影响，先记下来
+        if i1 > 0:
+            before = self._ends[b1][i1 - 1]
+        else:
+            before = self._ends[b1 - 1][-1] if b1 > 0 else None
+        if i2 < len(self._starts[b2]):
+            after = self._starts[b2][i2]
+        else:
+            after = self._starts[b2 + 1][0] if b2 < last else None
+
+        starts = [s for s, _ in pieces]
+        ends = [e for _, e in pieces]
+        if b1 == b2:
+            removed_starts, removed_ends = self._starts[b1][i1:i2], self._ends[b1][i1:i2]
+            self._starts[b1][i1:i2] = starts
+            self._ends[b1][i1:i2] = ends
+            self._fix(b1)
+        else:
+            removed_starts = self._starts[b1][i1:] + list(chain.from_iterable(self._starts[b1 + 1:b2])) + \
+                self._starts[b2][:i2]
+            removed_ends = self._ends[b1][i1:] + list(chain.from_iterable(self._ends[b1 + 1:b2])) + \
+                self._ends[b2][:i2]
+            del self._starts[b2][:i2], self._ends[b2][:i2]
+            self._starts[b1][i1:] = starts
+            self._ends[b1][i1:] = ends
+            del self._starts[b1 + 1:b2], self._ends[b1 + 1:b2], self._maxes[b1 + 1:b2]
+            self._fix(b1 + 1)
+            self._fix(b1)
+        self._count += len(pieces) - len(removed_starts)
+        self._covered += sum(ends) - sum(starts) - (sum(removed_ends) - sum(removed_starts))
+
+        points = [before] + list(chain.from_iterable(pieces)) + [after]
+        for k in range(0, len(points), 2):
+            start, end = points[k], points[k + 1]
+            if start is not None and end is not None:
+                heappush(self._gaps, (start - end, start, end))
+        if len(self._gaps) > 2 * self._count + 64:
+            self._rebuild_gaps()
+
+    def _fix(self, b: int) -> None:
+        """替换后整理第b块：删除空块，拆分过大的块，合并过小的块，更新块索引"""
+        starts, ends = self._starts[b], self._ends[b]
+        if not starts:
+            del self._starts[b], self._ends[b], self._maxes[b]
+            return
+        if len(starts) > 2 * LOAD:
+            self._starts.insert(b + 1, starts[LOAD:])
+            self._ends.insert(b + 1, ends[LOAD:])
+            self._maxes.insert(b + 1, ends[-1])
+            del starts[LOAD:], ends[LOAD:]
+        elif len(starts) < LOAD // 4 and b + 1 < len(self._starts) and \
+                len(starts) + len(self._starts[b + 1]) <= 2 * LOAD:
+            starts.extend(self._starts[b + 1])
+            ends.extend(self._ends[b + 1])
+            del self._starts[b + 1], self._ends[b + 1], self._maxes[b + 1]
+        self._maxes[b] = ends[-1]
+
+    def _rebuild_gaps(self) -> None:
+        """丢掉堆中失效的项，按当前区间重建"""
+        starts = chain.from_iterable(self._starts)
+        next(starts, None)
+        self._gaps = [(end - start, end, start) for end, start in zip(chain.from_iterable(self._ends), starts)]
+        heapify(self._gaps)
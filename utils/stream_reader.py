@@ -0,0 +1,109 @@
+import io
+import os
+import time
+
+
+class StreamReader(io.RawIOBase):
+    """边下边读的文件对象
+
+    只返回已经连续写入磁盘的数据，读到尚未下载的位置时阻塞等待。
+    读取和seek的位置会反馈给任务，流式模式下据此决定优先下载哪些分片。
+    下载完成后自动改为读取最终文件。
+    """
+
+    def __init__(self, task, part_path: str, timeout: float = None, poll_interval: float = 0.05):
+        super().__init__()
+        self.task = task
+        self.part_path = part_path
+        self.timeout = timeout  # 等待数据的超时时间（秒），None表示一直等待
+        self.poll_interval = poll_interval
+        self.position = 0
+        self._final_file = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self._wait_total_size() + offset
+        else:
+            raise ValueError(f"无效的whence：{whence}")
+        if position < 0:
+            raise ValueError("seek位置不能为负数")
+        self.position = position
+        self.task.stream_position = position
+        return position
+
+    def _wait_total_size(self) -> int:
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while self.task.total_size <= 0:
+            self._check_failed()
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError("等待文件信息超时")
+            time.sleep(self.poll_interval)
+        return self.task.total_size
+
+    def _check_failed(self):
+        if self.task.status == "错误":
+            raise IOError(f"下载失败：{self.task.error_msg}")
+
+    def _read_final(self, b) -> int:
+        """下载完成后从最终文件读取"""
+        if self._final_file is None:
+            self._final_file = open(self.task.save_path, 'rb')
+        self._final_file.seek(self.position)
+        n = self._final_file.readinto(b)
+        self.position += n
+        return n
+
+    def readinto(self, b) -> int:
+        if self.closed:
+            raise ValueError("文件已关闭")
+        if len(b) == 0:
+            return 0
+
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while True:
+            self._check_failed()
+            if self.task.status == "已完成":
+                return self._read_final(b)
+
+            total = self.task.total_size
+            if total > 0 and self.position >= total:
+                return 0
+
+            available = self.task.contiguous_from(self.position) if total > 0 else 0
+            if available > 0:
+                # 持有merge_lock，避免读取过程中.part文件被重命名
+                with self.task.merge_lock:
+                    if os.path.exists(self.part_path):
+                        with open(self.part_path, 'rb') as f:
+                            f.seek(self.position)
+                            view = memoryview(b)[:min(len(b), available)]
+                            n = f.readinto(view)
+                        self.position += n
+                        self.task.stream_position = self.position
+                        return n
+                # .part文件已被重命名，等任务完成后从最终文件读取
+                time.sleep(self.poll_interval)
+                continue
+
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError("等待数据超时")
+            time.sleep(self.poll_interval)
+
+    def close(self):
+        if self._final_file is not None:
+            self._final_file.close()
+            self._final_file = None
+        super().close()
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from utils.network import ProbeResult, filename_from_headers, probe_url
+
+MANIFEST_NAME = ".sync_manifest.json"  # 保存在同步目录中的清单文件
+
+
+@dataclass
+class ManifestEntry:
+    """清单中记录的一个已同步文件"""
+    url: str
+    etag: str = ""
+    last_modified: str = ""
+    size: int = 0
+    synced_at: float = 0.0
+
+
+class SyncManifest:
+    """同步清单：记录每个文件上次下载时服务器返回的ETag、Last-Modified和大小"""
+
+    def __init__(self, save_dir: str):
+        self.path = os.path.join(save_dir, MANIFEST_NAME)
+        self.entries: Dict[str, ManifestEntry] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = {name: ManifestEntry(**entry) for name, entry in data.items()}
+        except FileNotFoundError:
+            self.entries = {}
+        except (ValueError, TypeError) as e:
+            print(f"同步清单损坏，将重新检查所有文件：{str(e)}")
+            self.entries = {}
+
+    def get(self, filename: str) -> Optional[ManifestEntry]:
+        with self._lock:
+            return self.entries.get(filename)
+
+    def update(self, filename: str, url: str, etag: str, last_modified: str, size: int) -> None:
+        with self._lock:
+            self.entries[filename] = ManifestEntry(url, etag, last_modified, size, time.time())
+
+    def save(self) -> None:
+        """先写临时文件再重命名，避免中途退出损坏清单"""
+        with self._lock:
+            data = {name: asdict(entry) for name, entry in self.entries.items()}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+@dataclass
+class SyncItem:
+    """一个URL的同步检查结果"""
+    url: str
+    filename: str
+    save_path: str
+    action: str = "new"  # new / changed / unchanged / failed / duplicate（文件名与前面的URL重复，不同步）
+    probe: Optional[ProbeResult] = None
+    error: str = ""
+
+
+@dataclass
+class SyncSummary:
+    """一次同步的结果汇总（文件名列表）"""
+    save_dir: str
+    new: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    errors: Dict[str, str] = field(default_factory=dict)  # 失败项 -> 原因
+
+    def fail(self, name: str, reason: str = "") -> None:
+        self.failed.append(name)
+        if reason:
+            self.errors[name] = reason
+
+    def text(self) -> str:
+        lines = [f"同步目录：{self.save_dir}",
+                 f"新增 {len(self.new)}，更新 {len(self.changed)}，"
+                 f"未变化 {len(self.unchanged)}，失败 {len(self.failed)}"]
+        for title, names in (("新增", self.new), ("更新", self.changed), ("失败", self.failed)):
+            if names:
+                shown = names[:20]
+                more = f" 等{len(names)}个" if len(names) > len(shown) else ""
+                lines.append(f"{title}：{'、'.join(shown)}{more}")
+        for name in self.failed[:20]:
+            if name in self.errors:
+                lines.append(f"  {name}：{self.errors[name]}")
+        return "\n".join(lines)
+
+
+def sync_filename(url: str) -> str:
+    """同步模式下的文件名，URL没有文件名时用URL的哈希，保证每次运行得到相同的名字"""
+    filename = filename_from_headers(url, {})
+    if not filename:
+        filename = 'download_' + hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]
+    return filename
+
+
+def _remote_not_newer(last_modified: str, local_mtime: float) -> bool:
+    """服务器的Last-Modified不晚于本地文件的修改时间"""
+    try:
+        return parsedate_to_datetime(last_modified).timestamp() <= local_mtime
+    except (TypeError, ValueError):
+        return False
+
+
+def check_item(item: SyncItem, manifest: SyncManifest, proxies: Optional[Dict[str, str]] = None) -> SyncItem:
+    """用条件HEAD请求判断本地文件是否需要重新下载"""
+    if not os.path.exists(item.save_path):
+        item.action = "new"
+        return item
+
+    local_size = os.path.getsize(item.save_path)
+    entry = manifest.get(item.filename)
+    if entry is not None and entry.url != item.url:
+        entry = None  # 同名文件来自其他URL，清单记录不可用
+
+    headers = {}
+    if entry is not None and entry.size == local_size:
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+    try:
+        probe = probe_url(item.url, proxies, headers=headers)
+    except Exception as e:
+        item.action = "failed"
+        item.error = str(e)
+        return item
+    item.probe = probe
+
+    if probe.status_code == 304:
+        item.action = "unchanged"
+    elif probe.total_size and probe.total_size != local_size:
+        item.action = "changed"
+    elif entry is not None and entry.size == local_size:
+        # 服务器忽略了条件请求时自己比较校验信息
+        if probe.etag or entry.etag:
+            same = probe.etag == entry.etag
+        else:
+            same = bool(probe.last_modified) and probe.last_modified == entry.last_modified
+        item.action = "unchanged" if same else "changed"
+    else:
+        # 没有清单记录（首次同步已有的目录）：大小相同且服务器文件不比本地新时认为未变化
+        same = bool(probe.total_size) and _remote_not_newer(probe.last_modified, os.path.getmtime(item.save_path))
+        item.action = "unchanged" if same else "changed"
+
+    if item.action == "unchanged" and entry is None:
+        manifest.update(item.filename, item.url, probe.etag, probe.last_modified, local_size)
+    return item
+
+
+def plan_sync(urls: List[str], save_dir: str, manifest: SyncManifest,
+              proxies: Optional[Dict[str, str]] = None, workers: int = 16) -> List[SyncItem]:
+    """并行检查所有URL，返回每个URL的同步动作
+
+    重复的URL只检查一次；不同URL得到相同文件名时只同步第一个，其余为duplicate，在汇总中记为失败。
+    """
+    items = []
+    conflicts = []
+    seen: Dict[str, str] = {}  # 文件名 -> URL
+    for url in urls:
+        filename = sync_filename(url)
+        if filename in seen:
+            if seen[filename] != url:
+                print(f"同步跳过重复的文件名：{filename}（{url}）")
+                conflicts.append(SyncItem(url, filename, os.path.join(save_dir, filename), action="duplicate",
+                                          error=f"文件名{filename}与{seen[filename]}重复"))
+            continue
+        seen[filename] = url
+        items.append(SyncItem(url, filename, os.path.join(save_dir, filename)))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items)))) as executor:
+        return list(executor.map(lambda item: check_item(item, manifest, proxies), items)) + conflicts
+
+
+class SyncBatch:
+    """一次同步：记录需要下载的任务，全部结束后更新清单并生成汇总"""
+
+    def __init__(self, save_dir: str, manifest: SyncManifest, items: List[SyncItem]):
+        self.manifest = manifest
+        self.summary = SyncSummary(save_dir)
+        self.pending: Dict[str, SyncItem] = {}  # 任务ID -> 同步项
+        for item in items:
+            if item.action == "unchanged":
+                self.summary.unchanged.append(item.filename)
+            elif item.action == "failed":
+                self.summary.fail(item.filename, item.error)
+                print(f"同步检查失败：{item.url}：{item.error}")
+            elif item.action == "duplicate":
+                # 同一个文件名对应多个URL，用URL标识
+                self.summary.fail(item.url, item.error)
+
+    def add_task(self, task_id: str, item: SyncItem) -> None:
+        self.pending[task_id] = item
+
+    def task_finished(self, task_id: str, task, status: str) -> bool:
+        """任务结束（已完成、错误或已取消）时调用，返回True表示整个同步已经结束"""
+        item = self.pending.pop(task_id, None)
+        if item is None:
+            return False
+        if status == "已完成":
+            getattr(self.summary, item.action).append(item.filename)
+            self.manifest.update(item.filename, item.url, task.etag, task.last_modified,
+                                 os.path.getsize(item.save_path))
+        else:
+            # 取消的任务没有错误信息，以状态作为原因
+            self.summary.fail(item.filename, getattr(task, "error_msg", "") or status)
+        return self.done()
+
+    def done(self) -> bool:
+        if self.pending:
+            return False
+        self.manifest.save()
+        return True
+
+
+class SyncWorker(QThread):
+    """在后台线程中并行检查URL列表，避免阻塞界面"""
+    planned = pyqtSignal(object)  # SyncBatch和同步项列表：(SyncBatch, List[SyncItem])
+
+    def __init__(self, urls: List[str], save_dir: str, proxies: Optional[Dict[str, str]] = None):
+        super().__init__()
+        self.urls = urls
+        self.save_dir = save_dir
+        self.proxies = proxies
+
+    def run(self):
+        manifest = SyncManifest(self.save_dir)
+        items = plan_sync(self.urls, self.save_dir, manifest, self.proxies)
+        self.planned.emit((SyncBatch(self.save_dir, manifest, items), items))
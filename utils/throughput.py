@@ -0,0 +1,162 @@
+"""传输速度和剩余时间估计
+
+每个分片的DownloadChunk.received只由下载它的线程累加、只增不减（重试时丢弃后重新下载的
+字节也计入，它们确实占用了带宽），汇总时不需要加锁。DownloadWorker每个汇总周期（100毫秒）
+把任务的累计字节数交给TransferMeter，TransferMeter按任务、主机和全局分别做指数加权平均
+（EWMA），并用剩余字节数估计剩余时间。结果是不可变的RateSnapshot，界面和统计接口
+随时读取，不需要加锁。
+"""
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+IDLE_GAP = 1.0  # 超过这么久没有采样（暂停、排队、收尾）的任务，再次采样时重新开始计算增量
+
+
+@dataclass(frozen=True)
+class RateSnapshot:
+    """某一时刻的速度估计"""
+    received: int = 0              # 累计收到的字节数
+    rate: float = 0.0              # 字节/秒（EWMA）
+    remaining: int = 0             # 剩余字节数（大小未知的任务不计入）
+    eta: Optional[float] = None    # 预计剩余秒数，速度为0或大小未知时为None
+    active: bool = False           # 本周期是否在传输
+
+
+class RateEstimator:
+    """指数加权平均速度，时间常数为tau秒
+
+    采样间隔不固定，权重按1-exp(-dt/tau)计算；开始时按已累计的权重修正偏差，
+    第一秒的估计不会因为从0开始而偏低。
+    """
+
+    def __init__(self, tau: float = 3.0):
+        self.tau = tau
+        self.rate = 0.0
+        self._weight = 0.0  # 已累计的权重，用于修正初始偏差
+        self._total: Optional[int] = None
+        self._time = 0.0
+
+    def update(self, total: int, now: float) -> float:
+        """total为累计字节数，返回修正后的速度（字节/秒）"""
+        if self._total is None or now - self._time > IDLE_GAP or total < self._total:
+            # 第一次采样、暂停后继续或计数被重置：只记录基准，保留之前的速度估计
+            self._total, self._time = total, now
+            return self.value
+        dt = now - self._time
+        if dt <= 0:
+            return self.value
+        alpha = 1.0 - math.exp(-dt / self.tau)
+        self.rate += alpha * ((total - self._total) / dt - self.rate)
+        self._weight += alpha * (1.0 - self._weight)
+        self._total, self._time = total, now
+        return self.value
+
+    @property
+    def value(self) -> float:
+        return self.rate / self._weight if self._weight > 0 else 0.0
+
+
+def _eta(remaining: int, rate: float) -> Optional[float]:
+    return remaining / rate if remaining > 0 and rate >= 1.0 else (0.0 if remaining <= 0 else None)
+
+
+class TransferMeter:
+    """按任务、主机和全局汇总传输速度
+
+    sample()和tick()只在界面线程中调用；task()、host()、total()、snapshot()可以在任意线程中调用。
+    """
+
+    def __init__(self, tau: float = 3.0):
+        self.tau = tau
+        self._tasks: Dict[str, RateEstimator] = {}
+        self._task_hosts: Dict[str, str] = {}
+        self._task_received: Dict[str, int] = {}  # 上次采样时任务的累计字节数
+        self._task_remaining: Dict[str, int] = {}
+        self._sampled: set = set()  # 本周期采样过的任务
+        self._hosts: Dict[str, RateEstimator] = {}
+        self._host_received: Dict[str, int] = {}  # 各主机只增不减的累计字节数
+        self._global = RateEstimator(tau)
+        self._global_received = 0
+        # 发布给读取者的快照，每次整体替换
+        self._task_snapshots: Dict[str, RateSnapshot] = {}
+        self._host_snapshots: Dict[str, RateSnapshot] = {}
+        self._total_snapshot = RateSnapshot()
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return (urlparse(url).netloc or "").lower()
+
+    def sample(self, task_id: str, url: str, received: int, done: int, total_size: int,
+               now: float = None) -> RateSnapshot:
+        """记录任务的累计收到字节数和已完成字节数（传输阶段每个汇总周期调用一次）"""
+        now = time.time() if now is None else now
+        estimator = self._tasks.get(task_id)
+        if estimator is None:
+            estimator = self._tasks[task_id] = RateEstimator(self.tau)
+            self._task_hosts[task_id] = self.host_of(url)
+        host = self._task_hosts[task_id]
+        # 分片列表被替换（压缩试下载后重新切分等）时累计值可能变小，这时只更新基准
+        delta = max(0, received - self._task_received.get(task_id, received))
+        self._task_received[task_id] = received
+        self._host_received[host] = self._host_received.get(host, 0) + delta
+        self._global_received += delta
+
+        rate = estimator.update(received, now)
+        remaining = max(0, total_size - done) if total_size > 0 else 0
+        self._task_remaining[task_id] = remaining
+        self._sampled.add(task_id)
+        snapshot = RateSnapshot(received, rate, remaining, _eta(remaining, rate) if total_size > 0 else None, True)
+        self._task_snapshots[task_id] = snapshot
+        return snapshot
+
+    def tick(self, now: float = None) -> None:
+        """所有任务采样后调用：没有采样的任务速度记为0，更新主机和全局的估计"""
+        now = time.time() if now is None else now
+        for task_id, snapshot in list(self._task_snapshots.items()):
+            if task_id not in self._sampled and snapshot.active:
+                self._task_snapshots[task_id] = RateSnapshot(snapshot.received, 0.0, snapshot.remaining, None, False)
+
+        remaining: Dict[str, int] = {}
+        for task_id in self._sampled:
+            host = self._task_hosts[task_id]
+            remaining[host] = remaining.get(host, 0) + self._task_remaining.get(task_id, 0)
+        hosts = {}
+        for host, received in self._host_received.items():
+            estimator = self._hosts.get(host)
+            if estimator is None:
+                estimator = self._hosts[host] = RateEstimator(self.tau)
+            rate = estimator.update(received, now)
+            left = remaining.get(host, 0)
+            active = host in remaining
+            hosts[host] = RateSnapshot(received, rate, left, _eta(left, rate) if active else None, active)
+        self._host_snapshots = hosts
+        rate = self._global.update(self._global_received, now)
+        left = sum(remaining.values())
+        active = bool(self._sampled)
+        self._total_snapshot = RateSnapshot(self._global_received, rate, left, _eta(left, rate) if active else None,
+                                            active)
+        self._sampled = set()
+
+    def remove(self, task_id: str) -> None:
+        """任务结束后不再统计（已计入主机和全局的字节数保留）"""
+        for d in (self._tasks, self._task_hosts, self._task_received, self._task_remaining):
+            d.pop(task_id, None)
+        self._task_snapshots.pop(task_id, None)
+        self._sampled.discard(task_id)
+
+    def task(self, task_id: str) -> RateSnapshot:
+        return self._task_snapshots.get(task_id) or RateSnapshot()
+
+    def host(self, host: str) -> RateSnapshot:
+        return self._host_snapshots.get(host) or RateSnapshot()
+
+    def total(self) -> RateSnapshot:
+        return self._total_snapshot
+
+    def snapshot(self) -> Dict[str, object]:
+        """所有任务、主机和全局的速度估计"""
+        return {"total": self._total_snapshot, "hosts": dict(self._host_snapshots),
+                "tasks": dict(self._task_snapshots)}